@@ -0,0 +1,1708 @@
+# bench.py - micro benchmarks for the hot paths in main.py
+# Usage: python bench.py [name ...]   (tanpa argumen = jalankan semua)
+# shared_state butuh: pip install redis "fakeredis[lua]"   (tanpa [lua] fakeredis menolak script match: "unknown command 'script'")
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Optional
+
+from telegram.error import RetryAfter
+
+import main
+from fake_bot_api import FakeBotAPI
+
+# benches start and stop the app in-process; keep them away from a real restart checkpoint
+main.CHECKPOINT_PATH = ""
+
+
+def _reset_state():
+    main.users.clear()
+    main.chat_logs.clear()
+    main.search_pool = main.MatchEngine()
+    main.user_filters.clear()
+    main.timers = main.TimerHeap()
+    main.search_started.clear()
+    main.pair_activity.clear()
+    main.stats = main.Stats()
+    main.outbox = main.Outbox()
+    main.bulk = main.BulkNotifier()
+    main.analytics = main.Analytics()
+    main.moderation = main.ModerationFilter("")
+    main.moderation_flags.clear()
+    main.digest_new = 0
+    main.pending_verifications.__init__()
+    for index in main.user_index.values():
+        index.__init__()
+
+
+def _populate(n_users: int, searching_ratio: float = 0.01):
+    """Fill users with n_users verified users, a fraction of them searching."""
+    _reset_state()
+    for uid in range(1, n_users + 1):
+        main.ensure_user(uid)
+        main.update_user(uid, verified=True)
+        if random.random() < searching_ratio:
+            main.set_searching(uid, True)
+
+
+# ---------------------------
+# Matchmaking: latency per "find" tap vs registered users
+# ---------------------------
+def bench_matchmaking(sizes=(1_000, 10_000, 100_000, 1_000_000), taps=20_000):
+    print("== matchmaking (match_user) ==")
+    for n in sizes:
+        _populate(n)
+        tappers = random.sample(range(1, n + 1), min(taps, n))
+        start = time.perf_counter()
+        for uid in tappers:
+            u = main.users[uid]
+            if u.partner or u.searching:
+                continue
+            main.match_user(uid)
+        elapsed = time.perf_counter() - start
+        print(f"users={n:>9,}  pool={len(main.search_pool):>7,}  {elapsed / len(tappers) * 1e6:8.2f} us/tap")
+        assert not main.check_stats(), main.check_stats()
+
+
+# ---------------------------
+# Memory: slotted User record vs the old seven-key dict
+# ---------------------------
+def bench_user_memory(n_users=200_000):
+    print("== user record memory ==")
+
+    def old_layout(i):
+        return {"verified": True, "partner": None, "university": "UNNES", "gender": "Perempuan",
+                "age": 18 + i % 8, "searching": False, "banned": False}
+
+    def new_layout(i):
+        return main.User(verified=True, university=main.University.UNNES, gender=main.Gender.FEMALE, age=18 + i % 8)
+
+    for label, make in (("dict", old_layout), ("User", new_layout)):
+        tracemalloc.start()
+        records = {uid: make(uid) for uid in range(n_users)}
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        start = time.perf_counter()
+        if label == "dict":
+            hits = sum(1 for u in records.values() if u.get("verified") and not u.get("banned"))
+        else:
+            hits = sum(1 for u in records.values() if u.verified and not u.banned)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<5} {current / n_users:7.1f} B/user  {current / 2**20:7.1f} MiB total  "
+              f"scan {elapsed / n_users * 1e9:5.1f} ns/user ({hits})")
+        del records
+
+
+# ---------------------------
+# Matching simulation: preference buckets + widening, virtual time
+# ---------------------------
+def _random_prefs(u, rng: random.Random) -> "main.SearchPrefs":
+    prefs = main.DEFAULT_PREFS
+    if rng.random() < 0.5:  # Cari Doi: opposite gender
+        prefs = main.replace(prefs, partner_gender=main.Gender.FEMALE if u.gender == main.Gender.MALE else main.Gender.MALE)
+    if rng.random() < 0.3:
+        low = rng.randint(main.AGE_MIN, main.AGE_MAX - 3)
+        prefs = main.replace(prefs, age_min=low, age_max=low + rng.randint(2, 3))
+    if rng.random() < 0.2:
+        prefs = main.replace(prefs, university=u.university)
+    return prefs
+
+
+def bench_matching_sim(arrivals_per_s=0.05, duration_s=86_400, patience_s=300, widen_after=30.0):
+    print("== matching simulation (virtual time) ==")
+    for widen in (False, True):
+        _reset_state()
+        engine = main.search_pool
+        rng = random.Random(42)
+        enqueued = {}  # user_id -> arrival time, in arrival order
+        waits = []
+        matched = abandoned = 0
+        cost = 0.0
+        now = 0.0
+        next_tick = main.MATCH_WIDEN_INTERVAL
+        uid = 0
+        while now < duration_s:
+            now += rng.expovariate(arrivals_per_s)
+            uid += 1
+            main.users[uid] = u = main.User(
+                verified=True, gender=rng.choice(list(main.Gender)),
+                university=rng.choice(list(main.University)), age=rng.randint(main.AGE_MIN, main.AGE_MAX),
+            )
+            prefs = _random_prefs(u, rng)
+            start = time.perf_counter()
+            partner = engine.find_partner(uid, prefs, "fifo")
+            cost += time.perf_counter() - start
+            if partner:
+                matched += 2
+                waits += [0.0, now - enqueued.pop(partner)]
+            else:
+                engine.add(uid, prefs, now)
+                enqueued[uid] = now
+            while now >= next_tick:
+                # users give up after patience_s
+                while enqueued:
+                    oldest = next(iter(enqueued))
+                    if enqueued[oldest] > next_tick - patience_s:
+                        break
+                    engine.discard(oldest)
+                    del enqueued[oldest]
+                    abandoned += 1
+                if widen:
+                    for waiting in engine.expired(widen_after, next_tick):
+                        if waiting not in engine:
+                            continue
+                        partner = engine.widen(waiting, next_tick)
+                        if partner:
+                            matched += 2
+                            waits += [next_tick - enqueued.pop(waiting), next_tick - enqueued.pop(partner)]
+                next_tick += main.MATCH_WIDEN_INTERVAL
+        waits.sort()
+        print(f"widening={'on ' if widen else 'off'}  users={uid:,}  match rate={matched / uid:6.1%}  "
+              f"abandoned={abandoned:,}  wait p50={_percentile(waits, 50):5.1f}s  p90={_percentile(waits, 90):5.1f}s  "
+              f"p99={_percentile(waits, 99):5.1f}s  find={cost / uid * 1e6:.1f} us")
+
+
+# ---------------------------
+# Fake Telegram objects (cukup untuk memanggil handler langsung)
+# ---------------------------
+class FakeBot:
+    """In-process stand-in for the Bot API with optional latency and 429 injection."""
+
+    def __init__(self, latency: float = 0.0, flood_ratio: float = 0.0, retry_after: int = 1):
+        self.sent = 0
+        self.latency = latency
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+        self.flood_errors = 0
+        self.received = {}  # chat_id -> list of texts, in delivery order
+
+    async def send_message(self, chat_id=None, text=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_ratio and random.random() < self.flood_ratio:
+            self.flood_errors += 1
+            raise RetryAfter(self.retry_after)
+        self.sent += 1
+        self.received.setdefault(chat_id, []).append(text)
+
+    async def copy_message(self, chat_id=None, from_chat_id=None, message_id=None, **kwargs):
+        self.sent += 1
+        self.received.setdefault(chat_id, []).append(("copy", from_chat_id, message_id))
+
+    async def send_media_group(self, chat_id=None, media=None, **kwargs):
+        self.sent += 1
+        self.received.setdefault(chat_id, []).append(("album", [m.media for m in media]))
+
+
+def fake_context(bot=None):
+    return SimpleNamespace(bot=bot or FakeBot(), args=[])
+
+
+def fake_text_update(user_id: int, text: str):
+    async def reply_text(*args, **kwargs):
+        return None
+
+    message = SimpleNamespace(text=text, reply_text=reply_text)
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message, callback_query=None)
+
+
+def fake_media_update(user_id: int, message_id: int, kind: str, media_group_id=None, caption=None):
+    """Message carrying one piece of media by file_id, shaped like telegram.Message for relay_message."""
+    fields = {attr: None for attr, _ in main.MEDIA_LABELS}
+    fields["photo"] = ()
+    file = SimpleNamespace(file_id=f"file-{user_id}-{message_id}", emoji="😀")
+    fields[kind] = (file,) if kind == "photo" else file
+    message = SimpleNamespace(text=None, message_id=message_id, media_group_id=media_group_id,
+                              caption=caption, caption_entities=(), **fields)
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message, callback_query=None)
+
+
+def fake_callback_update(user_id: int, data: str, latency: float = 0.0):
+    async def noop(*args, **kwargs):
+        if latency:
+            await asyncio.sleep(random.random() * latency)
+        return None
+
+    query = SimpleNamespace(data=data, from_user=SimpleNamespace(id=user_id), message=None,
+                            answer=noop, edit_message_text=noop)
+    return SimpleNamespace(effective_user=query.from_user, message=None, callback_query=query)
+
+
+def _pair_users(n_pairs: int):
+    for i in range(n_pairs):
+        a, b = 2 * i + 1, 2 * i + 2
+        main.ensure_user(a)
+        main.ensure_user(b)
+        main.users[a].partner = b
+        main.users[b].partner = a
+
+
+# ---------------------------
+# Relay throughput: persistence off vs on (SQLite write-behind)
+# ---------------------------
+def bench_relay_persistence(n_pairs=1_000, messages=100_000):
+    print("== relay_message throughput ==")
+    context = fake_context()
+    updates = [fake_text_update(random.randint(1, 2 * n_pairs), f"pesan {i}") for i in range(messages)]
+
+    async def run():
+        for update in updates:
+            await main.relay_message(update, context)
+
+    for label in ("off", "on"):
+        _reset_state()
+        tmpdir = None
+        if label == "on":
+            tmpdir = tempfile.TemporaryDirectory()
+            main.init_storage(os.path.join(tmpdir.name, "bench.db"))
+        _pair_users(n_pairs)
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        print(f"persistence={label:<3}  {messages / elapsed:>10,.0f} msg/s")
+        if main.storage:
+            start = time.perf_counter()
+            main.storage.close()
+            print(f"               final flush {time.perf_counter() - start:.3f}s")
+            main.storage = None
+            tmpdir.cleanup()
+
+
+# ---------------------------
+# Outbox load test: relays under 429 injection, no drops, order kept
+# ---------------------------
+def bench_outbox(n_pairs=500, messages_per_user=20, flood_ratio=0.02):
+    print("== outbox under flood control ==")
+    _reset_state()
+    _pair_users(n_pairs)
+    bot = FakeBot(latency=0.002, flood_ratio=flood_ratio)
+    context = fake_context(bot)
+    # the fake API has no real limits; keep the buckets wide so the run is short
+    main.outbox = main.Outbox(global_rate=5_000, chat_rate=100, chat_burst=20, workers=64)
+    senders = list(range(1, 2 * n_pairs + 1))
+
+    async def run():
+        main.outbox.start(bot)
+        for i in range(messages_per_user):
+            for uid in senders:
+                await main.relay_message(fake_text_update(uid, f"{uid}:{i}"), context)
+        await main.outbox.stop(timeout=600)
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    expected = len(senders) * messages_per_user
+    in_order = all(
+        [int(t.split(":")[1]) for t in texts] == list(range(messages_per_user))
+        for texts in bot.received.values()
+    )
+    m = main.outbox.metrics()
+    print(f"relays={expected:,}  delivered={bot.sent:,}  dropped={expected - bot.sent}  "
+          f"429s={bot.flood_errors}  in_order={in_order}  {elapsed:.2f}s")
+    print(f"queue latency avg={m['latency_avg'] * 1000:.1f} ms  max={m['latency_max'] * 1000:.1f} ms")
+
+
+# ---------------------------
+# Concurrency: many users tapping "Find" at once must never double-match
+# ---------------------------
+def bench_find_stress(n_users=5_000, taps_per_user=3, rounds=5):
+    print("== concurrent Find taps (PerUserUpdateProcessor) ==")
+    for r in range(rounds):
+        _populate(n_users, searching_ratio=0)
+        processor = main.PerUserUpdateProcessor(256)
+        context = fake_context()
+        updates = [fake_callback_update(uid, "find", latency=0.002)
+                   for uid in range(1, n_users + 1) for _ in range(taps_per_user)]
+        random.shuffle(updates)
+
+        async def run():
+            await asyncio.gather(*(processor.process_update(u, main.button_handler(u, context)) for u in updates))
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        paired = {uid: u.partner for uid, u in main.users.items() if u.partner}
+        asymmetric = sum(1 for uid, partner in paired.items() if paired.get(partner) != uid)
+        self_matched = sum(1 for uid, partner in paired.items() if uid == partner)
+        both = sum(1 for uid in paired if uid in main.search_pool)
+        ok = not (asymmetric or self_matched or both or main.check_stats())
+        print(f"round {r + 1}: taps={len(updates):,}  pairs={len(paired) // 2:,}  waiting={len(main.search_pool)}  "
+              f"asymmetric={asymmetric}  self={self_matched}  paired+searching={both}  ok={ok}  {elapsed:.2f}s")
+
+
+# ---------------------------
+# Admin fan-out: registration burst, per-user messages vs digest
+# ---------------------------
+def bench_admin_fanout(registrations=300, admins=5, api_latency=0.02):
+    print("== admin notifications for a registration burst ==")
+    saved = (main.ADMIN_IDS, main.VERIFY_DIGEST_INTERVAL)
+    main.ADMIN_IDS = [900_000 + i for i in range(admins)]
+    for interval in (0, 0.2):
+        _reset_state()
+        main.pending_verifications.__init__()
+        main.VERIFY_DIGEST_INTERVAL = interval
+        bot = FakeBot(latency=api_latency)
+        main.outbox = main.Outbox(global_rate=1_000, chat_rate=1_000, chat_burst=1_000, workers=32)
+        context = fake_context(bot)
+
+        async def run():
+            await main.on_startup(SimpleNamespace(bot=bot))
+            start = time.perf_counter()
+            for uid in range(1, registrations + 1):
+                main.ensure_user(uid)
+                main.update_user(uid, university=main.University.UNNES, gender=main.Gender.MALE, age=20)
+                await main.request_admin_verification(uid, context)
+            handler_time = time.perf_counter() - start
+            await asyncio.sleep(max(interval * 2, 0.05))
+            await main.on_shutdown(None)
+            return handler_time, time.perf_counter() - start
+
+        handler_time, total = asyncio.run(run())
+        mode = f"digest {interval}s" if interval else "per-user"
+        print(f"{mode:<12} handler {handler_time / registrations * 1e6:6.1f} us/registration  "
+              f"admin messages={bot.sent:,}  drained in {total:.2f}s")
+    main.ADMIN_IDS, main.VERIFY_DIGEST_INTERVAL = saved
+
+
+# ---------------------------
+# Reaper: tick cost depends on expired entries, not on live pairs
+# ---------------------------
+def bench_reaper(sizes=(10_000, 100_000, 1_000_000)):
+    print("== reaper tick (timer heap) ==")
+    for n in sizes:
+        _reset_state()
+        _populate(n, searching_ratio=0)
+
+        async def run():
+            for uid in range(1, n, 2):
+                main.pair_users(uid, uid + 1)
+            now = time.monotonic()
+            start = time.perf_counter()
+            for _ in range(1_000):
+                main.reap_expired(now)
+            idle_tick = (time.perf_counter() - start) / 1_000
+            start = time.perf_counter()
+            reaped = main.reap_expired(now + main.PAIR_IDLE_TTL + 1)
+            return idle_tick, reaped, time.perf_counter() - start
+
+        idle_tick, reaped, full = asyncio.run(run())
+        print(f"pairs={n // 2:>8,}  idle tick {idle_tick * 1e6:6.2f} us  "
+              f"all expired: {reaped:,} users in {full:.2f}s ({full / max(reaped, 1) * 1e6:.1f} us/user)")
+
+
+# ---------------------------
+# Admin panel: paged list render vs registered users
+# ---------------------------
+def bench_admin_lists(sizes=(1_000, 100_000, 1_000_000), clicks=2_000):
+    print("== admin_panel_handler (paged) ==")
+    admin_id = main.ADMIN_IDS[0]
+    context = fake_context()
+    for n in sizes:
+        _populate(n, searching_ratio=0)
+        updates = [fake_callback_update(admin_id, f"list_verified:{random.randrange(n // main.ADMIN_PAGE_SIZE)}")
+                   for _ in range(clicks)]
+
+        async def run():
+            for update in updates:
+                await main.admin_panel_handler(update, context)
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        print(f"users={n:>9,}  {elapsed / clicks * 1e6:8.2f} us/click")
+
+
+# ---------------------------
+# Update delivery: polling vs webhook against the local fake Bot API
+# Replays BENCH_RECORDING (JSONL of Update dicts) or a synthetic /myid stream
+# ---------------------------
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _chat_of(update: dict) -> int:
+    if "callback_query" in update:
+        return update["callback_query"]["from"]["id"]
+    return update["message"]["chat"]["id"]
+
+
+def message_update(uid: int, message_id: int, text: str) -> dict:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"},
+        "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+def callback_update(uid: int, callback_id: str, data: str) -> dict:
+    return {"callback_query": {
+        "id": callback_id,
+        "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"},
+        "chat_instance": "bench",
+        "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "text": "menu"},
+    }}
+
+
+def synthetic_updates(n: int, text: str = "/myid") -> list:
+    return [message_update(100_000 + i, i + 1, text) for i in range(n)]
+
+
+async def replay(mode: str, updates: list, rate: float = 200.0) -> list:
+    """Run the real handlers in polling or webhook mode; return inject-to-reply latencies."""
+    api = FakeBotAPI()
+    await api.start()
+    app = main.build_application("123456:BENCH", base_url=api.base_url)
+    pending = defaultdict(deque)  # chat_id -> inject times
+    latencies = []
+
+    def on_call(method, params):
+        chat_id = params.get("chat_id")
+        if chat_id is not None and pending.get(int(chat_id)):
+            latencies.append(time.monotonic() - pending[int(chat_id)].popleft())
+
+    api.listeners.append(on_call)
+    async with app:
+        await app.start()
+        await main.on_startup(app)  # post_init only runs under run_polling/run_webhook
+        if mode == "webhook":
+            port = _free_port()
+            await app.updater.start_webhook(
+                listen="127.0.0.1", port=port, url_path="hook",
+                webhook_url=f"http://127.0.0.1:{port}/hook", secret_token="bench",
+            )
+        else:
+            await app.updater.start_polling(poll_interval=0.0, timeout=10)
+
+        for update in updates:
+            pending[_chat_of(update)].append(time.monotonic())
+            await api.inject(update)
+            await asyncio.sleep(1 / rate)
+        deadline = time.monotonic() + 30
+        while any(pending.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        await app.updater.stop()
+        await main.on_shutdown(app)
+        await app.stop()
+    await api.stop()
+    return latencies
+
+
+def bench_update_modes(n_updates=2_000, rate=200.0):
+    print("== polling vs webhook (inject -> first reply) ==")
+    recording = os.getenv("BENCH_RECORDING")
+    if recording:
+        with open(recording) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic_updates(n_updates)
+    for mode in ("polling", "webhook"):
+        _reset_state()
+        latencies = sorted(asyncio.run(replay(mode, updates, rate)))
+        print(f"{mode:<8} replied={len(latencies):,}/{len(updates):,}  "
+              f"p50={_percentile(latencies, 50) * 1000:6.2f} ms  p99={_percentile(latencies, 99) * 1000:6.2f} ms")
+
+
+# ---------------------------
+# Scenario load test: simulated users through the real app + fake Bot API
+# ---------------------------
+class ScenarioRun:
+    """
+    Closed-loop driver: each simulated user sends one update, waits for the
+    bot's first visible reaction (seen on the fake API), then continues.
+    Reactions: answerCallbackQuery for buttons, the relayed text reaching
+    the partner for chat messages, anything sent to the user's chat for
+    commands (may be an unrelated notification, so that latency is a lower bound).
+    """
+
+    def __init__(self, api: FakeBotAPI, think: float = 0.0, timeout: float = 10.0):
+        self.api = api
+        self.think = think  # mean pause before each step (0 = as fast as the bot answers)
+        self.timeout = timeout
+        self.waiting = {}  # ("cb", id) | ("chat", chat_id) | ("text", text) -> future
+        self.events = defaultdict(dict)  # uid -> {"paired": Event, "left": Event}
+        self.latencies = defaultdict(list)  # step kind -> seconds
+        self.timeouts = defaultdict(int)
+        self.updates = 0
+        self._next_id = 0
+        api.listeners.append(self._on_call)
+
+    def _event(self, uid: int, name: str) -> asyncio.Event:
+        event = self.events[uid].get(name)
+        if event is None:
+            event = self.events[uid][name] = asyncio.Event()
+        return event
+
+    def _resolve(self, key):
+        future = self.waiting.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(time.monotonic())
+
+    def _on_call(self, method: str, params: dict):
+        if method == "answerCallbackQuery":
+            self._resolve(("cb", str(params.get("callback_query_id"))))
+            return
+        chat_id = params.get("chat_id")
+        if chat_id is None:
+            return
+        chat_id = int(chat_id)
+        text = params.get("text") or ""
+        self._resolve(("text", text))
+        self._resolve(("chat", chat_id))
+        if text.startswith("💬 Partner ditemukan"):
+            self._event(chat_id, "paired").set()
+        elif text.startswith("❌ Partner keluar") or text.startswith("⌛ Percakapan diakhiri"):
+            self._event(chat_id, "left").set()
+
+    async def step(self, kind: str, update: dict, *keys):
+        """Inject update and wait until any of keys is observed; record latency under kind."""
+        if self.think:
+            await asyncio.sleep(random.random() * 2 * self.think)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        for key in keys:
+            self.waiting[key] = future
+        start = time.monotonic()
+        self.updates += 1
+        await self.api.inject(update)
+        try:
+            done_at = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            self.latencies[kind].append(done_at - start)
+        except asyncio.TimeoutError:
+            self.timeouts[kind] += 1
+        finally:
+            for key in keys:
+                if self.waiting.get(key) is future:
+                    del self.waiting[key]
+
+    def _ids(self, uid: int) -> tuple:
+        self._next_id += 1
+        return self._next_id, f"cb{self._next_id}"
+
+    async def send(self, kind: str, uid: int, text: str, expect_text: Optional[str] = None):
+        message_id, _ = self._ids(uid)
+        keys = [("chat", uid)] + ([("text", expect_text)] if expect_text else [])
+        await self.step(kind, message_update(uid, message_id, text), *keys)
+
+    async def press(self, kind: str, uid: int, data: str):
+        _, callback_id = self._ids(uid)
+        await self.step(kind, callback_update(uid, callback_id, data), ("cb", callback_id))
+
+
+async def simulate_user(run: ScenarioRun, uid: int, admin_id: int, rng: random.Random, sessions: int = 2,
+                        messages: int = 5, report_ratio: float = 0.1):
+    """One user's life: register, get approved, then search / chat / maybe report / stop a few times."""
+    await run.send("start", uid, "/start")
+    await run.press("university", uid, rng.choice(["unnes", "nonunnes"]))
+    await run.press("gender", uid, rng.choice(["male", "female"]))
+    await run.send("age", uid, str(rng.randint(18, 25)))
+    await run.press("approve", admin_id, f"approve_{uid}")
+    for session in range(sessions):
+        paired, left = run._event(uid, "paired"), run._event(uid, "left")
+        paired.clear()
+        left.clear()
+        await run.press("find", uid, "find")
+        try:
+            await asyncio.wait_for(paired.wait(), 2.0 + 4 * run.think)
+        except asyncio.TimeoutError:
+            await run.send("stop", uid, "/stop")  # nobody came; give up this round
+            continue
+        for i in range(messages):
+            if left.is_set():
+                break
+            text = f"m{uid}-{session}-{i}"
+            await run.send("chat", uid, text, expect_text=text)
+        if not left.is_set() and rng.random() < report_ratio:
+            await run.send("report", uid, "/report")
+        await run.send("stop", uid, "/stop")
+
+
+async def run_scenario(n_users: int, think: float = 0.0, latency: float = 0.0, flood_ratio: float = 0.0,
+                       seed: int = 7) -> dict:
+    api = FakeBotAPI(latency=latency, flood_ratio=flood_ratio)
+    await api.start()
+    app = main.build_application("123456:BENCH", base_url=api.base_url)
+    run = ScenarioRun(api, think)
+    before = {labels: list(h.counts) for (name, labels), h in main.metrics.histograms.items()
+              if name == "bot_handler_seconds"}
+    errors_before = dict(main.metrics.counters)
+    rng = random.Random(seed)
+    async with app:
+        await app.start()
+        await main.on_startup(app)
+        await app.updater.start_polling(poll_interval=0.0, timeout=10)
+        start = time.monotonic()
+        await asyncio.gather(*(
+            simulate_user(run, 200_000 + i, main.ADMIN_IDS[i % len(main.ADMIN_IDS)], random.Random(rng.random()))
+            for i in range(n_users)
+        ))
+        elapsed = time.monotonic() - start
+        await app.updater.stop()
+        await main.on_shutdown(app)
+        await app.stop()
+    await api.stop()
+    handlers = {}
+    for (name, labels), h in main.metrics.histograms.items():
+        if name == "bot_handler_seconds":
+            window = h.since(before.get(labels, [0] * len(h.counts)))
+            if window.count:
+                handlers[labels.split('"')[1]] = window
+    errors = {labels.split('"')[1]: value - errors_before.get((name, labels), 0)
+              for (name, labels), value in main.metrics.counters.items() if name == "bot_handler_errors_total"}
+    return {"run": run, "elapsed": elapsed, "handlers": handlers, "errors": errors, "api_calls": len(api.calls),
+            "flood_errors": api.flood_errors}
+
+
+def bench_scenario(runs=((200, 0.0), (100, 1.0)), latency=0.002, flood_ratio=0.0):
+    """
+    Offline end-to-end load test: (users, mean think time) per run. Think 0
+    measures capacity (updates/s at saturation), think 1s the latency of a
+    paced load. Set BENCH_FLOOD=0.02 to answer 2% of sends with 429.
+    """
+    flood_ratio = float(os.getenv("BENCH_FLOOD", flood_ratio))
+    saved = (main.ADMIN_IDS, main.METRICS_PORT, main.METRICS_LOG_INTERVAL)
+    main.ADMIN_IDS = [900_000 + i for i in range(5)]
+    main.METRICS_PORT, main.METRICS_LOG_INTERVAL = 0, 0
+    try:
+        for n_users, think in runs:
+            print(f"== scenario: {n_users} users, think {think:.1f}s: register -> approve -> find -> chat -> "
+                  f"report -> stop ==")
+            _reset_state()
+            main.outbox = main.Outbox(global_rate=5_000, chat_rate=100, chat_burst=20, workers=64)
+            result = asyncio.run(run_scenario(n_users, think, latency, flood_ratio))
+            _print_scenario(result)
+    finally:
+        main.ADMIN_IDS, main.METRICS_PORT, main.METRICS_LOG_INTERVAL = saved
+
+
+def _print_scenario(result: dict):
+    run = result["run"]
+    print(f"updates={run.updates:,}  {run.updates / result['elapsed']:,.0f} updates/s  "
+          f"api_calls={result['api_calls']:,}  429s={result['flood_errors']}  {result['elapsed']:.1f}s")
+    print("step         n      p50 ms   p95 ms   p99 ms  timeouts")
+    for kind, values in run.latencies.items():
+        values.sort()
+        print(f"{kind:<10} {len(values):>5}  {_percentile(values, 50) * 1000:7.2f}  "
+              f"{_percentile(values, 95) * 1000:7.2f}  {_percentile(values, 99) * 1000:7.2f}  {run.timeouts[kind]:>5}")
+    print("handler                n   p50 ms   p99 ms  errors  (bucket upper bounds)")
+    for name, h in sorted(result["handlers"].items()):
+        print(f"{name:<20} {h.count:>5}  {h.quantile(0.5) * 1000:7.2f}  {h.quantile(0.99) * 1000:7.2f}  "
+              f"{result['errors'].get(name, 0):>5}")
+
+
+# ---------------------------
+# Shared state (Redis): atomic matching across worker processes
+# ---------------------------
+def _redis_client(url: str):
+    import redis
+
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+def _shared_worker(url: str, worker: int, workers: int, n_users: int, duration: float, barrier, results):
+    """One bot worker: owns the users with uid % workers == worker (like a load balancer would route them)."""
+    _reset_state()
+    main.init_shared_state(_redis_client(url))
+    mine = [uid for uid in range(1, n_users + 1) if uid % workers == worker]
+    rng = random.Random(worker)
+    ops = 0
+    barrier.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        uid = rng.choice(mine)
+        u = main.get_user(uid)
+        if u.partner:
+            if rng.random() < 0.3:
+                main.unpair_users(uid, u.partner)
+            else:
+                main.save_chat(uid, u.partner, f"pesan {ops}")
+        elif not u.searching:
+            main.match_user(uid, _random_prefs(u, rng) if rng.random() < 0.2 else main.DEFAULT_PREFS)
+        ops += 1
+    results.put(ops)
+
+
+def _check_shared(client, n_users: int) -> dict:
+    """Every partner link symmetric, nobody paired and queued at once, pool index consistent."""
+    pipe = client.pipeline(transaction=False)
+    for uid in range(1, n_users + 1):
+        pipe.hget(f"user:{uid}", "partner")
+    partners = {uid: int(p) for uid, p in zip(range(1, n_users + 1), pipe.execute()) if p}
+    waiting = {int(uid) for uid in client.hkeys("pool:where")}
+    in_buckets = set()
+    for name in client.smembers("pool:buckets"):
+        in_buckets |= {int(uid) for uid in client.zrange(f"pool:b:{name}", 0, -1)}
+    return {
+        "pairs": len(partners) // 2,
+        "waiting": len(waiting),
+        "asymmetric": sum(1 for uid, p in partners.items() if partners.get(p) != uid),
+        "self": sum(1 for uid, p in partners.items() if uid == p),
+        "paired+searching": len(waiting & partners.keys()),
+        "index_mismatch": len(waiting ^ in_buckets),
+    }
+
+
+def _assert_shared(check: dict, label: str):
+    """A broken invariant is a matching bug, not a number to read past."""
+    broken = {k: check[k] for k in ("asymmetric", "self", "paired+searching", "index_mismatch") if check[k]}
+    assert not broken, f"{label}: shared state broken: {broken}"
+
+
+def bench_shared_state(n_users=2_000, worker_users=400, duration=3.0, worker_counts=(1, 2, 4)):
+    """Set REDIS_URL to bench a real server; otherwise a fakeredis TCP server runs in-process."""
+    import multiprocessing
+
+    print("== shared state (Redis backend) ==")
+    # fakeredis[lua]: lupa runs the match/unpair scripts
+    missing = [name for name in ("redis", "fakeredis", "lupa") if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f'ERROR {", ".join(missing)} belum terpasang: pip install redis "fakeredis[lua]"')
+        return
+    import fakeredis
+    # in-process correctness pass against fakeredis, memory engine as reference
+
+    for label in ("memory", "redis"):
+        _reset_state()
+        client = fakeredis.FakeRedis(decode_responses=True)
+        if label == "redis":
+            main.init_shared_state(client)
+        rng = random.Random(1)
+        for uid in range(1, n_users + 1):
+            main.ensure_user(uid)
+            main.update_user(uid, verified=True, gender=rng.choice(list(main.Gender)),
+                             university=rng.choice(list(main.University)), age=rng.randint(18, 25))
+        start = time.perf_counter()
+        for _ in range(20_000):
+            uid = rng.randint(1, n_users)
+            u = main.get_user(uid)
+            if u.partner:
+                main.unpair_users(uid, u.partner)
+            elif not u.searching:
+                main.match_user(uid, _random_prefs(u, rng))
+        elapsed = time.perf_counter() - start
+        paired = sum(1 for uid in range(1, n_users + 1) if main.get_user(uid).partner)
+        assert not main.check_stats(), main.check_stats()
+        if label == "redis":
+            _assert_shared(_check_shared(client, n_users), "in-process")
+        print(f"{label:<6} 20,000 ops  {elapsed / 20_000 * 1e6:7.1f} us/op  paired={paired:,}  "
+              f"waiting={len(main.search_pool):,}  invariants ok")
+    main.storage = None
+
+    url = os.getenv("REDIS_URL")
+    server = None
+    if not url:
+        import threading
+
+        server = fakeredis.TcpFakeServer(("127.0.0.1", _free_port()))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "redis://%s:%d/0" % server.server_address
+    # with the in-process fakeredis server ops/s measure that server, not how the bot scales: set REDIS_URL
+    print(f"server={'fakeredis (in-process)' if server else url}  cpus={os.cpu_count()}")
+    for workers in worker_counts:
+        client = _redis_client(url)
+        client.flushdb()
+        _reset_state()
+        main.init_shared_state(client)
+        for uid in range(1, worker_users + 1):
+            main.ensure_user(uid)
+            main.update_user(uid, verified=True, gender=random.choice(list(main.Gender)),
+                             university=random.choice(list(main.University)), age=random.randint(18, 25))
+        main.storage = None
+        barrier = multiprocessing.Barrier(workers)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_shared_worker,
+                                         args=(url, w, workers, worker_users, duration, barrier, results))
+                 for w in range(workers)]
+        for proc in procs:
+            proc.start()
+        total = sum(results.get() for _ in procs)
+        for proc in procs:
+            proc.join()
+        check = _check_shared(client, worker_users)
+        _assert_shared(check, f"workers={workers}")
+        print(f"workers={workers}  {total / duration:>9,.0f} ops/s  " +
+              "  ".join(f"{k}={v:,}" for k, v in check.items()))
+    if server:
+        server.shutdown()
+
+
+# ---------------------------
+# Metrics: per-update overhead of timed() + cost of a scrape
+# ---------------------------
+def bench_metrics_overhead(n_pairs=1_000, messages=200_000):
+    print("== metrics overhead (relay_message) ==")
+    context = fake_context()
+    updates = [fake_text_update(random.randint(1, 2 * n_pairs), f"pesan {i}") for i in range(messages)]
+    results = {}
+    for label, handler in (("plain", main.relay_message), ("timed", main.timed(main.relay_message))):
+        _reset_state()
+        _pair_users(n_pairs)
+
+        async def run():
+            for update in updates:
+                await handler(update, context)
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        results[label] = (time.perf_counter() - start) / messages
+        print(f"{label:<6} {results[label] * 1e6:6.2f} us/update")
+    print(f"overhead {(results['timed'] - results['plain']) * 1e6:+.2f} us/update")
+    for name in ("start", "profil", "stop", "button_handler", "admin_action_handler"):
+        main.timed(getattr(main, name))  # a realistic number of series
+    start = time.perf_counter()
+    for _ in range(100):
+        text = main.metrics.render()
+    print(f"scrape: {len(text.splitlines())} lines, {(time.perf_counter() - start) / 100 * 1000:.2f} ms/render")
+    print(json.dumps(main.metrics_log_line()))
+
+
+# ---------------------------
+# Media relay: copy_message / file_id, albums batched into one send
+# ---------------------------
+def bench_media_relay(n_pairs=500, messages=20_000, album_ratio=0.2):
+    print("== media relay ==")
+    _reset_state()
+    _pair_users(n_pairs)
+    bot = FakeBot()
+    context = fake_context(bot)
+    main.outbox = main.Outbox(global_rate=1_000_000, chat_rate=1_000_000, chat_burst=1_000, workers=64)
+    main.ALBUM_WAIT = 0.05
+    rng = random.Random(3)
+    kinds = ["photo", "video", "sticker", "voice", "document", "animation", "video_note"]
+    updates = []
+    albums = 0
+    message_id = 0
+    while len(updates) < messages:
+        uid = rng.randint(1, 2 * n_pairs)
+        if rng.random() < album_ratio:
+            albums += 1
+            for _ in range(rng.randint(2, 10)):
+                message_id += 1
+                updates.append(fake_media_update(uid, message_id, rng.choice(["photo", "video"]),
+                                                 media_group_id=f"g{albums}", caption="x" * rng.randint(0, 1000)))
+        else:
+            message_id += 1
+            if rng.random() < 0.5:
+                updates.append(fake_text_update(uid, f"pesan {message_id}"))
+            else:
+                updates.append(fake_media_update(uid, message_id, rng.choice(kinds), caption="y" * rng.randint(0, 1000)))
+
+    async def run():
+        main.outbox.start(bot)
+        start = time.perf_counter()
+        for update in updates:
+            await main.relay_message(update, context)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(main.ALBUM_WAIT * 2)
+        await main.outbox.stop(timeout=60)
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    deliveries = [d for received in bot.received.values() for d in received]
+    album_sends = sum(1 for d in deliveries if isinstance(d, tuple) and d[0] == "album")
+    longest = max(len(entry[1]) for ring in main.chat_logs.values() for entry in ring.view())
+    print(f"updates={len(updates):,}  api_calls={bot.sent:,}  albums={albums:,} -> {album_sends:,} sends  "
+          f"{elapsed / len(updates) * 1e6:.1f} us/update")
+    print(f"longest chat log entry={longest} chars  (captions up to 1,000 chars, media never downloaded)")
+
+
+# ---------------------------
+# Render cache: main menu keyboard + profile text
+# ---------------------------
+def _menu_uncached():
+    """The pre-cache menu path: datetime.now() check and a fresh keyboard on every call."""
+    now = main.datetime.now()
+    keyboard = [
+        [main.InlineKeyboardButton("🔍 Find", callback_data="find")],
+        [main.InlineKeyboardButton("✏️ Ubah Profil", callback_data="ubah_profil")],
+        [main.InlineKeyboardButton("👤 Profil", callback_data="profil")],
+    ]
+    if (now.weekday() == 5 and now.hour >= 18) or now.weekday() == 6:
+        keyboard.insert(1, [main.InlineKeyboardButton("💘 Cari Doi", callback_data="cari_doi")])
+    return main.InlineKeyboardMarkup(keyboard)
+
+
+def bench_render_cache(calls=100_000):
+    print("== menu / profile rendering ==")
+    # window transitions agree with the old per-call check over two weeks, minute by minute
+    window = main.CariDoiWindow()
+    t = main.datetime(2026, 1, 1).timestamp()
+    for minute in range(14 * 24 * 60):
+        now = t + minute * 60
+        d = main.datetime.fromtimestamp(now)
+        assert window.is_open(now) == ((d.weekday() == 5 and d.hour >= 18) or d.weekday() == 6), d
+
+    for label, build in (("uncached", _menu_uncached),
+                         ("cached", lambda: main.MENU_MARKUPS[main.cari_doi_window.is_open()])):
+        start = time.perf_counter()
+        for _ in range(calls):
+            build()
+        print(f"menu markup {label:<9} {(time.perf_counter() - start) / calls * 1e6:6.2f} us")
+
+    _reset_state()
+    main.ensure_user(1)
+    main.update_user(1, verified=True, university=main.University.UNNES, gender=main.Gender.FEMALE, age=21)
+    update = fake_text_update(1, "/profil")
+    context = fake_context()
+
+    async def run(clear: bool):
+        for _ in range(calls):
+            if clear:
+                main.profile_cache.clear()
+            await main.profil(update, context)
+
+    for label, clear in (("miss", True), ("hit", False)):
+        start = time.perf_counter()
+        asyncio.run(run(clear))
+        print(f"/profil render {label:<6} {(time.perf_counter() - start) / calls * 1e6:6.2f} us")
+    main.update_user(1, age=22)
+    assert "Usia: 22" in main.profile_details(1, main.users[1]), "stale profile after update"
+
+
+# ---------------------------
+# Event log: recovery time for 1M events, full replay vs snapshot + tail
+# ---------------------------
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def bench_event_recovery(n_users=50_000, n_events=1_000_000, snapshot_every=100_000):
+    print("== event log recovery ==")
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as full_dir, tempfile.TemporaryDirectory() as snap_dir:
+        # 1) drive the real mutators, journaling without snapshots
+        _reset_state()
+        main.event_log = main.EventLog(full_dir, ({}, {}), 0, snapshot_every=n_events * 10)
+        start = time.perf_counter()
+        for uid in range(1, n_users + 1):
+            main.ensure_user(uid)
+            main.update_user(uid, university=rng.choice(list(main.University)),
+                             gender=rng.choice(list(main.Gender)), age=rng.randint(18, 25))
+            main.update_user(uid, verified=True)
+        while main.event_log.seq < n_events:
+            uid = rng.randint(1, n_users)
+            u = main.users[uid]
+            if u.partner:
+                main.unpair_users(uid, u.partner)
+            elif u.searching:
+                main.set_searching(uid, False)
+            elif u.banned:
+                main.update_user(uid, banned=False)
+            elif rng.random() < 0.01:
+                main.update_user(uid, banned=True, searching=False)
+            else:
+                main.match_user(uid)
+        generated = time.perf_counter() - start
+        main.event_log.close()
+        events = main.event_log.seq
+        live = ({uid: u.partner for uid, u in main.users.items() if u.partner}, set(main.search_pool))
+        main.event_log = None
+        print(f"generated {events} events via mutators in {generated:.1f}s "
+              f"({generated / events * 1e6:.2f} us/event incl. journaling), log {_dir_size(full_dir) / 1e6:.1f} MB")
+
+        # 2) the same stream through a log that snapshots every snapshot_every events
+        stream = []
+        for _, file_path in main.EventLog.segments(full_dir):
+            with open(file_path, encoding="utf-8") as f:
+                for line in f:
+                    _, _, kind, uid, arg, _ = line.rstrip("\n").split("\t")
+                    stream.append((kind, int(uid), arg))
+        # worst case for recovery: crash just before the next snapshot is due
+        tail = snapshot_every - 1
+        log = main.EventLog(snap_dir, ({}, {}), 0, snapshot_every=snapshot_every)
+        start = time.perf_counter()
+        for kind, uid, arg in stream[:-tail]:
+            log.append(kind, uid, arg)
+        log.snapshot()
+        log.snapshot_every = n_events * 10
+        for kind, uid, arg in stream[-tail:]:
+            log.append(kind, uid, arg)
+        appended = time.perf_counter() - start
+        log.close()
+        # on one CPU the writer thread's formatting and shadow-state updates land in this window too
+        print(f"append + writer {appended / len(stream) * 1e6:.2f} us/event, "
+              f"snapshots every {snapshot_every}, all written in {time.perf_counter() - start:.1f}s, "
+              f"{len(main.EventLog.segments(snap_dir))} segments, "
+              f"snapshot {os.path.getsize(os.path.join(snap_dir, main.EventLog.SNAPSHOT)) / 1e6:.1f} MB")
+
+        # 3) recovery, best of 3
+        results = {}
+        for label, path in (("full replay", full_dir), ("snapshot + tail", snap_dir)):
+            best = None
+            for _ in range(3):
+                _reset_state()
+                start = time.perf_counter()
+                state, seq, replayed = main.EventLog.load(path)
+                loaded = time.perf_counter() - start
+                main.restore_state(state)
+                total = time.perf_counter() - start
+                if best is None or total < best[1]:
+                    best = (loaded, total, replayed)
+            results[label] = state
+            recovered = ({uid: u.partner for uid, u in main.users.items() if u.partner}, set(main.search_pool))
+            assert seq == events and recovered == live, f"{label}: recovered state differs from the live one"
+            assert not main.check_stats(), main.check_stats()
+            print(f"{label:<16} replayed {best[2]:>8} events  load {best[0] * 1000:7.1f} ms  "
+                  f"load+restore {best[1] * 1000:7.1f} ms  ({len(main.users)} users, "
+                  f"{len(recovered[0]) // 2} pairs, {len(recovered[1])} searching)")
+        assert results["full replay"] == results["snapshot + tail"], "snapshot recovery differs from full replay"
+    _reset_state()
+
+
+# ---------------------------
+# Hot restart: SIGTERM a real bot process, start a new one, time restart-to-ready
+# ---------------------------
+async def _spawn_bot(env: dict):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(main.__file__), env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+
+
+async def _read_until(proc, marker: str, timeout: float = 60.0) -> list:
+    """Lines printed by proc up to and including the first one containing marker."""
+    lines = []
+    while True:
+        line = (await asyncio.wait_for(proc.stdout.readline(), timeout)).decode().rstrip()
+        if not line and proc.stdout.at_eof():
+            raise RuntimeError(f"bot exited before {marker!r}: {lines}")
+        lines.append(line)
+        if marker in line:
+            return lines
+
+
+async def _wait_for(predicate, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+async def _restart(n_users: int, n_pairs: int, n_searching: int, drain_timeout: float) -> dict:
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bot.db")
+        store = main.Storage(db_path)
+        for uid in range(1, n_users + 1):
+            store.save_user(uid, main.User(verified=True, university=main.University.UNNES, age=20,
+                                           gender=main.Gender.FEMALE if uid % 2 == 0 else main.Gender.MALE))
+        store.close()
+
+        api = FakeBotAPI()
+        await api.start()
+        answered = []
+        relayed = defaultdict(list)
+        api.listeners.append(lambda method, params: answered.append(1) if method == "answerCallbackQuery" else None)
+        api.listeners.append(lambda method, params: relayed[int(params["chat_id"])].append(params.get("text"))
+                             if method == "sendMessage" else None)
+        env = dict(os.environ, BOT_TOKEN="123456:BENCH", BOT_API_URL=api.base_url, DB_PATH=db_path,
+                   CHECKPOINT_PATH=os.path.join(tmp, "checkpoint.bin"), METRICS_PORT="0",
+                   METRICS_LOG_INTERVAL="0", VERIFY_DIGEST_INTERVAL="0", PYTHONUNBUFFERED="1",
+                   SHUTDOWN_DRAIN_TIMEOUT=str(drain_timeout),
+                   PYTHONIOENCODING="utf-8")
+
+        proc = await _spawn_bot(env)
+        await _read_until(proc, "Siap dalam")
+        # pairs among 1..2*n_pairs; odd (male) users after them wait via cari_doi, so they never match each other
+        paired = list(range(1, 2 * n_pairs + 1))
+        waiting = list(range(2 * n_pairs + 1, 2 * n_pairs + 2 * n_searching, 2))
+        for group, data in ((paired, "find"), (waiting, "cari_doi")):
+            for uid in group:
+                await api.inject(callback_update(uid, f"{data}{uid}", data))
+            await _wait_for(lambda: len(answered) == len(paired) + (len(waiting) if group is waiting else 0))
+
+        start = time.monotonic()
+        proc.send_signal(15)  # SIGTERM, what Heroku sends on a dyno restart
+        lines = await _read_until(proc, "Shutdown selesai")
+        await proc.wait()
+        result["shutdown"] = time.monotonic() - start
+        result["saved"] = next(line for line in lines if "Checkpoint" in line)
+
+        start = time.monotonic()
+        proc = await _spawn_bot(env)
+        lines = await _read_until(proc, "Siap dalam")
+        result["ready"] = time.monotonic() - start
+        result["ready_inside"] = lines[-1]
+        result["restored"] = next((line for line in lines if "Checkpoint" in line), "nothing restored")
+
+        # every restored pair still relays, without anyone pressing /start
+        relayed.clear()
+
+        def hellos():
+            return {uid for uid, texts in relayed.items() if any(t and t.startswith("halo dari ") for t in texts)}
+
+        start = time.monotonic()
+        for uid in paired:
+            await api.inject(message_update(uid, 10_000 + uid, f"halo dari {uid}"))
+        await _wait_for(lambda: len(hellos()) == len(paired))
+        result["relay_resumed"] = time.monotonic() - start
+        result["notices"] = sum(t.startswith("💬 Partner ditemukan") for texts in relayed.values() for t in texts if t)
+
+        # a restored searcher is still in the pool: a woman pressing Find meets one of them
+        await api.inject(callback_update(n_users, "late", "find"))
+        await _wait_for(lambda: any(t and t.startswith("💬") for t in relayed.get(n_users, [])))
+        result["search_ok"] = any(
+            uid in waiting and relayed[uid][-1].startswith("💬") for uid in relayed if relayed[uid]
+        )
+
+        proc.send_signal(15)
+        await proc.wait()
+        await api.stop()
+    return result
+
+
+def bench_restart(n_users=100_000, n_pairs=100, n_searching=50, drain_timeout=2.0):
+    print("== graceful shutdown + hot restart ==")
+    # short drain: part of the "partner found" notices is still queued at SIGTERM and rides the checkpoint
+    r = asyncio.run(_restart(n_users, n_pairs, n_searching, drain_timeout))
+    print(f"users={n_users:,}  pairs={n_pairs}  searching={n_searching}  drain timeout={drain_timeout:.0f}s")
+    print(f"SIGTERM -> exit       {r['shutdown']:.2f}s   {r['saved']}")
+    print(f"spawn -> ready        {r['ready']:.2f}s   (target {main.READY_TARGET:.0f}s, "
+          f"{'ok' if r['ready'] <= main.READY_TARGET else 'OVER'}; bot: {r['ready_inside'].strip()})")
+    print(f"restored              {r['restored'].strip()}")
+    print(f"relay after restart   {n_pairs * 2} messages, every partner reached in {r['relay_resumed']:.2f}s "
+          f"(+{r['notices']} re-queued notices)  search pool ok={r['search_ok']}")
+
+
+# ---------------------------
+# Anti-spam: one flooder among normal chatters, limiter in front of relay_message
+# ---------------------------
+def bench_rate_limit(n_pairs=500, messages_per_user=5, spam=20_000, buckets=1_000_000):
+    print("== per-user rate limit ==")
+    _reset_state()
+    _pair_users(n_pairs)
+    main.limiter = main.RateLimiter(main.RATE_LIMITS)
+    bot = FakeBot()
+    context = fake_context(bot)
+    spammer = 1
+    legit = [fake_text_update(uid, f"halo {i}") for i in range(messages_per_user) for uid in range(2, 2 * n_pairs + 1)]
+    flood = [fake_text_update(spammer, f"spam {i}") for i in range(spam)]
+    updates = legit + flood
+    random.Random(3).shuffle(updates)
+    passed = defaultdict(int)
+    cost = {"allowed": [0, 0.0], "dropped": [0, 0.0]}
+
+    async def run():
+        main.outbox.start(bot)
+        for update in updates:
+            start = time.perf_counter()
+            try:
+                await main.rate_limit(update, context)
+            except main.ApplicationHandlerStop:
+                slot = cost["dropped"]
+            else:
+                slot = cost["allowed"]
+                passed[update.effective_user.id] += 1
+                await main.relay_message(update, context)
+            slot[0] += 1
+            slot[1] += time.perf_counter() - start
+        await main.outbox.stop(timeout=0)
+
+    asyncio.run(run())
+    admin_reports = [t for admin in main.ADMIN_IDS for t in bot.received.get(admin, []) if t.startswith("🚨 SPAM")]
+    queued_to_admins = sum(1 for chat_id, _, kw in main.outbox.pending_calls()
+                           if chat_id in main.ADMIN_IDS and kw["text"].startswith("🚨 SPAM"))
+    legit_through = sum(v for uid, v in passed.items() if uid != spammer)
+    print(f"spammer: {spam:,} sent, {passed[spammer]} relayed (burst {main.RATE_LIMITS['message'][1]})  "
+          f"admin reports={len(admin_reports) + queued_to_admins}")
+    print(f"normal users: {legit_through:,}/{len(legit):,} relayed")
+    for label, (n, total) in cost.items():
+        print(f"{label:<8} {n:>7,} updates  {total / n * 1e6:6.2f} us/update (limiter + handler)")
+
+    # constant memory: a million distinct senders never grow past the LRU bound
+    limiter = main.RateLimiter(main.RATE_LIMITS, max_users=100_000)
+    start = time.perf_counter()
+    for uid in range(buckets):
+        limiter.allow(uid, "message")
+    elapsed = time.perf_counter() - start
+    limiter = main.RateLimiter(main.RATE_LIMITS, max_users=100_000)
+    tracemalloc.start()
+    for uid in range(buckets):
+        limiter.allow(uid, "message")
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{buckets:,} distinct senders: {len(limiter):,} buckets kept, {current / 2**20:.1f} MiB, "
+          f"{elapsed / buckets * 1e6:.2f} us/allow")
+    main.limiter = main.RateLimiter(main.RATE_LIMITS)
+    _reset_state()
+
+
+# ---------------------------
+# Bulk admin operations on 10k users: approve, ban, export, import
+# ---------------------------
+async def _timed_op(coro) -> tuple:
+    """(result, seconds, longest event loop stall) while coro runs next to a 1 ms ticker."""
+    stalls = [0.0]
+
+    async def ticker():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stalls[0] = max(stalls[0], now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return result, elapsed, stalls[0]
+
+
+def _register_pending(n_users: int):
+    rng = random.Random(5)
+    for uid in range(1, n_users + 1):
+        main.ensure_user(uid)
+        main.update_user(uid, university=rng.choice(list(main.University)), gender=rng.choice(list(main.Gender)),
+                         age=rng.randint(main.AGE_MIN, main.AGE_MAX))
+        main.pending_verifications.add(uid)
+
+
+def bench_bulk_admin(n_users=10_000, live_messages=100):
+    print(f"== bulk admin operations ({n_users:,} users) ==")
+
+    def report(label, result, elapsed, stall):
+        print(f"{label:<34} {result!s:>8}  {elapsed * 1000:8.1f} ms  longest loop stall {stall * 1000:6.1f} ms")
+
+    async def run():
+        _reset_state()
+        _register_pending(n_users)
+        report("/approveall unnes perempuan", *await _timed_op(
+            main.approve_pending(main.parse_user_filter(["unnes", "perempuan"]))))
+        report("/approveall (rest)", *await _timed_op(main.approve_pending(main.parse_user_filter([]))))
+        assert not main.pending_verifications and main.stats.verified == n_users
+        report("/banlist", *await _timed_op(main.ban_users(list(range(1, n_users + 1)))))
+        assert main.stats.verified == 0 and len(main.user_index["banned"]) == n_users
+        print(f"notices queued in the bulk sender: {len(main.bulk):,}")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for fmt in ("csv", "jsonl"):
+                path = os.path.join(tmp, f"users.{fmt}")
+                before = {uid: main.user_row(uid, u) for uid, u in main.users.items()}
+                with open(path, "w", encoding="utf-8", newline="") as f:
+                    count, elapsed, stall = await _timed_op(
+                        asyncio.to_thread(main.export_users, f, fmt, main.iter_all_users()))
+                report(f"/export {fmt} (memory)", count, elapsed, stall)
+                _reset_state()
+                with open(path, encoding="utf-8", newline="") as f:
+                    (applied, errors), elapsed, stall = await _timed_op(main.import_users(f, fmt))
+                report(f"/import {fmt} ({os.path.getsize(path) / 1024:.0f} KiB)", applied, elapsed, stall)
+                assert not errors and {uid: main.user_row(uid, u) for uid, u in main.users.items()} == before
+
+            # SQLite: rows streamed in id-ordered batches straight from the store
+            main.storage = main.Storage(os.path.join(tmp, "bot.db"))
+            for uid, u in main.users.items():
+                main.storage.save_user(uid, u)
+            with open(os.path.join(tmp, "db.csv"), "w", encoding="utf-8", newline="") as f:
+                report("/export csv (SQLite)", *await _timed_op(
+                    asyncio.to_thread(main.export_users, f, "csv", main.iter_all_users())))
+            main.storage.close()
+            main.storage = None
+
+        # live chat keeps flowing while the bulk sender trickles 10k notices out
+        for with_bulk in (False, True):
+            _reset_state()
+            _pair_users(live_messages)
+            if with_bulk:
+                for uid in range(100_000, 100_000 + n_users):
+                    main.bulk.send(uid, "🎉 Profil kamu sudah diverifikasi!\n\n" + main.MENU_TEXT, with_menu=True)
+            bot = FakeBot()
+            main.outbox.start(bot)
+            main.bulk.start()
+            await asyncio.sleep(1.0)
+            start = time.monotonic()
+            for uid in range(1, 2 * live_messages + 1, 2):
+                main.outbox.send(uid + 1, f"live {uid}")
+            await _wait_for(lambda: sum(len(bot.received.get(uid + 1, ())) for uid in range(1, 2 * live_messages + 1, 2))
+                            == live_messages)
+            live = time.monotonic() - start
+            await main.bulk.stop()
+            await main.outbox.stop(timeout=0)
+            print(f"bulk {'on ' if with_bulk else 'off'}: {live_messages} live messages delivered in {live * 1000:5.0f} ms, "
+                  f"{n_users - len(main.bulk) if with_bulk else 0:,} notices sent "
+                  f"(bulk rate {main.BULK_SEND_RATE:.0f}/s of {main.SEND_GLOBAL_RATE:.0f}/s)")
+        _reset_state()
+
+    asyncio.run(run())
+
+
+# ---------------------------
+# Conversation state: abandoned registrations under churn, TTL eviction, restart
+# ---------------------------
+REGISTERED_TEXT = "📩 Data kamu sudah dikirim ke admin untuk diverifikasi. Tunggu ya!"
+
+
+def _conversation_state_bytes(conversations: dict, persistence) -> int:
+    """Memory held for conversation state: the live conversation dict + the persistence's touch index."""
+    size = sys.getsizeof(conversations) + sys.getsizeof(persistence._touched)
+    size += sum(sys.getsizeof(key) + sys.getsizeof(state) for key, state in conversations.items())
+    size += sum(sys.getsizeof(entry) + sys.getsizeof(entry[1]) for entry in persistence._touched)
+    return size
+
+
+async def _register_step(run: ScenarioRun, uid: int, age: str):
+    message_id, _ = run._ids(uid)
+    await run.step("age", message_update(uid, message_id, age), ("text", REGISTERED_TEXT))
+
+
+async def _registration_churn(db_path: str, waves: int, per_wave: int, pause: float) -> dict:
+    api = FakeBotAPI()
+    await api.start()
+    app = main.build_application("123456:BENCH", base_url=api.base_url)
+    run = ScenarioRun(api)
+    conversations = next(h for h in app.handlers[0] if isinstance(h, main.RegistrationHandler))
+    persistence = app.persistence
+    rounds = []
+    write = persistence._write
+    persistence._write = lambda dirty: (rounds.append(len(dirty)), write(dirty))
+    samples = []
+    async with app:
+        await app.start()
+        await main.on_startup(app)
+        await app.updater.start_polling(poll_interval=0.0, timeout=10)
+        for wave in range(waves):
+            first = 300_000 + wave * per_wave
+
+            async def abandon(uid):
+                await run.send("start", uid, "/start")
+                await run.press("university", uid, "unnes")  # ... and never picks a gender
+
+            await asyncio.gather(*(abandon(uid) for uid in range(first, first + per_wave)))
+            await asyncio.sleep(pause)
+            samples.append((len(conversations._conversations), persistence.entries,
+                            _conversation_state_bytes(conversations._conversations, persistence) / 1024))
+        # "ubah_profil" from the menu of a verified user now runs the whole flow again
+        uid = 299_999
+        main.ensure_user(uid)
+        main.update_user(uid, verified=True, university=main.University.UNNES, gender=main.Gender.MALE, age=20)
+        await run.press("ubah_profil", uid, "ubah_profil")
+        await run.press("university", uid, "nonunnes")
+        await run.press("gender", uid, "female")
+        await _register_step(run, uid, "22")
+        u = main.users[uid]
+        reregistered = (u.university, u.gender, u.age, u.verified) == (main.University.NON_UNNES, main.Gender.FEMALE, 22, False)
+        user_data = len(app.user_data)  # PTB's per-user dicts; none should exist, the bot does not use them
+        await app.updater.stop()
+        await main.on_shutdown(app)
+        await app.stop()
+    # restart: the states written to the db come back; a restored user continues where they stopped
+    app = main.build_application("123456:BENCH", base_url=api.base_url)
+    run = ScenarioRun(api)
+    async with app:
+        restored = len(next(h for h in app.handlers[0] if isinstance(h, main.RegistrationHandler))._conversations)
+        await app.start()
+        await app.updater.start_polling(poll_interval=0.0, timeout=10)
+        uid = 300_000 + waves * per_wave - 1
+        await run.press("gender", uid, "male")
+        await _register_step(run, uid, "21")
+        resumed = main.users[uid].age == 21
+        await app.updater.stop()
+        await app.stop()
+    await api.stop()
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM conversation_state").fetchone()[0]
+    return {"samples": samples, "rounds": rounds, "evicted": persistence.evicted, "reregistered": reregistered,
+            "user_data": user_data,
+            "restored": restored, "resumed": resumed, "rows": rows, "timeouts": sum(run.timeouts.values())}
+
+
+def bench_conversation_state(waves=6, per_wave=500, ttl=15.0, max_entries=1_000):
+    print(f"== registration state under churn ({waves} waves x {per_wave:,} abandoned registrations) ==")
+    saved = (main.ADMIN_IDS, main.METRICS_PORT, main.METRICS_LOG_INTERVAL, main.VERIFY_DIGEST_INTERVAL,
+             main.CONV_STATE_TTL, main.CONV_STATE_MAX, main.CONV_STATE_FLUSH, main.REAPER_INTERVAL)
+    main.ADMIN_IDS = [900_000]
+    main.METRICS_PORT, main.METRICS_LOG_INTERVAL, main.VERIFY_DIGEST_INTERVAL = 0, 0, 0
+    main.CONV_STATE_FLUSH, main.REAPER_INTERVAL = 0.5, 0.5
+    try:
+        for label, state_ttl, state_max in (("no expiry", 1e9, 10**9), (f"ttl {ttl:.0f}s", ttl, 10**9),
+                                            (f"ttl {ttl:.0f}s, max {max_entries:,}", ttl, max_entries)):
+            main.CONV_STATE_TTL, main.CONV_STATE_MAX = state_ttl, state_max
+            _reset_state()
+            main.outbox = main.Outbox(global_rate=5_000, chat_rate=100, chat_burst=20, workers=64)
+            with tempfile.TemporaryDirectory() as tmp:
+                main.storage = main.Storage(os.path.join(tmp, "bot.db"))
+                try:
+                    result = asyncio.run(_registration_churn(main.storage.path, waves, per_wave, 1.0))
+                finally:
+                    main.storage.close()
+                    main.storage = None
+            live = "  ".join(f"{conv:>5,}/{kib:5.0f}" for conv, _, kib in result["samples"])
+            rounds = result["rounds"]
+            print(f"{label:<16} live conversations/KiB per wave: {live}")
+            print(f"{'':<16} persisted={result['samples'][-1][1]:,} rows={result['rows']:,} evicted={result['evicted']:,}  "
+                  f"{sum(rounds):,} changes in {len(rounds)} transactions  restored={result['restored']:,} "
+                  f"resumed={result['resumed']}  ubah_profil ok={result['reregistered']}  timeouts={result['timeouts']}  "
+                  f"user_data={result['user_data']:,}")
+    finally:
+        (main.ADMIN_IDS, main.METRICS_PORT, main.METRICS_LOG_INTERVAL, main.VERIFY_DIGEST_INTERVAL,
+         main.CONV_STATE_TTL, main.CONV_STATE_MAX, main.CONV_STATE_FLUSH, main.REAPER_INTERVAL) = saved
+
+
+# ---------------------------
+# Cold start: import profile, spawn -> first handled update, --check
+# ---------------------------
+def _import_profile(top: int = 8):
+    """Run python -X importtime in a fresh interpreter; cumulative ms per top-level import of main."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(main.__file__))).stderr
+    total, direct = 0.0, []
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line[13:]:
+            continue
+        _, cumulative, name = line[12:].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        ms = int(cumulative) / 1000
+        if name.strip() == "main":
+            total = ms
+        elif name.startswith("   ") and not name.startswith("    "):
+            direct.append((ms, name.strip()))  # imported by main itself
+    direct.sort(reverse=True)
+    return total, direct[:top]
+
+
+async def _first_update(args: list, env: dict, cwd: str) -> float:
+    """Seconds from spawning the bot until its reply to an update that was already waiting."""
+    api = FakeBotAPI()
+    await api.start()
+    replied = asyncio.get_running_loop().create_future()
+    api.listeners.append(lambda method, params: replied.done() or replied.set_result(time.monotonic())
+                         if method == "sendMessage" and int(params["chat_id"]) == 42 else None)
+    await api.inject(message_update(42, 1, "/myid"))
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, *args, cwd=cwd, env=dict(env, BOT_API_URL=api.base_url),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        elapsed = await asyncio.wait_for(replied, 60) - start
+        lines = await _read_until(proc, "Siap dalam")
+    finally:
+        proc.send_signal(15)
+        await proc.wait()
+        await api.stop()
+    return elapsed, lines[-1].split("Siap dalam ", 1)[1]
+
+
+def bench_startup(user_counts=(0, 100_000), runs=5):
+    print("== cold start ==")
+    cwd = os.path.dirname(os.path.abspath(main.__file__))
+    total, direct = _import_profile()
+    print(f"import main: {total:.0f} ms  (" + ", ".join(f"{name} {ms:.0f}" for ms, name in direct) + ")")
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, BOT_TOKEN="123456:BENCH", METRICS_PORT="0", METRICS_LOG_INTERVAL="0",
+                   VERIFY_DIGEST_INTERVAL="0", CHECKPOINT_PATH="", PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+        start = time.monotonic()
+        check = subprocess.run([sys.executable, "-m", "main", "--check"], cwd=cwd, capture_output=True, text=True,
+                               env=dict(env, DB_PATH=os.path.join(tmp, "check.db")))
+        print(f"--check: exit {check.returncode} in {(time.monotonic() - start) * 1000:.0f} ms  "
+              f"{check.stdout.strip().splitlines()[-1]}")
+        for n_users in user_counts:
+            db_path = os.path.join(tmp, f"bot-{n_users}.db")
+            store = main.Storage(db_path)
+            for uid in range(1, n_users + 1):
+                store.save_user(uid, main.User(verified=uid % 3 != 0, university=main.University.UNNES, age=20,
+                                               gender=main.Gender.MALE, banned=uid % 50 == 0))
+            store.close()
+            for label, args in (("python main.py", [os.path.join(cwd, "main.py")]), ("python -m main", ["-m", "main"])):
+                times, inside = [], None
+                for _ in range(runs):
+                    elapsed, inside = asyncio.run(_first_update(args, dict(env, DB_PATH=db_path), cwd))
+                    times.append(elapsed)
+                times.sort()
+                print(f"users={n_users:>7,}  {label:<15} spawn -> first reply  median {times[len(times) // 2] * 1000:4.0f} ms  "
+                      f"(min {times[0] * 1000:.0f})  last ready line: {inside}")
+
+
+# ---------------------------
+# Analytics: per-event cost, memory vs events, quantile error, /stats render
+# ---------------------------
+def _feed_analytics(analytics, n_users: int, events: int, waits: list):
+    """Rounds of search + match + 8 relays + end (12 events) over random pairs; waits gets every true wait."""
+    search_started = main.search_started
+    for i in range(events // 12):
+        a, b = random.randint(1, n_users), random.randint(1, n_users)
+        if a == b:
+            continue
+        now = time.monotonic()
+        wait_a, wait_b = random.lognormvariate(3, 1.2), random.lognormvariate(3, 1.2)  # median ~20 s, long tail
+        search_started[a], search_started[b] = now - wait_a, now - wait_b
+        waits += (wait_a, wait_b)
+        analytics.search()  # a queued
+        analytics.search()  # b found a
+        analytics.match(a, b, now)
+        del search_started[a], search_started[b]
+        key = main.pair_key(a, b)
+        for _ in range(8):
+            analytics.relay(key)
+        analytics.ended(key, now + random.expovariate(1 / 300))
+
+
+def bench_analytics(n_users=20_000, event_counts=(12_000, 120_000, 1_200_000)):
+    print("== analytics (streaming aggregates for /stats) ==")
+    _reset_state()
+    genders, universities = list(main.Gender), list(main.University)
+    for uid in range(1, n_users + 1):
+        main.users[uid] = main.User(verified=True, gender=random.choice(genders),
+                                    university=random.choice(universities), age=random.randint(18, 25))
+    for events in event_counts:
+        main.analytics = main.Analytics()
+        waits = []
+        start = time.perf_counter()
+        _feed_analytics(main.analytics, n_users, events, waits)
+        per_event = (time.perf_counter() - start) / events
+
+        tracemalloc.start()
+        analytics = main.Analytics()
+        _feed_analytics(analytics, n_users, events, [])
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{events:>9} events: {per_event * 1e6:5.2f} us/event, aggregates {held / 1024:6.1f} KiB")
+    waits.sort()
+    total, _ = main.analytics.window()
+    for q in (0.5, 0.9, 0.99):
+        exact = waits[int(q * (len(waits) - 1))]
+        approx = total.wait.quantile(q)
+        print(f"wait p{q * 100:.0f}: exact {exact:8.1f} s, histogram {approx:8.1f} s ({(approx / exact - 1) * 100:+.0f}%)")
+    start = time.perf_counter()
+    for _ in range(1_000):
+        text = main.render_stats()
+    print(f"/stats render: {(time.perf_counter() - start):.3f} ms (n_users={n_users})")
+    start = time.perf_counter()
+    sum(1 for u in main.users.values() if u.verified and u.partner is None)  # what a users scan would cost
+    print(f"one pass over users for comparison: {(time.perf_counter() - start) * 1000:.3f} ms")
+    print(text)
+
+
+# ---------------------------
+# Moderation: relay latency vs banned-list size, reload next to live traffic
+# ---------------------------
+def _banned_patterns(n: int) -> list:
+    """n distinct words, phrases and URLs, roughly like an admin-curated list."""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    patterns = set()
+    while len(patterns) < n:
+        word = "".join(random.choices(letters, k=random.randint(4, 10)))
+        kind = random.random()
+        if kind < 0.2:
+            word = f"{word}.{random.choice(['com', 'id', 'ly', 'xyz'])}/"
+        elif kind < 0.3:
+            word = f"{word} {''.join(random.choices(letters, k=random.randint(3, 8)))}"
+        patterns.add(word)
+    return sorted(patterns)
+
+
+def bench_moderation(n_pairs=500, messages=20_000, pattern_counts=(0, 100, 1_000, 10_000), hit_ratio=0.01):
+    print("== moderation pre-filter (relay_message) ==")
+    chat = ("halo kamu kuliah di mana", "aku dari semarang", "lagi apa nih", "hahaha iya bener banget",
+            "cek ini https://youtube.com/watch?v=abc", "boleh minta ig nya?", "udah makan belum", "wkwk 😂")
+    context = fake_context()
+    naive = {}
+    for count in pattern_counts:
+        patterns = _banned_patterns(count)
+        texts = [random.choice(chat) + (" " + random.choice(patterns) if patterns and random.random() < hit_ratio
+                                        else "") for _ in range(messages)]
+        updates = [fake_text_update(random.randint(1, 2 * n_pairs), text) for text in texts]
+        _reset_state()
+        _pair_users(n_pairs)
+        start = time.perf_counter()
+        main.moderation._regex = main.ModerationFilter.compile(main.parse_patterns(patterns))
+        compile_s = time.perf_counter() - start
+        main.moderation.patterns = frozenset(patterns)
+
+        start = time.perf_counter()
+        hits = sum(1 for text in texts if main.moderation.check(text))
+        check_us = (time.perf_counter() - start) / messages * 1e6
+
+        async def run():
+            for update in updates:
+                await main.relay_message(update, context)
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        relay_us = (time.perf_counter() - start) / messages * 1e6
+        sample = texts[:1_000]
+        start = time.perf_counter()
+        for text in sample:  # what a loop over the list would cost
+            lowered = text.lower()
+            any(p in lowered for p in patterns)
+        naive[count] = (time.perf_counter() - start) / len(sample) * 1e6
+        print(f"patterns={count:>6}  compile {compile_s * 1000:6.1f} ms  check {check_us:5.2f} us/msg "
+              f"(loop over list {naive[count]:8.2f} us)  relay {relay_us:5.2f} us/msg  hits={hits} "
+              f"pairs flagged to admins={len(main.moderation_flags)}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "moderation.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(_banned_patterns(pattern_counts[-1])))
+
+        async def reload():
+            moderation = main.ModerationFilter(path)
+            count, seconds, stall = await _timed_op(moderation.reload())
+            print(f"reload {count} patterns from file: {seconds * 1000:.0f} ms, longest relay stall {stall * 1000:.1f} ms")
+            _, seconds, stall = await _timed_op(moderation.update(add=["satu pola baru"]))
+            print(f"/moderasi tambah (recompile + save): {seconds * 1000:.0f} ms, "
+                  f"longest relay stall {stall * 1000:.1f} ms")
+
+        asyncio.run(reload())
+
+
+BENCHES = {
+    "matchmaking": bench_matchmaking,
+    "relay_persistence": bench_relay_persistence,
+    "admin_lists": bench_admin_lists,
+    "outbox": bench_outbox,
+    "user_memory": bench_user_memory,
+    "update_modes": bench_update_modes,
+    "find_stress": bench_find_stress,
+    "admin_fanout": bench_admin_fanout,
+    "matching_sim": bench_matching_sim,
+    "reaper": bench_reaper,
+    "shared_state": bench_shared_state,
+    "metrics_overhead": bench_metrics_overhead,
+    "media_relay": bench_media_relay,
+    "render_cache": bench_render_cache,
+    "scenario": bench_scenario,
+    "event_recovery": bench_event_recovery,
+    "restart": bench_restart,
+    "rate_limit": bench_rate_limit,
+    "bulk_admin": bench_bulk_admin,
+    "conversation_state": bench_conversation_state,
+    "startup": bench_startup,
+    "analytics": bench_analytics,
+    "moderation": bench_moderation,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHES)
+    for name in names:
+        BENCHES[name]()
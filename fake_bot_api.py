@@ -0,0 +1,200 @@
+# fake_bot_api.py - minimal local Telegram Bot API stand-in for benchmarks
+# Supports just enough of the HTTP API for main.py to run offline:
+#   getMe, getUpdates (long polling), setWebhook, deleteWebhook, sendMessage,
+#   editMessageText, answerCallbackQuery, copyMessage, sendMediaGroup
+# Updates are injected with inject(); they go out via getUpdates or, when a
+# webhook is set, are POSTed to it (like the real server does).
+# latency delays every method call; flood_ratio answers that share of sends
+# with 429 Too Many Requests (retry_after seconds), like Telegram's flood control.
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeBotAPI:
+    FLOOD_METHODS = {"sendMessage", "editMessageText", "copyMessage", "sendMediaGroup"}
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 flood_ratio: float = 0.0, retry_after: int = 1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+        self.flood_errors = 0
+        self._server = None
+        self._updates = []  # pending update dicts for getUpdates
+        self._new_update = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.calls = []  # (monotonic time, method, params)
+        self.listeners = []  # callables(method, params) invoked on every API call
+
+    @property
+    def base_url(self) -> str:
+        """Value for ApplicationBuilder().base_url(); the token is appended by PTB."""
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_conn, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    # ---------------------------
+    # Update injection
+    # ---------------------------
+    async def inject(self, update: dict) -> dict:
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        if self.webhook_url:
+            await self._post_webhook(update)
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+        return update
+
+    async def _post_webhook(self, update: dict):
+        url = urlsplit(self.webhook_url)
+        body = json.dumps(update).encode()
+        headers = [
+            f"POST {url.path or '/'} HTTP/1.1",
+            f"Host: {url.netloc}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        if self.webhook_secret:
+            headers.append(f"X-Telegram-Bot-Api-Secret-Token: {self.webhook_secret}")
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+        await reader.read()  # wait for the response so delivery is acknowledged
+        writer.close()
+
+    # ---------------------------
+    # HTTP plumbing (HTTP/1.1 with keep-alive, enough for httpx)
+    # ---------------------------
+    async def _handle_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode()
+                    if line in ("\r\n", "\n", ""):
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                params = self._parse_params(headers.get("content-type", ""), body)
+                method = path.rsplit("/", 1)[-1]
+                status, payload = await self._dispatch(method, params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if not body:
+            return {}
+        if "json" in content_type:
+            return json.loads(body)
+        params = {}
+        for key, value in parse_qsl(body.decode()):
+            # PTB sends non-string values JSON encoded
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    # ---------------------------
+    # Bot API methods
+    # ---------------------------
+    async def _dispatch(self, method: str, params: dict):
+        self.calls.append((time.monotonic(), method, params))
+        for listener in self.listeners:
+            listener(method, params)
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return 404, {"ok": False, "error_code": 404, "description": f"Not Found: method {method}"}
+        if self.latency and method != "getUpdates":
+            await asyncio.sleep(self.latency)
+        if method in self.FLOOD_METHODS and self.flood_ratio and random.random() < self.flood_ratio:
+            self.flood_errors += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        return await handler(params)
+
+    async def api_getMe(self, params):
+        return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}}
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params.get("url") or None
+        self.webhook_secret = params.get("secret_token")
+        return 200, {"ok": True, "result": True}
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = None
+        return 200, {"ok": True, "result": True}
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return 200, {"ok": True, "result": self._updates[:100]}
+
+    def _message(self, params: dict) -> dict:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    async def api_sendMessage(self, params):
+        return 200, {"ok": True, "result": self._message(params)}
+
+    async def api_editMessageText(self, params):
+        message = self._message(params)
+        message["message_id"] = int(params.get("message_id") or message["message_id"])
+        return 200, {"ok": True, "result": message}
+
+    async def api_answerCallbackQuery(self, params):
+        return 200, {"ok": True, "result": True}
+
+    async def api_copyMessage(self, params):
+        return 200, {"ok": True, "result": {"message_id": self._message(params)["message_id"]}}
+
+    async def api_sendMediaGroup(self, params):
+        media = params.get("media") or []
+        return 200, {"ok": True, "result": [self._message(params) for _ in media]}
@@ -1,30 +1,165 @@
 # main.py - FULL
+import asyncio
+import bisect
+import contextvars
+import csv
+import functools
+import gc
+import heapq
+import importlib.util
+import io
+import itertools
+import json
+import marshal
 import os
 import random
-from datetime import datetime
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from enum import Enum
 from typing import Optional
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import httpx
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+)
+from telegram.error import NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
+    ApplicationHandlerStop,
+    BasePersistence,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
     MessageHandler,
+    PersistenceInput,
+    TypeHandler,
     filters,
 )
 
 # === STATE CONSTANTS ===
 UNIVERSITY, GENDER, AGE = range(3)
 
-# === In-memory data (ganti ke DB untuk persisten) ===
-users = {}  # user_id -> dict with keys: verified, partner, university, gender, age, searching, banned
-chat_logs = {}  # user_id -> list of (sender_label, message) up to last 20
+# === In-memory data (cache di depan storage SQLite, dimuat lazy) ===
+users = {}  # user_id -> User (hanya user yang pernah /start atau dibanned admin)
+chat_logs = OrderedDict()  # (user_a, user_b) with a < b -> ChatRing of (sender_id, message), LRU order
+CHAT_LOG_LIMIT = 20  # pesan terakhir per pasangan
+CHAT_LOG_MAX_PAIRS = int(os.getenv("CHAT_LOG_MAX_PAIRS", "100000"))  # batas total memori log
+CAPTION_LOG_LIMIT = 100  # caption media yang disimpan di log (karakter)
+
+# === Album (media group): tunggu N detik sampai semua item masuk, lalu kirim sekali ===
+ALBUM_WAIT = float(os.getenv("ALBUM_WAIT", "0.5"))
+
+# === Persistensi: path SQLite, kosongkan untuk mode in-memory saja ===
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "0.5"))  # detik
+
+# === State bersama: isi REDIS_URL agar beberapa worker bisa jalan bareng (kosong = SQLite/memori lokal) ===
+REDIS_URL = os.getenv("REDIS_URL")
+
+# === Event log: jurnal transisi (audit admin + pemulihan cepat saat restart), kosong = mati ===
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "")
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "100000"))  # snapshot tiap N event
+AUDIT_LIMIT = 20  # event terakhir yang ditampilkan /audit
+
+# === Restart: saat SIGTERM/SIGINT antrian kirim dikuras lalu pasangan + pencarian disimpan, dipulihkan saat start ===
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "checkpoint.bin")  # kosong = mati (user diberi tahu saat restart)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))  # Heroku kill paksa 30 detik setelah SIGTERM
+READY_TARGET = float(os.getenv("READY_TARGET", "5"))  # target restart-to-ready (detik), lebih = log ERROR
+
+# === State registrasi (ConversationHandler): dibuang setelah TTL idle, maks N entri, ditulis tiap N detik ===
+CONV_STATE_TTL = float(os.getenv("CONV_STATE_TTL", "3600"))  # registrasi yang ditinggal lebih lama harus /start ulang
+CONV_STATE_MAX = int(os.getenv("CONV_STATE_MAX", "100000"))
+CONV_STATE_FLUSH = float(os.getenv("CONV_STATE_FLUSH", "5"))
+
+# === Bot API server sendiri (mis. telegram-bot-api lokal), format http://host:port/bot; kosong = api.telegram.org ===
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# === Webhook: isi WEBHOOK_URL (https://<app>.herokuapp.com) untuk mode webhook, kosong = polling ===
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # dicek di header X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+
+# === Digest verifikasi: ringkasan ke admin tiap N detik (0 = kirim langsung per user) ===
+VERIFY_DIGEST_INTERVAL = float(os.getenv("VERIFY_DIGEST_INTERVAL", "60"))
+DIGEST_PAGE_SIZE = 10
+
+# === Jumlah update yang diproses paralel (tetap berurutan per user) ===
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# === Rate limit kirim pesan (batas Telegram: ~30 msg/detik global, ~1 msg/detik per chat) ===
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_CHAT_BUCKETS = 100_000  # bucket per chat yang disimpan (LRU); yang lama tidak dipakai sudah penuh lagi
+
+# === Anti-spam: token bucket per user per jenis update (rate/detik, burst); lewat batas = update dibuang ===
+RATE_LIMITS = {
+    "message": (float(os.getenv("RATE_MESSAGE", "1")), int(os.getenv("RATE_MESSAGE_BURST", "10"))),
+    "button": (float(os.getenv("RATE_BUTTON", "0.5")), int(os.getenv("RATE_BUTTON_BURST", "5"))),
+    "command": (float(os.getenv("RATE_COMMAND", "0.2")), int(os.getenv("RATE_COMMAND_BURST", "5"))),
+    "report": (1 / 60, 2),  # /report: 2 langsung, lalu 1 per menit
+}
+RATE_LIMIT_MAX_USERS = 100_000  # bucket yang disimpan (LRU); bucket yang lama idle sudah penuh lagi, aman dibuang
+SPAM_REPORT_DROPS = int(os.getenv("SPAM_REPORT_DROPS", "50"))  # update dibuang dalam SPAM_WINDOW -> lapor admin
+SPAM_WINDOW = 600.0  # detik
+
+# === Moderasi otomatis: kata/URL terlarang (satu per baris, # = komentar), dicek di setiap pesan yang diteruskan ===
+MODERATION_PATH = os.getenv("MODERATION_PATH", "moderation.txt")  # kosong = hanya di memori (diatur lewat /moderasi)
+MODERATION_BLOCK = os.getenv("MODERATION_BLOCK", "1") == "1"  # 0 = pesan tetap diteruskan, hanya lapor admin
+MODERATION_RELOAD = 30.0  # detik antar cek perubahan file (diedit manual atau oleh worker lain)
+MODERATION_FLAG_COOLDOWN = 600.0  # lapor admin maks sekali per pasangan per N detik
+MODERATION_PATTERN_MAX = 200  # karakter per pola
+
+# === Operasi massal admin (/approveall, /banlist, /import): notifikasi prioritas rendah, N pesan/detik ===
+BULK_SEND_RATE = float(os.getenv("BULK_SEND_RATE", "10"))  # sisa kuota global tetap untuk chat biasa
+BULK_CHUNK = 500  # user per batch sebelum event loop diberi giliran
 
 # === Admin IDs ===
 ADMIN_IDS = [7894393728]  # ganti dengan user ID admin-mu
 
+# === Matching mode: "random" atau "fifo" ===
+MATCH_MODE = os.getenv("MATCH_MODE", "random")
+
+# === Pelebaran filter: setelah N detik menunggu, filter usia lalu kampus dilonggarkan ===
+MATCH_WIDEN_AFTER = float(os.getenv("MATCH_WIDEN_AFTER", "30"))
+MATCH_WIDEN_INTERVAL = 5.0  # detik antar pengecekan
+AGE_MIN, AGE_MAX = 18, 25
+
+# === Reaper: batas waktu mencari & percakapan tanpa aktivitas (detik) ===
+SEARCH_TTL = float(os.getenv("SEARCH_TTL", "600"))
+PAIR_IDLE_TTL = float(os.getenv("PAIR_IDLE_TTL", "1800"))
+REAPER_INTERVAL = 10.0
+
+# === Metrics: endpoint /metrics (format Prometheus) di METRICS_HOST:METRICS_PORT (0 = mati), log JSON tiap N detik ===
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))  # 0 = tanpa log berkala
+
+# === Analitik /stats: agregat per jam (pencarian, match, percakapan, laporan) untuk N jam terakhir ===
+ANALYTICS_HOURS = int(os.getenv("ANALYTICS_HOURS", "24"))
+
+# === Debug: bandingkan counter statistik dengan hitung ulang penuh ===
+STATS_SELF_CHECK = os.getenv("STATS_SELF_CHECK") == "1"
+
 
 # ---------------------------
 # Helper utilities
@@ -42,491 +177,3042 @@ async def safe_reply(update: Update, text: str, parse_mode=None, reply_markup=No
             return await cq.answer(text)
 
 
-def ensure_user(user_id: int):
-    """Ensure user record exists."""
-    if user_id not in users:
-        users[user_id] = {
-            "verified": False,
-            "partner": None,
-            "university": None,
-            "gender": None,
-            "age": None,
-            "searching": False,
-            "banned": False,
-        }
-
+# ---------------------------
+# Metrics (Prometheus text format, no extra dependency)
+# ---------------------------
+class Histogram:
+    """Fixed-bucket latency histogram in seconds; observe() is one bisect + three adds."""
 
-def save_chat(user_id: int, sender: str, message: str):
-    """Save chat history (max 20 entries per user)."""
-    if user_id not in chat_logs:
-        chat_logs[user_id] = []
-    chat_logs[user_id].append((sender, message))
-    if len(chat_logs[user_id]) > 20:
-        chat_logs[user_id] = chat_logs[user_id][-20:]
+    __slots__ = ("counts", "sum", "count")
 
+    BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
-# ---------------------------
-# Menu / Start / Registration
-# ---------------------------
-async def show_main_menu(update: Optional[Update] = None, context: Optional[ContextTypes.DEFAULT_TYPE] = None, chat_id: Optional[int] = None):
-    """
-    Show main menu.
-    Cari Doi button only shown between:
-      - Saturday >= 18:00 (local server time) up to Sunday 23:59
-    """
-    now = datetime.now()
-    day = now.weekday()  # Monday=0 .. Sunday=6
-    hour = now.hour
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
 
-    keyboard = [
-        [InlineKeyboardButton("🔍 Find", callback_data="find")],
-        [InlineKeyboardButton("✏️ Ubah Profil", callback_data="ubah_profil")],
-        [InlineKeyboardButton("👤 Profil", callback_data="profil")],
-    ]
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.sum += value
+        self.count += 1
 
-    # Insert Cari Doi only Sat 18:00 -> Sun 23:59
-    if (day == 5 and hour >= 18) or (day == 6):
-        keyboard.insert(1, [InlineKeyboardButton("💘 Cari Doi", callback_data="cari_doi")])
+    def since(self, counts: list) -> "Histogram":
+        """Histogram of the observations made after counts (an earlier copy of self.counts)."""
+        h = Histogram()
+        h.counts = [now - before for now, before in zip(self.counts, counts)]
+        h.count = sum(h.counts)
+        return h
 
-    text = "✅ Kamu sudah diverifikasi!\nPilih tombol untuk memulai percakapan:"
-    markup = InlineKeyboardMarkup(keyboard)
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if it is past the last bound)."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.BOUNDS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank and seen:
+                return bound
+        return 0.0
 
-    if update and getattr(update, "message", None):
-        await update.message.reply_text(text, reply_markup=markup)
-    elif update and getattr(update, "callback_query", None):
-        await update.callback_query.edit_message_text(text, reply_markup=markup)
-    elif chat_id and context:
-        await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=markup)
 
+class Metrics:
+    """Counters, histograms and scrape-time gauges, keyed by (name, rendered labels)."""
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    ensure_user(user_id)
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> number
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> callable returning the current value
 
-    if users[user_id].get("banned"):
-        await safe_reply(update, "⚠️ Kamu telah diblokir admin dan tidak bisa menggunakan bot ini.")
-        return ConversationHandler.END
+    def inc(self, name: str, labels: str = "", amount: float = 1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
 
-    if users[user_id].get("verified"):
-        if users[user_id].get("searching"):
-            await safe_reply(update, "⏳ Kamu sedang mencari partner...\nGunakan /stop untuk membatalkan.")
-        elif users[user_id].get("partner"):
-            await safe_reply(update, "💬 Kamu sedang dalam percakapan anonim.\nGunakan /stop untuk mengakhiri.")
-        else:
-            await show_main_menu(update, context)
-        return ConversationHandler.END
+    def histogram(self, name: str, labels: str = "") -> Histogram:
+        key = (name, labels)
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = Histogram()
+        return h
 
-    # not verified -> start registration
-    keyboard = [
-        [InlineKeyboardButton("UNNES", callback_data="unnes")],
-        [InlineKeyboardButton("Non-UNNES", callback_data="nonunnes")],
-    ]
-    await safe_reply(update, "👋 Selamat datang di Anonymous Kampus!\nPilih asal universitas kamu:", reply_markup=InlineKeyboardMarkup(keyboard))
-    return UNIVERSITY
+    def observe(self, name: str, labels: str, value: float):
+        self.histogram(name, labels).observe(value)
 
+    def gauge(self, name: str, read):
+        self.gauges[name] = read
 
-async def handle_university(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    ensure_user(user_id)
-    users[user_id]["university"] = "UNNES" if query.data == "unnes" else "Non-UNNES"
+    def read_gauges(self) -> dict:
+        """name -> current value; a gauge that fails to read is logged and left out."""
+        values = {}
+        for name, read in self.gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                print(f"ERROR reading gauge {name}: {e}")
+        return values
 
-    keyboard = [
-        [InlineKeyboardButton("Laki-laki", callback_data="male")],
-        [InlineKeyboardButton("Perempuan", callback_data="female")],
-    ]
-    await query.edit_message_text("🚻 Pilih gender kamu:", reply_markup=InlineKeyboardMarkup(keyboard))
-    return GENDER
+    def render(self, gauges: Optional[dict] = None) -> str:
+        """Prometheus text exposition (version 0.0.4); gauges = read_gauges() if already read."""
+        lines = []
+        for name, value in (self.read_gauges() if gauges is None else gauges).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, n in zip(h.BOUNDS, h.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}')
+            lines.append(f"{name}_sum{{{labels}}} {h.sum}" if labels else f"{name}_sum {h.sum}")
+            lines.append(f"{name}_count{{{labels}}} {h.count}" if labels else f"{name}_count {h.count}")
+        return "\n".join(lines) + "\n"
 
 
-async def handle_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    ensure_user(user_id)
-    users[user_id]["gender"] = "Laki-laki" if query.data == "male" else "Perempuan"
+metrics = Metrics()
+# scrape-time gauges; read whatever the globals point at when scraped
+metrics.gauge("bot_search_pool_size", lambda: len(search_pool))
+metrics.gauge("bot_active_pairs", lambda: len(pair_activity))
+metrics.gauge("bot_outbox_depth", lambda: outbox.depth)
+metrics.gauge("bot_users_cached", lambda: len(users))
+metrics.gauge("bot_rate_limit_buckets", lambda: len(limiter))
+metrics.gauge("bot_bulk_queue_depth", lambda: len(bulk))
 
-    await query.edit_message_text("🎂 Masukkan usia kamu (contoh: 21):")
-    return AGE
 
+def timed(callback):
+    """Wrap a handler: latency goes to bot_handler_seconds, exceptions to bot_handler_errors_total."""
+    labels = f'handler="{callback.__name__}"'
+    histogram = metrics.histogram("bot_handler_seconds", labels)
 
-async def handle_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    ensure_user(user_id)
-    age_text = update.message.text.strip()
-    if not age_text.isdigit():
-        await safe_reply(update, "⚠️ Usia harus berupa angka. Coba lagi:")
-        return AGE
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", labels)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
 
-    age = int(age_text)
-    if age < 18 or age > 25:
-        await safe_reply(update, "⚠️ Usia hanya diperbolehkan 18–25 tahun. Coba lagi:")
-        return AGE
+    return wrapper
 
-    users[user_id]["age"] = age
-    await safe_reply(update, "📩 Data kamu sudah dikirim ke admin untuk diverifikasi. Tunggu ya!")
-    await request_admin_verification(user_id, context)
-    return ConversationHandler.END
 
+@functools.lru_cache(maxsize=None)
+def bot_api_ssl_context():
+    """One SSL context for every Bot API client; loading the CA bundle takes ~40 ms per client at startup."""
+    return httpx.create_ssl_context()
 
-# ---------------------------
-# Profil user (diri sendiri)
-# ---------------------------
-async def profil(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    ensure_user(user_id)
-    profil = users[user_id]
 
-    if profil.get("banned"):
-        status_text = "🚫 Diblokir Admin"
-    elif profil.get("partner"):
-        status_text = f"💬 Sedang ngobrol dengan User {profil['partner']}"
-    elif profil.get("searching"):
-        status_text = "🔎 Sedang mencari partner"
-    else:
-        status_text = "⏸️ Idle (tidak mencari / tidak ngobrol)"
+class SharedSSLRequest(HTTPXRequest):
+    """HTTPXRequest whose client reuses bot_api_ssl_context() (tls=False: plain-http Bot API server, no CA bundle)."""
 
-    teks = "📝 **Profil Kamu (Detail)**\n"
-    teks += f"🆔 User ID: `{user_id}`\n"
-    teks += f"🏫 Universitas: {profil.get('university') or '-'}\n"
-    teks += f"🚻 Gender: {profil.get('gender') or '-'}\n"
-    teks += f"🎂 Usia: {profil.get('age') or '-'}\n"
-    teks += f"📌 Status Aktivitas: {status_text}\n"
-    teks += f"✅ Verifikasi: {'Sudah' if profil.get('verified') else 'Belum'}\n"
-    teks += f"🚫 Banned: {'Ya' if profil.get('banned') else 'Tidak'}\n\n"
-    teks += "🔒 Profil ini **hanya bisa kamu lihat sendiri**.\nIdentitasmu tetap **anonymous**."
+    def __init__(self, *args, tls: bool = True, **kwargs):
+        self._tls = tls  # HTTPXRequest.__init__ already builds the client
+        super().__init__(*args, **kwargs)
 
-    await safe_reply(update, teks, parse_mode="Markdown")
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(verify=bot_api_ssl_context() if self._tls else False, **self._client_kwargs)
 
 
-# ---------------------------
-# Stop command (keluar pencarian/percakapan)
-# ---------------------------
-async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    ensure_user(user_id)
-    partner_id = users[user_id].get("partner")
+class TimedRequest(SharedSSLRequest):
+    """HTTPXRequest that records every Bot API call's duration and failures by method."""
 
-    if partner_id:
-        # inform partner
+    async def do_request(self, url: str, *args, **kwargs):
+        labels = f'method="{url.rsplit("/", 1)[-1]}"'
+        start = time.perf_counter()
         try:
-            await context.bot.send_message(chat_id=partner_id, text="❌ Partner keluar dari percakapan.")
-        except:
-            pass
-        users[partner_id]["partner"] = None
-
-    users[user_id]["partner"] = None
-    users[user_id]["searching"] = False
-    await safe_reply(update, "❌ Kamu keluar dari percakapan / pencarian partner.")
+            code, payload = await super().do_request(url, *args, **kwargs)
+        except Exception:
+            metrics.inc("bot_telegram_api_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("bot_telegram_api_seconds", labels, time.perf_counter() - start)
+        if code >= 400:
+            metrics.inc("bot_telegram_api_errors_total", labels)
+        return code, payload
 
 
 # ---------------------------
-# Request admin verification (kirim ke semua admin)
+# User record
 # ---------------------------
-async def request_admin_verification(user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    # ensure user exists
-    ensure_user(user_id)
-    u = users[user_id]
-    text = (
-        f"🔔 Permintaan verifikasi baru!\n\n"
-        f"👤 User ID: {user_id}\n"
-        f"🏫 Universitas: {u.get('university')}\n"
-        f"🚻 Gender: {u.get('gender')}\n"
-        f"🎂 Usia: {u.get('age')}\n\n"
-        "✅ Approve atau ❌ Reject?"
-    )
-    keyboard = [
-        [InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user_id}")],
-        [InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user_id}")],
-        [InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_{user_id}")],
-        [InlineKeyboardButton("✅ Unban User", callback_data=f"unban_{user_id}")],
-    ]
+class University(Enum):
+    UNNES = "UNNES"
+    NON_UNNES = "Non-UNNES"
 
-    for admin_id in ADMIN_IDS:
-        try:
-            print(f"DEBUG: Sending verification request to admin {admin_id}")
-            await context.bot.send_message(admin_id, text, reply_markup=InlineKeyboardMarkup(keyboard))
-        except Exception as e:
-            print(f"ERROR sending verification to {admin_id}: {e}")
+    def __str__(self):
+        return self.value
 
 
-# ---------------------------
-# Report command - send log to admin
-# ---------------------------
-async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    ensure_user(user_id)
-    partner_id = users[user_id].get("partner")
-    if not partner_id:
-        await safe_reply(update, "⚠️ Kamu tidak sedang dalam percakapan anonim.")
-        return
+class Gender(Enum):
+    MALE = "Laki-laki"
+    FEMALE = "Perempuan"
 
-    # build log text from user's chat_logs (we saved symmetrical logs)
-    log_text = "📑 Riwayat Chat Terakhir:\n\n"
-    for sender, msg in chat_logs.get(user_id, []):
-        prefix = "🟢 Kamu" if sender == "user" else "🔵 Partner"
-        log_text += f"{prefix}: {msg}\n"
+    def __str__(self):
+        return self.value
 
-    for admin_id in ADMIN_IDS:
-        keyboard = [
-            [
-                InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_{partner_id}"),
-                InlineKeyboardButton("✅ Unban User", callback_data=f"unban_{partner_id}"),
-            ]
-        ]
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"🚨 LAPORAN USER!\n\nPelapor: {user_id}\nTerlapor: {partner_id}\n\n{log_text}",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
-        except Exception as e:
-            print(f"ERROR send report to {admin_id}: {e}")
 
-    await safe_reply(update, "📩 Laporan sudah dikirim ke admin. Terima kasih!")
+@dataclass(slots=True)
+class User:
+    """Compact per-user record (slots, no per-instance __dict__)."""
+
+    verified: bool = False
+    partner: Optional[int] = None
+    university: Optional[University] = None
+    gender: Optional[Gender] = None
+    age: Optional[int] = None
+    searching: bool = False
+    banned: bool = False
 
 
 # ---------------------------
-# Admin: show user profile (helper)
+# Outbound send queue (rate limit + RetryAfter)
 # ---------------------------
-async def show_user_profile(context: ContextTypes.DEFAULT_TYPE, chat_id: int, target_id: int):
-    ensure_user(target_id)
-    profil = users[target_id]
+class TokenBucket:
+    """Classic token bucket; delay() takes a token or says how long to wait for one."""
 
-    if profil.get("banned"):
-        status_text = "🚫 Diblokir Admin"
-    elif profil.get("partner"):
-        status_text = f"💬 Sedang ngobrol dengan User {profil['partner']}"
-    elif profil.get("searching"):
-        status_text = "🔎 Sedang mencari partner"
-    else:
-        status_text = "⏸️ Idle (tidak mencari / tidak ngobrol)"
+    __slots__ = ("rate", "burst", "tokens", "last")  # one per chat and per rate-limited user
 
-    teks = "📝 **Profil User (Detail)**\n"
-    teks += f"🆔 User ID: `{target_id}`\n"
-    teks += f"🏫 Universitas: {profil.get('university') or '-'}\n"
-    teks += f"🚻 Gender: {profil.get('gender') or '-'}\n"
-    teks += f"🎂 Usia: {profil.get('age') or '-'}\n"
-    teks += f"📌 Status Aktivitas: {status_text}\n"
-    teks += f"✅ Verifikasi: {'Sudah' if profil.get('verified') else 'Belum'}\n"
-    teks += f"🚫 Banned: {'Ya' if profil.get('banned') else 'Tidak'}\n"
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
 
-    keyboard = [
-        [InlineKeyboardButton("🚫 Ban", callback_data=f"ban_{target_id}"),
-         InlineKeyboardButton("✅ Unban", callback_data=f"unban_{target_id}")],
-    ]
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
 
-    await context.bot.send_message(chat_id, teks, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+    def delay(self) -> float:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
 
 
-# ---------------------------
-# Admin panel - clickable lists
-# ---------------------------
-async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    admin_id = update.effective_user.id
-    if admin_id not in ADMIN_IDS:
-        await safe_reply(update, "❌ Kamu bukan admin.")
-        return
+class Outbox:
+    """
+    Queue for every outgoing bot call.
+    Messages to one chat are sent strictly in order (one worker owns a chat
+    at a time); per-chat and global token buckets keep us under Telegram's
+    limits, and a 429 (RetryAfter) pauses that chat and retries instead of
+    dropping the message.
+    """
 
-    keyboard = [
-        [InlineKeyboardButton("📋 Semua User", callback_data="list_users")],
-        [InlineKeyboardButton("✅ Terverifikasi", callback_data="list_verified")],
-        [InlineKeyboardButton("⏳ Belum Verif", callback_data="list_unverified")],
-        [InlineKeyboardButton("🚫 Banned", callback_data="list_banned")],
-    ]
-    await safe_reply(update, "⚙️ Panel Admin:", reply_markup=InlineKeyboardMarkup(keyboard))
+    MAX_RETRIES = 5
 
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3, workers: int = 8,
+                 max_buckets: int = SEND_CHAT_BUCKETS):
+        self.bot = None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_buckets = max_buckets
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chats = {}  # chat_id -> deque of pending calls; removed as soon as it is empty
+        self._buckets = OrderedDict()  # chat_id -> TokenBucket, least recently used first (bounded)
+        self._ready = None  # asyncio.Queue of chat ids with pending jobs
+        self._tasks = []
+        # metrics
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
 
-async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    action = query.data
-    admin_id = query.from_user.id
+    def start(self, bot):
+        self.bot = bot
+        self._ready = asyncio.Queue()
+        for chat_id in self._chats:
+            self._ready.put_nowait(chat_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
 
-    if admin_id not in ADMIN_IDS:
-        await query.edit_message_text("❌ Kamu bukan admin.")
-        return
+    async def stop(self, timeout: float = 10.0):
+        """Drain pending sends (up to timeout) and stop the workers."""
+        deadline = time.monotonic() + timeout
+        while self.depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
 
-    if action == "list_users":
-        if not users:
-            await query.edit_message_text("📋 Belum ada user terdaftar.")
-            return
-        keyboard = [[InlineKeyboardButton(f"User {uid}", callback_data=f"detail_{uid}")] for uid in users.keys()]
-        await query.edit_message_text("📋 Semua User:", reply_markup=InlineKeyboardMarkup(keyboard))
+    def call(self, chat_id: int, method: str, **kwargs) -> asyncio.Future:
+        """Queue bot.<method>(chat_id=chat_id, **kwargs); returns a future with the result."""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+        queue.append((method, kwargs, future, time.monotonic()))
+        self.depth += 1
+        if len(queue) == 1 and self._ready is not None:
+            self._ready.put_nowait(chat_id)
+        return future
 
-    elif action == "list_verified":
-        verified = [uid for uid, u in users.items() if u.get("verified")]
-        if not verified:
-            await query.edit_message_text("✅ Tidak ada user terverifikasi.")
-            return
-        keyboard = [[InlineKeyboardButton(f"User {uid}", callback_data=f"detail_{uid}")] for uid in verified]
-        await query.edit_message_text("✅ User Terverifikasi:", reply_markup=InlineKeyboardMarkup(keyboard))
+    def send(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        return self.call(chat_id, "send_message", text=text, **kwargs)
 
-    elif action == "list_unverified":
-        unver = [uid for uid, u in users.items() if not u.get("verified")]
-        if not unver:
-            await query.edit_message_text("⏳ Semua user sudah terverifikasi.")
-            return
-        keyboard = [[InlineKeyboardButton(f"User {uid}", callback_data=f"detail_{uid}")] for uid in unver]
-        await query.edit_message_text("⏳ User Belum Verifikasi:", reply_markup=InlineKeyboardMarkup(keyboard))
+    def pending_calls(self) -> list:
+        """Calls still queued, as (chat_id, method, kwargs) in per-chat order (futures are not kept)."""
+        return [(chat_id, method, kwargs) for chat_id, queue in self._chats.items() for method, kwargs, _, _ in queue]
+
+    def metrics(self) -> dict:
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chats[chat_id]
+            method, kwargs, future, enqueued = queue[0]
+            await self._wait(self._bucket(chat_id))
+            await self._wait(self.global_bucket)
+            await self._deliver(chat_id, method, kwargs, future)
+            queue.popleft()
+            self.depth -= 1
+            latency = time.monotonic() - enqueued
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            if queue:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._chats[chat_id]  # the bucket stays in the LRU, so a quick next send still waits
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    @staticmethod
+    async def _wait(bucket: TokenBucket):
+        while True:
+            delay = bucket.delay()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
 
-    elif action == "list_banned":
-        banned = [uid for uid, u in users.items() if u.get("banned")]
-        if not banned:
-            await query.edit_message_text("🚫 Tidak ada user banned.")
+    async def _deliver(self, chat_id: int, method: str, kwargs: dict, future: asyncio.Future):
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                result = await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.MAX_RETRIES:
+                    break
+                self.retries += 1
+                await asyncio.sleep(e.retry_after)
+                continue
+            except NetworkError:
+                # includes TimedOut; back off exponentially
+                if attempt == self.MAX_RETRIES:
+                    break
+                self.retries += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            except Exception as e:
+                print(f"ERROR {method} to {chat_id}: {e}")
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+                return
+            self.sent += 1
+            if not future.done():
+                future.set_result(result)
             return
-        keyboard = [[InlineKeyboardButton(f"User {uid}", callback_data=f"detail_{uid}")] for uid in banned]
-        await query.edit_message_text("🚫 User Banned:", reply_markup=InlineKeyboardMarkup(keyboard))
+        print(f"ERROR {method} to {chat_id}: gave up after {self.MAX_RETRIES} retries")
+        self.failed += 1
+        if not future.done():
+            future.set_exception(RuntimeError("send retries exhausted"))
 
 
-# ---------------------------
-# Admin detail handler (click user)
-# ---------------------------
-async def admin_detail_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    admin_id = query.from_user.id
+def _consume_exception(future: asyncio.Future):
+    # errors are already logged by the worker; callers may ignore the future
+    if not future.cancelled():
+        future.exception()
 
-    if admin_id not in ADMIN_IDS:
-        await query.edit_message_text("❌ Kamu bukan admin.")
-        return
 
-    parts = query.data.split("_", 1)
-    if len(parts) != 2:
-        await query.edit_message_text("⚠️ Data tidak valid.")
-        return
+outbox = Outbox(SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_WORKERS)
 
-    try:
-        target_id = int(parts[1])
-    except ValueError:
-        await query.edit_message_text("⚠️ ID user tidak valid.")
-        return
 
-    await show_user_profile(context, admin_id, target_id)
+class BulkNotifier:
+    """
+    Low-priority queue for notices from bulk admin operations. One task
+    feeds them to the outbox at `rate` per second, and only while the
+    outbox is nearly empty, so approving 10k users never queues ahead of
+    live chat messages. Items are plain (chat_id, text, with_menu) so they
+    fit in the restart checkpoint; the menu keyboard is attached at send time.
+    """
 
+    def __init__(self, rate: float = BULK_SEND_RATE):
+        self.rate = rate
+        self._queue = deque()
+        self._wake = None
+        self._task = None
 
-# ---------------------------
-# Admin button actions (approve/reject/ban/unban)
-# Note: this handler accepts both verification buttons and ban/unban
-# ---------------------------
-async def admin_action_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    parts = query.data.split("_", 1)
-    action = parts[0]
+    def __len__(self):
+        return len(self._queue)
 
-    if len(parts) != 2:
-        await query.edit_message_text("❌ Data tidak valid.")
-        return
+    def send(self, chat_id: int, text: str, with_menu: bool = False):
+        self._queue.append((chat_id, text, with_menu))
+        if self._wake is not None:
+            self._wake.set()
 
-    try:
-        target_id = int(parts[1])
-    except ValueError:
-        await query.edit_message_text("❌ ID user tidak valid.")
-        return
+    def pending(self) -> list:
+        return list(self._queue)
 
-    ensure_user(target_id)
+    def start(self):
+        self._wake = asyncio.Event()
+        self._wake.set()
+        self._task = asyncio.create_task(self._run())
 
-    if action == "approve":
-        users[target_id]["verified"] = True
-        await query.edit_message_text(f"✅ User {target_id} diverifikasi.")
-        try:
-            await context.bot.send_message(target_id, "🎉 Profil kamu sudah diverifikasi!")
-            await show_main_menu(context=context, chat_id=target_id)
-        except:
-            pass
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
 
-    elif action == "reject":
-        users[target_id]["verified"] = False
-        await query.edit_message_text(f"❌ User {target_id} ditolak.")
-        try:
-            await context.bot.send_message(target_id, "⚠️ Verifikasi kamu ditolak. Silakan coba lagi.")
-        except:
-            pass
+    async def _run(self):
+        bucket = TokenBucket(self.rate, max(1.0, self.rate))
+        while True:
+            if not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            if outbox.depth > outbox.workers:
+                await asyncio.sleep(0.1)  # live traffic first
+                continue
+            delay = bucket.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            chat_id, text, with_menu = self._queue.popleft()
+            if with_menu:
+                outbox.send(chat_id, text, reply_markup=MENU_MARKUPS[cari_doi_window.is_open()])
+            else:
+                outbox.send(chat_id, text)
 
-    elif action == "ban":
-        users[target_id]["banned"] = True
-        await query.edit_message_text(f"🚫 User {target_id} telah diblokir oleh admin.")
-        try:
-            await context.bot.send_message(target_id, "⚠️ Kamu telah diblokir oleh admin dan tidak bisa lagi menggunakan bot.")
-        except:
-            pass
 
-    elif action == "unban":
-        users[target_id]["banned"] = False
-        await query.edit_message_text(f"✅ User {target_id} telah di-unban oleh admin.")
-        try:
-            await context.bot.send_message(target_id, "✅ Kamu sudah di-unban oleh admin. Silakan gunakan bot kembali.")
-        except:
-            pass
+bulk = BulkNotifier()
 
 
 # ---------------------------
-# Manual ban/unban commands
+# Persistent storage (SQLite WAL, write-behind)
 # ---------------------------
-async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    admin_id = update.effective_user.id
-    if admin_id not in ADMIN_IDS:
-        await safe_reply(update, "❌ Kamu bukan admin.")
-        return
+class Storage:
+    """
+    SQLite store for users and per-pair chat logs.
+    Writes are queued in memory (latest user row wins) and flushed in
+    batches by a background thread, so handlers never wait on disk.
+    """
 
-    if not context.args:
-        await safe_reply(update, "⚠️ Gunakan format: /ban <user_id>")
-        return
+    shared = False  # only this process reads and writes the store
 
-    try:
-        target_id = int(context.args[0])
-    except ValueError:
-        await safe_reply(update, "⚠️ User ID harus berupa angka.")
-        return
+    def __init__(self, path: str, flush_interval: float = 0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, verified INTEGER, university TEXT, "
+            "gender TEXT, age INTEGER, banned INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pair_logs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_a INTEGER, user_b INTEGER, sender INTEGER, message TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pair_logs_pair ON pair_logs (user_a, user_b, id)")
+        # lookups on the event loop get their own connection: WAL lets it read while a flush is writing
+        self._read_conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._db_lock = threading.Lock()  # serializes use of the shared connection
+        self._read_lock = threading.Lock()  # same for _read_conn; never held across a write
+        self._lock = threading.Lock()  # protects the pending buffers
+        self._pending_users = {}  # user_id -> row tuple
+        self._flushing_users = {}  # rows of the batch being written, visible until it is committed
+        self._pending_chats = []  # (user_a, user_b, sender_id, message)
+        self._pending_drops = set()  # pairs whose log should be deleted
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+        self._thread.start()
 
-    ensure_user(target_id)
-    users[target_id]["banned"] = True
-    await safe_reply(update, f"✅ User {target_id} berhasil diblokir.")
-    try:
-        await context.bot.send_message(target_id, "⚠️ Kamu telah diblokir oleh admin dan tidak bisa lagi menggunakan bot.")
-    except:
-        pass
+    # --- reads (primary key lookups, cheap enough to do inline) ---
+    def load_user(self, user_id: int) -> Optional[User]:
+        with self._lock:
+            row = self._pending_users.get(user_id)
+            if row is None:
+                row = self._flushing_users.get(user_id)
+        if row is None:
+            with self._read_lock:
+                row = self._read_conn.execute(
+                    "SELECT verified, university, gender, age, banned FROM users WHERE user_id = ?", (user_id,)
+                ).fetchone()
+        if row is None:
+            return None
+        return self._row_user(row)
 
+    @staticmethod
+    def _row_user(row: tuple) -> User:
+        verified, university, gender, age, banned = row
+        return User(
+            verified=bool(verified),
+            university=University(university) if university else None,
+            gender=Gender(gender) if gender else None,
+            age=age,
+            banned=bool(banned),
+        )
 
-async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    admin_id = update.effective_user.id
-    if admin_id not in ADMIN_IDS:
-        await safe_reply(update, "❌ Kamu bukan admin.")
-        return
+    def iter_users(self, batch: int = 1000):
+        """Yield (user_id, User) for every stored user in id order, one short query per batch."""
+        self.flush()
+        last = -1
+        while True:
+            with self._db_lock:
+                rows = self._conn.execute(
+                    "SELECT user_id, verified, university, gender, age, banned FROM users "
+                    "WHERE user_id > ? ORDER BY user_id LIMIT ?", (last, batch),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], self._row_user(row[1:])
+            last = rows[-1][0]
 
-    if not context.args:
-        await safe_reply(update, "⚠️ Gunakan format: /unban <user_id>")
-        return
+    def load_chat_log(self, pair: tuple) -> list:
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT sender, message FROM pair_logs WHERE user_a = ? AND user_b = ? ORDER BY id DESC LIMIT ?",
+                pair + (CHAT_LOG_LIMIT,),
+            ).fetchall()
+        return rows[::-1]
 
-    try:
-        target_id = int(context.args[0])
-    except ValueError:
-        await safe_reply(update, "⚠️ User ID harus berupa angka.")
-        return
+    def iter_status(self):
+        """Yield (user_id, verified, banned) for every stored user."""
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT user_id, verified, banned FROM users").fetchall()
+        for user_id, verified, banned in rows:
+            yield user_id, bool(verified), bool(banned)
 
-    ensure_user(target_id)
-    users[target_id]["banned"] = False
+    def status_ids(self) -> tuple:
+        """(all, verified, banned) user id lists; three JSON arrays parse far faster than 100k row tuples."""
+        self.flush()
+        with self._db_lock:
+            arrays = self._conn.execute(
+                "SELECT json_group_array(user_id), json_group_array(user_id) FILTER (WHERE verified), "
+                "json_group_array(user_id) FILTER (WHERE banned) FROM users"
+            ).fetchone()
+        return tuple(json.loads(array) for array in arrays)
+
+    def pending_ids(self) -> list:
+        """Unverified, non-banned users with a complete profile: registrations still waiting for an admin."""
+        self.flush()
+        with self._db_lock:
+            array = self._conn.execute(
+                "SELECT json_group_array(user_id) FROM users WHERE NOT verified AND NOT banned "
+                "AND university IS NOT NULL AND gender IS NOT NULL AND age IS NOT NULL"
+            ).fetchone()[0]
+        return json.loads(array)
+
+    # --- writes (buffered) ---
+    def save_user(self, user_id: int, u: User):
+        row = (
+            u.verified,
+            u.university.value if u.university else None,
+            u.gender.value if u.gender else None,
+            u.age,
+            u.banned,
+        )
+        with self._lock:
+            self._pending_users[user_id] = row
+        self._wake.set()
+
+    def save_chat(self, pair: tuple, sender_id: int, message: str):
+        with self._lock:
+            self._pending_chats.append(pair + (sender_id, message))
+        self._wake.set()
+
+    def drop_chat_log(self, pair: tuple):
+        with self._lock:
+            # messages queued before the drop must not resurrect the log
+            self._pending_chats = [c for c in self._pending_chats if c[:2] != pair]
+            self._pending_drops.add(pair)
+        self._wake.set()
+
+    def flush(self):
+        # hold _db_lock across swap + write so concurrent flushes keep insert order
+        with self._db_lock:
+            with self._lock:
+                pending_users, self._pending_users = self._pending_users, {}
+                pending_chats, self._pending_chats = self._pending_chats, []
+                pending_drops, self._pending_drops = self._pending_drops, set()
+                self._flushing_users = pending_users
+            if not pending_users and not pending_chats and not pending_drops:
+                return
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO users (user_id, verified, university, gender, age, banned) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(uid,) + row for uid, row in pending_users.items()],
+                )
+                conn.executemany("DELETE FROM pair_logs WHERE user_a = ? AND user_b = ?", pending_drops)
+                conn.executemany(
+                    "INSERT INTO pair_logs (user_a, user_b, sender, message) VALUES (?, ?, ?, ?)", pending_chats
+                )
+                # keep only the last CHAT_LOG_LIMIT rows for every touched pair
+                conn.executemany(
+                    "DELETE FROM pair_logs WHERE user_a = ? AND user_b = ? AND id <= "
+                    "(SELECT id FROM pair_logs WHERE user_a = ? AND user_b = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    [pair + pair + (CHAT_LOG_LIMIT,) for pair in {c[:2] for c in pending_chats}],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                with self._lock:
+                    self._flushing_users = {}
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"ERROR flushing storage: {e}")
+            # coalesce: let more writes pile up before the next batch
+            time.sleep(self.flush_interval)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+        with self._read_lock:
+            self._read_conn.close()
+
+
+def load_script(client, source: str):
+    """Register a Lua script and load it now: fails fast without Lua support, no NOSCRIPT retry later."""
+    client.script_load(source)
+    return client.register_script(source)
+
+
+class RedisStore:
+    """
+    Users and chat logs in Redis, shared by every worker process.
+    Writes go straight through (no local buffer) because other workers read
+    the same keys. partner is owned by the atomic match/unpair scripts and
+    searching by the shared search pool, so save_user() never touches them.
+    """
+
+    shared = True  # other processes change the same records; never trust the local cache
+
+    _UNPAIR = """
+    if redis.call('HGET', 'user:' .. ARGV[1], 'partner') == ARGV[2] then
+        redis.call('HDEL', 'user:' .. ARGV[1], 'partner')
+    end
+    if redis.call('HGET', 'user:' .. ARGV[2], 'partner') == ARGV[1] then
+        redis.call('HDEL', 'user:' .. ARGV[2], 'partner')
+    end
+    """
+
+    def __init__(self, client):
+        self._r = client  # redis.Redis(decode_responses=True) or anything speaking its protocol
+        self._unpair = load_script(client, self._UNPAIR)
+
+    # --- reads ---
+    def load_user(self, user_id: int) -> Optional[User]:
+        pipe = self._r.pipeline(transaction=False)
+        pipe.hgetall(f"user:{user_id}")
+        pipe.hexists("pool:where", user_id)
+        row, searching = pipe.execute()
+        if not row:
+            return None
+        return self._row_user(row, bool(searching))
+
+    @staticmethod
+    def _row_user(row: dict, searching: bool = False) -> User:
+        return User(
+            verified=row.get("verified") == "1",
+            partner=int(row["partner"]) if row.get("partner") else None,
+            university=University(row["university"]) if row.get("university") else None,
+            gender=Gender(row["gender"]) if row.get("gender") else None,
+            age=int(row["age"]) if row.get("age") else None,
+            searching=searching,
+            banned=row.get("banned") == "1",
+        )
+
+    def iter_users(self, batch: int = 1000):
+        """Yield (user_id, User) for every stored user, one pipelined round trip per batch."""
+        user_ids = (int(user_id) for user_id in self._r.sscan_iter("users", count=batch))
+        while True:
+            chunk = list(itertools.islice(user_ids, batch))
+            if not chunk:
+                return
+            pipe = self._r.pipeline(transaction=False)
+            for user_id in chunk:
+                pipe.hgetall(f"user:{user_id}")
+            for user_id, row in zip(chunk, pipe.execute()):
+                if row:
+                    yield user_id, self._row_user(row)
+
+    def load_chat_log(self, pair: tuple) -> list:
+        return [tuple(json.loads(entry)) for entry in self._r.lrange("chat:%d:%d" % pair, 0, -1)]
+
+    def iter_status(self):
+        """Yield (user_id, verified, banned) for every stored user."""
+        batch = []
+        for user_id in self._r.sscan_iter("users", count=1000):
+            batch.append(int(user_id))
+            if len(batch) == 1000:
+                yield from self._status_batch(batch)
+                batch = []
+        yield from self._status_batch(batch)
+
+    def _status_batch(self, user_ids: list):
+        pipe = self._r.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hmget(f"user:{user_id}", "verified", "banned")
+        for user_id, (verified, banned) in zip(user_ids, pipe.execute()):
+            yield user_id, verified == "1", banned == "1"
+
+    def pending_ids(self) -> list:
+        """Unverified, non-banned users with a complete profile: registrations still waiting for an admin."""
+        pending = []
+        user_ids = (int(user_id) for user_id in self._r.sscan_iter("users", count=1000))
+        while True:
+            chunk = list(itertools.islice(user_ids, 1000))
+            if not chunk:
+                return pending
+            pipe = self._r.pipeline(transaction=False)
+            for user_id in chunk:
+                pipe.hmget(f"user:{user_id}", "verified", "banned", "university", "gender", "age")
+            for user_id, (verified, banned, *profile) in zip(chunk, pipe.execute()):
+                if verified != "1" and banned != "1" and all(profile):
+                    pending.append(user_id)
+
+    # --- writes (immediate) ---
+    def save_user(self, user_id: int, u: User):
+        pipe = self._r.pipeline(transaction=False)
+        pipe.hset(f"user:{user_id}", mapping={
+            "verified": int(bool(u.verified)),
+            "university": u.university.value if u.university else "",
+            "gender": u.gender.value if u.gender else "",
+            "age": u.age or "",
+            "banned": int(bool(u.banned)),
+        })
+        pipe.sadd("users", user_id)
+        pipe.execute()
+
+    def unpair(self, user_id: int, partner_id: int):
+        """Clear both partner links, but only where they still point at each other."""
+        self._unpair(args=[user_id, partner_id])
+
+    def save_chat(self, pair: tuple, sender_id: int, message: str):
+        key = "chat:%d:%d" % pair
+        pipe = self._r.pipeline(transaction=False)
+        pipe.rpush(key, json.dumps([sender_id, message]))
+        pipe.ltrim(key, -CHAT_LOG_LIMIT, -1)
+        pipe.expire(key, int(PAIR_IDLE_TTL) + 1)  # the TTL doubles as the pair's last-activity time
+        pipe.execute()
+
+    def idle_for(self, pair: tuple) -> Optional[float]:
+        """Seconds since the pair's last message on any worker, or None if they never wrote."""
+        ttl = self._r.ttl("chat:%d:%d" % pair)
+        return None if ttl < 0 else int(PAIR_IDLE_TTL) + 1 - ttl
+
+    def drop_chat_log(self, pair: tuple):
+        self._r.delete("chat:%d:%d" % pair)
+
+    def flush(self):
+        pass  # nothing is buffered
+
+    def close(self):
+        self._r.close()
+
+
+storage = None  # Storage or RedisStore, set by init_storage()/init_shared_state(); None = in-memory only
+redis_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="redis")  # shared state: handlers' Redis round trips
+
+
+def shared_state() -> bool:
+    """True when other worker processes share users, the search pool and chat logs."""
+    return storage is not None and storage.shared
+
+
+async def shared_call(func, *args, **kwargs):
+    """
+    Run func (anything that reads or changes users, the pool or stats) and
+    return its result. With shared state it runs on the redis_io thread, so
+    its round trips don't block the event loop, and one thread keeps them in
+    the order they were issued (an unpair lands before the next match).
+    Otherwise it runs inline: local state is plain dicts.
+    """
+    if not shared_state():
+        return func(*args, **kwargs)
+    context = contextvars.copy_context()  # record() reads event_actor
+    return await asyncio.wrap_future(redis_io.submit(context.run, func, *args, **kwargs))
+
+
+def shared_post(func, *args):
+    """shared_call() for writes nobody waits for: queued behind earlier calls, errors logged."""
+    if not shared_state():
+        func(*args)
+        return
+    redis_io.submit(contextvars.copy_context().run, func, *args).add_done_callback(_log_shared_error)
+
+
+def _log_shared_error(future):
+    if future.exception() is not None:
+        print(f"ERROR shared state write: {future.exception()}")
+
+
+def init_storage(path: str = DB_PATH):
+    """Open storage and seed counters + list indexes from stored statuses (records load lazily)."""
+    global storage
+    if not path:
+        return
+    storage = Storage(path, DB_FLUSH_INTERVAL)
+    stats.add_verified(seed_indexes(*storage.status_ids()))
+    seed_pending(storage.pending_ids())
+
+
+def init_shared_state(client):
+    """Keep users, the search pool, chat logs and counters in Redis so several workers can run at once."""
+    global storage, search_pool, stats
+    storage = RedisStore(client)
+    search_pool = RedisMatchEngine(client)
+    stats = SharedStats(client)
+    verified = seed_indexes(*split_statuses(storage.iter_status()))
+    client.setnx(SharedStats.KEY, verified)  # first worker seeds it; later ones keep the live value
+    # every worker lists them, but only the first one up within a minute sends the reminder digest
+    seed_pending(storage.pending_ids(), remind=client.set("pending:reminded", 1, nx=True, ex=60))
+
+
+def persist_user(user_id: int):
+    if storage:
+        storage.save_user(user_id, users[user_id])
+
+
+def get_user(user_id: int) -> Optional[User]:
+    """Return the user record (loaded from storage on first access) without creating one."""
+    if shared_state():
+        # another worker may have changed it; the local dict is only this update's snapshot
+        u = storage.load_user(user_id)
+        if u is not None:
+            users[user_id] = u
+        return u
+    u = users.get(user_id)
+    if u is None and storage:
+        u = storage.load_user(user_id)
+        if u is not None:
+            users[user_id] = u
+    return u
+
+
+def get_users(user_ids) -> list:
+    return [get_user(user_id) for user_id in user_ids]
+
+
+def ensure_user(user_id: int) -> User:
+    """Ensure user record exists (loaded from storage on first access)."""
+    u = get_user(user_id)
+    if u is None:
+        u = users[user_id] = User()
+        index_user(user_id, False, False)
+        persist_user(user_id)
+        record("register", user_id)
+    return u
+
+
+# ---------------------------
+# Search pool (antrian user yang sedang mencari partner)
+# ---------------------------
+class IndexedSet:
+    """Set of user ids with O(1) add/remove and O(page size) positional slicing."""
+
+    def __init__(self):
+        self._items = []  # user ids, dense list
+        self._pos = {}  # user_id -> index in _items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, user_id):
+        return user_id in self._pos
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def add(self, user_id: int) -> bool:
+        if user_id in self._pos:
+            return False
+        self._pos[user_id] = len(self._items)
+        self._items.append(user_id)
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        idx = self._pos.pop(user_id, None)
+        if idx is None:
+            return False
+        # swap-pop: move last item into the freed slot
+        last = self._items.pop()
+        if last != user_id:
+            self._items[idx] = last
+            self._pos[last] = idx
+        return True
+
+    def extend(self, user_ids):
+        """add() for many ids; one list + dict build while the set is still empty (startup seeding)."""
+        if self._items:
+            for user_id in user_ids:
+                self.add(user_id)
+            return
+        self._pos = dict.fromkeys(user_ids)  # also drops duplicates
+        self._items = list(self._pos)
+        self._pos.update(zip(self._items, range(len(self._items))))
+
+    def slice(self, start: int, stop: int) -> list:
+        return self._items[start:stop]
+
+
+class SearchPool(IndexedSet):
+    """Waiting pool with O(1) add, remove and pick (random or FIFO)."""
+
+    def __init__(self):
+        super().__init__()
+        self._order = OrderedDict()  # user_id -> None, in arrival order
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def add(self, user_id: int) -> bool:
+        if not super().add(user_id):
+            return False
+        self._order[user_id] = None
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        if not super().discard(user_id):
+            return False
+        del self._order[user_id]
+        return True
+
+    def pop(self, mode: str = "random") -> Optional[int]:
+        if not self._items:
+            return None
+        if mode == "fifo":
+            user_id = next(iter(self._order))
+        else:
+            user_id = self._items[random.randrange(len(self._items))]
+        self.discard(user_id)
+        return user_id
+
+
+@dataclass(frozen=True, slots=True)
+class SearchPrefs:
+    """What a searching user accepts in a partner (None = any)."""
+
+    partner_gender: Optional[Gender] = None
+    age_min: int = AGE_MIN
+    age_max: int = AGE_MAX
+    university: Optional[University] = None
+
+    def accepts(self, gender, university, age) -> bool:
+        if self.partner_gender is not None and gender != self.partner_gender:
+            return False
+        if self.university is not None and university != self.university:
+            return False
+        if (self.age_min, self.age_max) != (AGE_MIN, AGE_MAX):
+            return age is not None and self.age_min <= age <= self.age_max
+        return True
+
+    def widened(self) -> Optional["SearchPrefs"]:
+        """Next fallback level: drop the age range, then the university. Gender stays."""
+        if (self.age_min, self.age_max) != (AGE_MIN, AGE_MAX):
+            return replace(self, age_min=AGE_MIN, age_max=AGE_MAX)
+        if self.university is not None:
+            return replace(self, university=None)
+        return None
+
+    def encode(self) -> str:
+        """Compact text form for the event log: "GENDER|age_min|age_max|UNIVERSITY" ("" = any)."""
+        return "%s|%d|%d|%s" % (
+            self.partner_gender.name if self.partner_gender else "", self.age_min, self.age_max,
+            self.university.name if self.university else "",
+        )
+
+    @classmethod
+    def decode(cls, text: str) -> "SearchPrefs":
+        gender, age_min, age_max, university = text.split("|")
+        return cls(Gender[gender] if gender else None, int(age_min), int(age_max),
+                   University[university] if university else None)
+
+
+DEFAULT_PREFS = SearchPrefs()
+
+
+class MatchEngine:
+    """
+    Search pool split into buckets keyed by (gender, university, age, prefs).
+    Only non-empty buckets are kept, so finding a mutually compatible
+    partner costs O(buckets) no matter how many users are waiting.
+    """
+
+    def __init__(self):
+        self._buckets = {}  # key -> SearchPool
+        self._where = {}  # user_id -> (key, enqueued_at)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, user_id):
+        return user_id in self._where
+
+    def __iter__(self):
+        return iter(self._where)
+
+    @staticmethod
+    def _key(user_id: int, prefs: SearchPrefs) -> tuple:
+        u = users[user_id]
+        return (u.gender, u.university, u.age, prefs)
+
+    def add(self, user_id: int, prefs: SearchPrefs = DEFAULT_PREFS, now: Optional[float] = None) -> bool:
+        if user_id in self._where:
+            return False
+        key = self._key(user_id, prefs)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = SearchPool()
+        bucket.add(user_id)
+        self._where[user_id] = (key, time.monotonic() if now is None else now)
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        entry = self._where.pop(user_id, None)
+        if entry is None:
+            return False
+        key = entry[0]
+        bucket = self._buckets[key]
+        bucket.discard(user_id)
+        if not bucket:
+            del self._buckets[key]
+        return True
+
+    def prefs_of(self, user_id: int) -> Optional[SearchPrefs]:
+        entry = self._where.get(user_id)
+        return entry[0][3] if entry else None
+
+    def find_partner(self, user_id: int, prefs: SearchPrefs = DEFAULT_PREFS, mode: str = "random") -> Optional[int]:
+        """Remove and return a waiting user compatible with user_id both ways, or None."""
+        u = users[user_id]
+        compatible = [
+            (key, bucket) for key, bucket in self._buckets.items()
+            if prefs.accepts(key[0], key[1], key[2]) and key[3].accepts(u.gender, u.university, u.age)
+        ]
+        if not compatible:
+            return None
+        if mode == "fifo":
+            # oldest head across all compatible buckets
+            _, bucket = min(compatible, key=lambda kb: self._where[next(iter(kb[1]))][1])
+        else:
+            # uniform over compatible users: pick a bucket weighted by its size
+            r = random.randrange(sum(len(b) for _, b in compatible))
+            for _, bucket in compatible:
+                if r < len(bucket):
+                    break
+                r -= len(bucket)
+        partner_id = bucket.pop(mode)
+        key, _ = self._where.pop(partner_id)
+        if not bucket:
+            del self._buckets[key]
+        return partner_id
+
+    def expired(self, max_wait: float, now: Optional[float] = None) -> list:
+        """Users waiting longer than max_wait whose prefs can still be widened (oldest first per bucket)."""
+        cutoff = (time.monotonic() if now is None else now) - max_wait
+        found = []
+        for key, bucket in self._buckets.items():
+            if key[3].widened() is None:
+                continue
+            for user_id in bucket:
+                if self._where[user_id][1] > cutoff:
+                    break
+                found.append(user_id)
+        return found
+
+    def widen(self, user_id: int, now: Optional[float] = None) -> Optional[int]:
+        """Relax user_id's prefs one level and try to match again. Returns partner id or None."""
+        key, enqueued_at = self._where[user_id]
+        prefs = key[3].widened()
+        self.discard(user_id)
+        partner_id = self.find_partner(user_id, prefs, MATCH_MODE)
+        if partner_id is None:
+            # re-queue with the new prefs; restart the clock for the next level
+            self.add(user_id, prefs, now)
+        return partner_id
+
+
+class RedisMatchEngine:
+    """
+    MatchEngine over Redis for several worker processes. Each bucket is a
+    sorted set scored by enqueue time; pool:buckets lists the non-empty ones
+    and pool:where maps user_id -> "<bucket>@<enqueued_at>". Compatibility is
+    filtered on the bucket names client side, then one Lua script pops the
+    partner and links both users, so two workers can never claim the same
+    person. Times are wall clock (time.time()) because workers may run on
+    different hosts.
+    """
+
+    _ADD = """
+    if redis.call('HEXISTS', 'pool:where', ARGV[1]) == 1 then return 0 end
+    if redis.call('HGET', 'user:' .. ARGV[1], 'partner') then return 0 end
+    redis.call('HSET', 'pool:where', ARGV[1], ARGV[2] .. '@' .. ARGV[3])
+    redis.call('ZADD', 'pool:b:' .. ARGV[2], ARGV[3], ARGV[1])
+    redis.call('SADD', 'pool:buckets', ARGV[2])
+    return 1
+    """
+
+    _DISCARD = """
+    local where = redis.call('HGET', 'pool:where', ARGV[1])
+    if not where then return 0 end
+    local bucket = string.match(where, '^(.*)@')
+    redis.call('HDEL', 'pool:where', ARGV[1])
+    redis.call('ZREM', 'pool:b:' .. bucket, ARGV[1])
+    if redis.call('ZCARD', 'pool:b:' .. bucket) == 0 then redis.call('SREM', 'pool:buckets', bucket) end
+    return 1
+    """
+
+    # ARGV: user_id, mode, random in [0, 1), candidate bucket names...
+    _MATCH = """
+    local uid = ARGV[1]
+    if redis.call('HEXISTS', 'pool:where', uid) == 1 then return false end
+    if redis.call('HGET', 'user:' .. uid, 'partner') then return false end
+    local names, sizes, total = {}, {}, 0
+    for i = 4, #ARGV do
+        local n = redis.call('ZCARD', 'pool:b:' .. ARGV[i])
+        if n > 0 then
+            names[#names + 1] = ARGV[i]
+            sizes[#sizes + 1] = n
+            total = total + n
+        end
+    end
+    if total == 0 then return false end
+    local bucket, index = nil, 0
+    if ARGV[2] == 'fifo' then
+        local oldest
+        for _, name in ipairs(names) do
+            local head = redis.call('ZRANGE', 'pool:b:' .. name, 0, 0, 'WITHSCORES')
+            local score = tonumber(head[2])
+            if oldest == nil or score < oldest then oldest, bucket = score, name end
+        end
+    else
+        local r = math.floor(tonumber(ARGV[3]) * total)
+        for i, name in ipairs(names) do
+            if r < sizes[i] then bucket, index = name, r break end
+            r = r - sizes[i]
+        end
+    end
+    local key = 'pool:b:' .. bucket
+    local partner = redis.call('ZRANGE', key, index, index)[1]
+    redis.call('ZREM', key, partner)
+    if redis.call('ZCARD', key) == 0 then redis.call('SREM', 'pool:buckets', bucket) end
+    redis.call('HDEL', 'pool:where', partner)
+    redis.call('HSET', 'user:' .. uid, 'partner', partner)
+    redis.call('HSET', 'user:' .. partner, 'partner', uid)
+    return partner
+    """
+
+    def __init__(self, client):
+        self._r = client
+        self._add = load_script(client, self._ADD)
+        self._discard = load_script(client, self._DISCARD)
+        self._match = load_script(client, self._MATCH)
+
+    def __len__(self):
+        return self._r.hlen("pool:where")
+
+    def __contains__(self, user_id):
+        return bool(self._r.hexists("pool:where", user_id))
+
+    def __iter__(self):
+        return (int(user_id) for user_id in self._r.hkeys("pool:where"))
+
+    @staticmethod
+    def _name(user_id: int, prefs: SearchPrefs) -> str:
+        u = users[user_id]
+        return "|".join((
+            u.gender.name if u.gender else "", u.university.name if u.university else "", str(u.age or ""),
+            prefs.partner_gender.name if prefs.partner_gender else "", str(prefs.age_min), str(prefs.age_max),
+            prefs.university.name if prefs.university else "",
+        ))
+
+    @staticmethod
+    def _parse(name: str) -> tuple:
+        """Bucket name -> (gender, university, age, prefs), the MatchEngine key."""
+        gender, university, age, partner_gender, age_min, age_max, prefs_university = name.split("|")
+        prefs = SearchPrefs(
+            Gender[partner_gender] if partner_gender else None, int(age_min), int(age_max),
+            University[prefs_university] if prefs_university else None,
+        )
+        return (Gender[gender] if gender else None, University[university] if university else None,
+                int(age) if age else None, prefs)
+
+    def add(self, user_id: int, prefs: SearchPrefs = DEFAULT_PREFS, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        return bool(self._add(args=[user_id, self._name(user_id, prefs), repr(now)]))
+
+    def discard(self, user_id: int) -> bool:
+        return bool(self._discard(args=[user_id]))
+
+    def prefs_of(self, user_id: int) -> Optional[SearchPrefs]:
+        where = self._r.hget("pool:where", user_id)
+        return self._parse(where.rpartition("@")[0])[3] if where else None
+
+    def find_partner(self, user_id: int, prefs: SearchPrefs = DEFAULT_PREFS, mode: str = "random") -> Optional[int]:
+        """Atomically pop a compatible waiting user and link both partners. Returns partner id or None."""
+        u = users[user_id]
+        candidates = []
+        for name in self._r.smembers("pool:buckets"):
+            gender, university, age, their_prefs = self._parse(name)
+            if prefs.accepts(gender, university, age) and their_prefs.accepts(u.gender, u.university, u.age):
+                candidates.append(name)
+        if not candidates:
+            return None
+        partner_id = self._match(args=[user_id, mode, repr(random.random())] + candidates)
+        return int(partner_id) if partner_id else None
+
+    def expired(self, max_wait: float, now: Optional[float] = None) -> list:
+        """Users waiting longer than max_wait whose prefs can still be widened (oldest first per bucket)."""
+        cutoff = (time.time() if now is None else now) - max_wait
+        names = [name for name in self._r.smembers("pool:buckets") if self._parse(name)[3].widened() is not None]
+        pipe = self._r.pipeline(transaction=False)
+        for name in names:
+            pipe.zrangebyscore(f"pool:b:{name}", "-inf", cutoff)
+        return [int(user_id) for found in pipe.execute() for user_id in found]
+
+    def widen(self, user_id: int, now: Optional[float] = None) -> Optional[int]:
+        """Relax user_id's prefs one level and try to match again. Returns partner id or None."""
+        prefs = self.prefs_of(user_id)
+        if prefs is None or not self.discard(user_id):
+            return None  # matched or widened by another worker meanwhile
+        prefs = prefs.widened()
+        partner_id = self.find_partner(user_id, prefs, MATCH_MODE)
+        if partner_id is None:
+            self.add(user_id, prefs, now)
+        return partner_id
+
+
+search_pool = MatchEngine()  # only verified, non-banned users with searching=True
+user_filters = {}  # user_id -> SearchPrefs set with /filter (age range, university)
+
+# admin panel list views: list name -> IndexedSet of user ids
+user_index = {
+    "users": IndexedSet(),
+    "verified": IndexedSet(),
+    "unverified": IndexedSet(),
+    "banned": IndexedSet(),
+}
+
+
+pending_verifications = IndexedSet()  # registered users waiting for admin approve/reject
+digest_new = 0  # verification requests since the last digest
+
+
+def seed_pending(user_ids: list, remind: bool = True):
+    """
+    Startup: registrations waiting for an admin are only known in memory and
+    the last digest may not have gone out before the restart, so re-list them
+    and (remind) send admins a digest of them at the next interval.
+    """
+    global digest_new
+    before = len(pending_verifications)
+    pending_verifications.extend(user_ids)
+    if remind:
+        digest_new += len(pending_verifications) - before
+
+
+def index_user(user_id: int, verified: bool, banned: bool):
+    """Put user_id into the admin list indexes matching its status."""
+    user_index["users"].add(user_id)
+    if verified:
+        user_index["verified"].add(user_id)
+        user_index["unverified"].discard(user_id)
+    else:
+        user_index["unverified"].add(user_id)
+        user_index["verified"].discard(user_id)
+    if banned:
+        user_index["banned"].add(user_id)
+    else:
+        user_index["banned"].discard(user_id)
+
+
+def split_statuses(statuses) -> tuple:
+    """(user_id, verified, banned) tuples -> the (all, verified, banned) id lists seed_indexes() takes."""
+    all_ids, verified_ids, banned_ids = [], [], []
+    for user_id, verified, banned in statuses:
+        all_ids.append(user_id)
+        if verified:
+            verified_ids.append(user_id)
+        if banned:
+            banned_ids.append(user_id)
+    return all_ids, verified_ids, banned_ids
+
+
+def seed_indexes(all_ids: list, verified_ids: list, banned_ids: list) -> int:
+    """index_user() for every stored user at startup, in bulk; returns the verified, non-banned count."""
+    verified, banned = set(verified_ids), set(banned_ids)
+    user_index["users"].extend(all_ids)
+    user_index["verified"].extend(verified_ids)
+    user_index["unverified"].extend([user_id for user_id in all_ids if user_id not in verified])
+    user_index["banned"].extend(banned_ids)
+    return len(verified - banned)
+
+
+def set_searching(user_id: int, value: bool, prefs: Optional[SearchPrefs] = None):
+    """Update the searching flag and keep search_pool in sync."""
+    u = users[user_id]
+    u.searching = value
+    if value and is_active(u):
+        prefs = prefs or DEFAULT_PREFS
+        if search_pool.add(user_id, prefs):
+            record("search", user_id, prefs.encode())
+    else:
+        if search_pool.discard(user_id):
+            record("unsearch", user_id)
+        search_started.pop(user_id, None)
+
+
+# ---------------------------
+# Stats registry (counter O(1) untuk /online dan layar pencarian)
+# ---------------------------
+class Stats:
+    """Incrementally maintained counters; reads are O(1)."""
+
+    def __init__(self):
+        self.verified = 0  # verified and not banned
+
+    def add_verified(self, delta: int):
+        self.verified += delta
+
+    @property
+    def searching(self) -> int:
+        # search_pool holds exactly the verified, non-banned, searching users
+        return len(search_pool)
+
+    def counts(self) -> tuple:
+        """(verified, searching) for the search screen and /online."""
+        return self.verified, self.searching
+
+
+class SharedStats(Stats):
+    """Stats whose counter lives in Redis, so every worker sees the same numbers."""
+
+    KEY = "stats:verified"
+
+    def __init__(self, client):
+        self._r = client
+
+    @property
+    def verified(self) -> int:
+        return int(self._r.get(self.KEY) or 0)
+
+    def add_verified(self, delta: int):
+        self._r.incrby(self.KEY, delta)
+
+
+stats = Stats()
+
+
+def is_active(u: User) -> bool:
+    return u.verified and not u.banned
+
+
+def update_user(user_id: int, **fields):
+    """Change user fields (verified, banned, profile) and keep stats + search_pool in sync."""
+    u = users[user_id]
+    was_active = is_active(u)
+    was_verified, was_banned = bool(u.verified), bool(u.banned)
+    for name, value in fields.items():
+        setattr(u, name, value)
+    if event_log:
+        if fields.keys() & {"gender", "university", "age"}:
+            record("profile", user_id, profile_arg(u))
+        if bool(u.verified) != was_verified:
+            record("approve" if u.verified else "unverify", user_id)
+        if bool(u.banned) != was_banned:
+            record("ban" if u.banned else "unban", user_id)
+    now_active = is_active(u)
+    if was_active != now_active:
+        stats.add_verified(1 if now_active else -1)
+    prefs = search_pool.prefs_of(user_id)
+    if fields.keys() & {"gender", "university", "age"}:
+        if search_pool.discard(user_id):  # bucket key depends on the profile
+            record("unsearch", user_id)
+    set_searching(user_id, u.searching and now_active, prefs)
+    if "verified" in fields or "banned" in fields:
+        index_user(user_id, bool(u.verified), bool(u.banned))
+    persist_user(user_id)
+
+
+def check_stats() -> list:
+    """Debug self-check: recount everything and return a list of mismatches."""
+    if storage:
+        # users are loaded lazily; every status change is persisted, so count the store
+        verified = sum(1 for _, v, b in storage.iter_status() if v and not b)
+    else:
+        verified = sum(1 for u in users.values() if is_active(u))
+    searching = {uid for uid, u in users.items() if u.searching and is_active(u)}
+    problems = []
+    if verified != stats.verified:
+        problems.append(f"verified: counter={stats.verified} recount={verified}")
+    if not shared_state() and searching != set(search_pool):  # shared: the cache only holds this worker's users
+        problems.append(f"searching: counter={stats.searching} recount={len(searching)}")
+    return problems
+
+
+def match_user(user_id: int, prefs: SearchPrefs = DEFAULT_PREFS) -> Optional[int]:
+    """Pair user with a compatible user from the pool, or enqueue them. Returns partner id or None."""
+    partner_id = search_pool.find_partner(user_id, prefs, MATCH_MODE)
+    analytics.search()
+    if partner_id is None:
+        set_searching(user_id, True, prefs)
+        if user_id in search_pool:
+            now = search_started[user_id] = time.monotonic()
+            timers.schedule(now + SEARCH_TTL, "search", user_id, now)
+        return None
+    pair_users(user_id, partner_id)
+    return partner_id
+
+
+def pair_users(user_id: int, partner_id: int):
+    # with shared state the match script already linked both; this refreshes the local copies
+    now = time.monotonic()
+    analytics.match(user_id, partner_id, now)  # reads the wait times set_searching() is about to drop
+    for a, b in ((user_id, partner_id), (partner_id, user_id)):
+        get_user(a).partner = b
+        set_searching(a, False)
+    record("pair", user_id, partner_id)
+    pair_activity[pair_key(user_id, partner_id)] = now
+    timers.schedule(now + PAIR_IDLE_TTL, "pair", pair_key(user_id, partner_id))
+
+
+def unpair_users(user_id: int, partner_id: int):
+    for uid in (user_id, partner_id):
+        u = users.get(uid)
+        if u is not None:
+            u.partner = None
+    if shared_state():
+        storage.unpair(user_id, partner_id)
+    record("unpair", user_id, partner_id)
+    pair_activity.pop(pair_key(user_id, partner_id), None)
+    moderation_flags.pop(pair_key(user_id, partner_id), None)
+    analytics.ended(pair_key(user_id, partner_id), time.monotonic())
+    drop_chat_log(user_id, partner_id)
+
+
+def widen_expired() -> list:
+    """Relax the filters of users who waited too long and retry matching them. Returns the new pairs."""
+    pairs = []
+    for user_id in search_pool.expired(MATCH_WIDEN_AFTER):
+        if user_id not in search_pool:
+            continue  # matched earlier in this pass
+        get_user(user_id)  # may have been queued by another worker
+        partner_id = search_pool.widen(user_id)
+        if partner_id:
+            pair_users(user_id, partner_id)
+            pairs.append((user_id, partner_id))
+        elif event_log:
+            record("search", user_id, search_pool.prefs_of(user_id).encode())  # re-queued with wider prefs
+    return pairs
+
+
+async def widen_searches():
+    for user_id, partner_id in await shared_call(widen_expired):
+        outbox.send(user_id, "💬 Partner ditemukan! Sekarang kamu bisa ngobrol anonim.")
+        outbox.send(partner_id, "💬 Partner ditemukan! Sekarang kamu bisa ngobrol anonim.")
+
+
+# ---------------------------
+# Reaper: search timeout + idle conversations (timer heap, no full scans)
+# ---------------------------
+class TimerHeap:
+    """Min-heap of deadlines. Entries are never removed early; stale ones are skipped when due."""
+
+    def __init__(self):
+        self._heap = []  # (deadline, seq, kind, key, stamp)
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, deadline: float, kind: str, key, stamp=None):
+        self._seq += 1
+        heapq.heappush(self._heap, (deadline, self._seq, kind, key, stamp))
+
+    def pop_due(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, kind, key, stamp = heapq.heappop(heap)
+            yield kind, key, stamp
+
+
+timers = TimerHeap()
+search_started = {}  # user_id -> monotonic time the current search began
+pair_activity = {}  # pair_key -> monotonic time of the last relayed message
+
+
+def expire_due(now: float) -> list:
+    """End searches older than SEARCH_TTL and pairs idle for PAIR_IDLE_TTL. Returns (chat_id, text) notices."""
+    notices = []
+    for kind, key, stamp in timers.pop_due(now):
+        if kind == "search":
+            if key not in search_pool or search_started.get(key) != stamp:
+                continue  # matched, stopped or restarted since
+            set_searching(key, False)
+            notices.append((key, "⌛ Pencarian dihentikan karena belum ada partner. Tekan 🔍 Find untuk mencari lagi."))
+        elif kind == "pair":
+            last = pair_activity.get(key)
+            a, b = key
+            if last is None or get_user(a).partner != b:
+                # ended (with shared state possibly on another worker, which never told us)
+                pair_activity.pop(key, None)
+                moderation_flags.pop(key, None)
+                continue
+            if shared_state():
+                idle = storage.idle_for(key)  # messages may have gone through other workers
+                if idle is not None:
+                    last = max(last, now - idle)
+            if last + PAIR_IDLE_TTL > now:
+                timers.schedule(last + PAIR_IDLE_TTL, "pair", key)  # active since; check again later
+                continue
+            unpair_users(a, b)
+            text = "⌛ Percakapan diakhiri karena tidak ada aktivitas. Gunakan /start untuk mencari partner baru."
+            notices += [(a, text), (b, text)]
+    return notices
+
+
+def send_notices(notices: list):
+    # one batch into the outbox; its workers fan the sends out under the rate limits
+    for chat_id, text in notices:
+        outbox.send(chat_id, text)
+
+
+def reap_expired(now: Optional[float] = None) -> int:
+    """expire_due() + send the notices. Returns how many were reaped."""
+    notices = expire_due(time.monotonic() if now is None else now)
+    send_notices(notices)
+    return len(notices)
+
+
+async def reap_expired_job():
+    send_notices(await shared_call(expire_due, time.monotonic()))
+
+
+# ---------------------------
+# Analytics: streaming aggregates for /stats (hourly slots, memory does not grow with traffic)
+# ---------------------------
+class DurationHistogram(Histogram):
+    """Histogram for waits and conversation lengths; bounds grow 25% per bucket, so quantile() is within 25%."""
+
+    __slots__ = ()
+
+    BOUNDS = tuple(round(1.25 ** i, 2) for i in range(42))  # 1 s ... ~3 h
+
+    def merge(self, other: "DurationHistogram"):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+
+class AnalyticsSlot:
+    """Counters and histograms of one clock hour."""
+
+    __slots__ = ("hour", "searches", "matched", "messages", "reports", "wait", "wait_by", "length",
+                 "length_messages")
+
+    def __init__(self, hour: int):
+        self.hour = hour  # unix time // 3600
+        self.searches = 0  # searches started (/find presses that matched or queued)
+        self.matched = 0  # users matched (two per pair)
+        self.messages = 0  # relayed messages
+        self.reports = 0
+        self.wait = DurationHistogram()
+        self.wait_by = {}  # "Laki-laki" / "Perempuan" / "UNNES" / "Non-UNNES" -> DurationHistogram
+        self.length = DurationHistogram()  # ended conversations
+        self.length_messages = 0  # messages in the ended conversations
+
+    def wait_of(self, label: str) -> DurationHistogram:
+        h = self.wait_by.get(label)
+        if h is None:
+            h = self.wait_by[label] = DurationHistogram()
+        return h
+
+    def merge(self, other: "AnalyticsSlot"):
+        self.searches += other.searches
+        self.matched += other.matched
+        self.messages += other.messages
+        self.reports += other.reports
+        self.wait.merge(other.wait)
+        for label, h in other.wait_by.items():
+            self.wait_of(label).merge(h)
+        self.length.merge(other.length)
+        self.length_messages += other.length_messages
+
+    def dump(self) -> tuple:
+        """marshal-friendly copy for the checkpoint."""
+        hists = [("", self.wait), ("length", self.length)] + [("wait:" + k, h) for k, h in self.wait_by.items()]
+        return (self.hour, self.searches, self.matched, self.messages, self.reports, self.length_messages,
+                {name: (h.counts, h.sum, h.count) for name, h in hists})
+
+    @classmethod
+    def load(cls, data: tuple) -> "AnalyticsSlot":
+        slot = cls(data[0])
+        slot.searches, slot.matched, slot.messages, slot.reports, slot.length_messages = data[1:6]
+        for name, (counts, total, count) in data[6].items():
+            h = slot.wait if name == "" else slot.length if name == "length" else slot.wait_of(name[5:])
+            h.counts, h.sum, h.count = list(counts), total, count
+        return slot
+
+
+class Analytics:
+    """
+    Rolling aggregates of the last ANALYTICS_HOURS clock hours, fed by the
+    match/relay/stop/report paths: a ring of hourly slots, each overwritten
+    when its hour comes round again. /stats merges the slots instead of
+    scanning users. Besides the fixed slots only open conversations are
+    tracked (start time + message count), like pair_activity.
+    """
+
+    def __init__(self, hours: int = ANALYTICS_HOURS):
+        self.hours = hours
+        self._slots = [AnalyticsSlot(-1) for _ in range(hours)]
+        self._open = {}  # pair_key -> [monotonic start, messages]
+
+    def _slot(self) -> AnalyticsSlot:
+        hour = int(time.time() // 3600)
+        slot = self._slots[hour % self.hours]
+        if slot.hour != hour:
+            slot.__init__(hour)
+        return slot
+
+    def search(self):
+        self._slot().searches += 1
+
+    def match(self, user_id: int, partner_id: int, now: float):
+        """Call before set_searching() drops search_started; no start time = matched on the spot."""
+        slot = self._slot()
+        slot.matched += 2
+        for uid in (user_id, partner_id):
+            started = search_started.get(uid)
+            wait = now - started if started is not None else 0.0
+            slot.wait.observe(wait)
+            u = users.get(uid)
+            if u is not None:
+                for label in (u.gender, u.university):
+                    if label is not None:
+                        slot.wait_of(str(label)).observe(wait)
+        self._open[pair_key(user_id, partner_id)] = [now, 0]
+
+    def relay(self, key: tuple):
+        self._slot().messages += 1
+        conversation = self._open.get(key)
+        if conversation is not None:
+            conversation[1] += 1
+
+    def report(self):
+        self._slot().reports += 1
+
+    def ended(self, key: tuple, now: float):
+        conversation = self._open.pop(key, None)
+        if conversation is None:
+            return  # started on another worker or before a restart without checkpoint
+        slot = self._slot()
+        slot.length.observe(now - conversation[0])
+        slot.length_messages += conversation[1]
+
+    def window(self) -> tuple:
+        """(merged totals, [hourly slots with activity, oldest first]) of the last self.hours hours."""
+        current = int(time.time() // 3600)
+        total = AnalyticsSlot(current)
+        hourly = sorted((s for s in self._slots if current - self.hours < s.hour <= current), key=lambda s: s.hour)
+        for slot in hourly:
+            total.merge(slot)
+        return total, [s for s in hourly if s.searches or s.matched]
+
+    def dump(self) -> tuple:
+        now = time.monotonic()
+        return ([s.dump() for s in self._slots if s.hour >= 0],
+                [(a, b, now - start, n) for (a, b), (start, n) in self._open.items()])
+
+    def load(self, data: tuple):
+        slots, conversations = data
+        for item in slots:
+            slot = AnalyticsSlot.load(item)
+            if slot.hour > self._slots[slot.hour % self.hours].hour:
+                self._slots[slot.hour % self.hours] = slot
+        now = time.monotonic()
+        for a, b, age, n in conversations:
+            if (a, b) in pair_activity:
+                self._open[(a, b)] = [now - age, n]
+
+
+analytics = Analytics()
+
+
+def format_duration(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "> 3 jam"
+    if seconds < 60:
+        return f"{seconds:.0f} dtk"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} mnt"
+    return f"{seconds / 3600:.1f} jam"
+
+
+def render_stats() -> str:
+    """/stats text from the analytics aggregates; cost depends on the slot count, not on users."""
+    total, hourly = analytics.window()
+
+    def quantiles(h: DurationHistogram) -> str:
+        return ", ".join(f"p{q * 100:.0f} ≈ {format_duration(h.quantile(q))}" for q in (0.5, 0.9, 0.99))
+
+    def rate(matched: int, searches: int) -> str:
+        return f"{min(matched / searches, 1.0) * 100:.0f}%" if searches else "-"
+
+    lines = [f"📊 Statistik {analytics.hours} jam terakhir" + (" (worker ini)" if shared_state() else ""),
+             f"🔍 Pencarian: {total.searches} | dapat partner: {total.matched} ({rate(total.matched, total.searches)})"]
+    if total.wait.count:
+        lines.append(f"⏳ Waktu tunggu: {quantiles(total.wait)}")
+        for label in ("Laki-laki", "Perempuan", "UNNES", "Non-UNNES"):
+            h = total.wait_by.get(label)
+            if h is not None and h.count:
+                lines.append(f"   • {label} ({h.count}): {quantiles(h)}")
+    ended = total.length.count
+    lines.append(f"💬 Percakapan selesai: {ended}")
+    if ended:
+        lines.append(f"   durasi rata-rata {format_duration(total.length.sum / ended)}, {quantiles(total.length)}")
+        lines.append(f"   rata-rata {total.length_messages / ended:.1f} pesan per percakapan")
+    lines.append(f"✉️ Pesan diteruskan: {total.messages} | 🚨 Laporan: {total.reports}")
+    if hourly:
+        lines.append("\n🕐 Per jam (pencarian → dapat partner):")
+        for slot in hourly:
+            label = datetime.fromtimestamp(slot.hour * 3600).strftime("%d/%m %H:00")
+            lines.append(f"   {label}  {slot.searches} → {rate(slot.matched, slot.searches)}")
+    return "\n".join(lines)
+
+
+# ---------------------------
+# Event log: append-only journal + snapshots (audit trail, fast restart)
+# ---------------------------
+# One event per state transition, written as a tab-separated line:
+#   seq  unix_time  kind  user_id  arg  actor
+EVENT_KINDS = frozenset((
+    "register",  # new user record
+    "profile",  # arg = "UNIVERSITY|GENDER|age" (enum names)
+    "approve", "unverify", "ban", "unban",
+    "search",  # entered the pool (or widened); arg = SearchPrefs.encode()
+    "unsearch",
+    "pair", "unpair",  # arg = partner id
+))
+event_actor = contextvars.ContextVar("event_actor", default=None)  # who sent the update being handled
+
+
+def profile_arg(u: User) -> str:
+    return "%s|%s|%s" % (
+        u.university.name if u.university else "", u.gender.name if u.gender else "", u.age or "",
+    )
+
+
+def apply_event(state: tuple, kind: str, user_id: int, arg: str):
+    """
+    Apply one event to a plain state (records, search):
+    records = user_id -> [verified, partner, university, gender, age, banned],
+    search = user_id -> encoded prefs. Used by the writer thread and by recovery.
+    """
+    records, search = state
+    rec = records.get(user_id)
+    if rec is None:
+        rec = records[user_id] = [False, None, "", "", None, False]
+    if kind == "search":
+        search[user_id] = arg
+    elif kind == "unsearch":
+        search.pop(user_id, None)
+    elif kind == "pair":
+        partner_id = int(arg)
+        other = records.get(partner_id)
+        if other is None:
+            other = records[partner_id] = [False, None, "", "", None, False]
+        rec[1], other[1] = partner_id, user_id
+        search.pop(user_id, None)
+        search.pop(partner_id, None)
+    elif kind == "unpair":
+        partner_id = int(arg)
+        if rec[1] == partner_id:
+            rec[1] = None
+        other = records.get(partner_id)
+        if other is not None and other[1] == user_id:
+            other[1] = None
+    elif kind == "profile":
+        rec[2], rec[3], age = arg.split("|")
+        rec[4] = int(age) if age else None
+    elif kind == "approve":
+        rec[0] = True
+    elif kind == "unverify":
+        rec[0] = False
+    elif kind == "ban":
+        rec[5] = True
+    elif kind == "unban":
+        rec[5] = False
+
+
+class EventLog:
+    """
+    Journal of typed state transitions in segment files named after their
+    first sequence number. append() only queues a tuple; a background
+    thread writes batches, applies them to its own copy of the state and,
+    every snapshot_every events, writes that copy as snapshot.bin and
+    starts a new segment. Recovery = snapshot + the segments after it.
+    Older segments are kept as the audit trail (safe to archive).
+    """
+
+    SNAPSHOT = "snapshot.bin"
+
+    def __init__(self, path: str, state: tuple, seq: int, tail: int = 0,
+                 snapshot_every: int = SNAPSHOT_EVERY, flush_interval: float = 0.5):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self.state = state  # owned by the writer thread from here on
+        self.seq = seq  # last sequence number handed out
+        self._written = seq  # last sequence number in the segment files
+        self._since_snapshot = tail
+        self._segment = self._open_segment(seq + 1)
+        self._io_lock = threading.Lock()  # serializes writes, snapshots and history reads
+        self._lock = threading.Lock()  # protects the pending buffer
+        self._pending = []  # (seq, time, kind, user_id, arg, actor)
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def segments(cls, path: str) -> list:
+        """(first seq, file path) of every segment, oldest first."""
+        found = []
+        for name in os.listdir(path):
+            if name.startswith("events-") and name.endswith(".log"):
+                found.append((int(name[7:-4]), os.path.join(path, name)))
+        return sorted(found)
+
+    @classmethod
+    def load(cls, path: str) -> tuple:
+        """Rebuild (state, last seq, events replayed) from the snapshot and the log tail."""
+        os.makedirs(path, exist_ok=True)
+        records, search, seq = {}, {}, 0
+        snapshot = os.path.join(path, cls.SNAPSHOT)
+        if os.path.exists(snapshot):
+            with open(snapshot, "rb") as f:
+                seq, records, search = marshal.loads(f.read())  # load(f) reads in tiny chunks
+        state = (records, search)
+        segments = cls.segments(path)
+        replayed = 0
+        for i, (first, file_path) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= seq + 1:
+                continue  # fully covered by the snapshot
+            with open(file_path, encoding="utf-8") as f:
+                for line in f:
+                    fields = line.split("\t")
+                    if len(fields) != 6 or not line.endswith("\n"):
+                        break  # torn write at crash time: the rest of this segment is lost
+                    event_seq = int(fields[0])
+                    if event_seq <= seq:
+                        continue
+                    apply_event(state, fields[2], int(fields[3]), fields[4])
+                    seq = event_seq
+                    replayed += 1
+        return state, seq, replayed
+
+    def _open_segment(self, first_seq: int):
+        return open(os.path.join(self.path, "events-%012d.log" % first_seq), "a", encoding="utf-8")
+
+    # --- writes (called on the event loop, never block) ---
+    def append(self, kind: str, user_id: int, arg="", actor: Optional[int] = None):
+        self.seq += 1
+        with self._lock:
+            self._pending.append((self.seq, time.time(), kind, user_id, arg, actor))
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            state = self.state
+            lines = []
+            for seq, ts, kind, user_id, arg, actor in pending:
+                lines.append("%d\t%d\t%s\t%d\t%s\t%s\n" % (seq, ts, kind, user_id, arg, "" if actor is None else actor))
+                apply_event(state, kind, user_id, str(arg))
+            self._segment.write("".join(lines))
+            self._segment.flush()
+            self._written = pending[-1][0]
+            self._since_snapshot += len(pending)
+            if self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+
+    def _snapshot(self):
+        """Write the state as of self._written atomically, then roll to a new segment."""
+        tmp = os.path.join(self.path, self.SNAPSHOT + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(marshal.dumps((self._written, self.state[0], self.state[1])))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, self.SNAPSHOT))
+        self._segment.close()
+        self._segment = self._open_segment(self._written + 1)
+        self._since_snapshot = 0
+
+    def snapshot(self):
+        self.flush()
+        with self._io_lock:
+            self._snapshot()
+
+    # --- audit reads (scan segments newest first; run off the event loop) ---
+    def history(self, user_id: int, limit: int = AUDIT_LIMIT) -> list:
+        """Last `limit` events about user_id (as subject or partner), oldest first."""
+        self.flush()
+        wanted = str(user_id)
+        found = []
+        with self._io_lock:
+            segments = self.segments(self.path)
+        for _, file_path in reversed(segments):
+            with open(file_path, encoding="utf-8") as f:
+                hits = [line.rstrip("\n").split("\t") for line in f if wanted in line]
+            hits = [h for h in hits if len(h) == 6 and (h[3] == wanted or (h[2] in ("pair", "unpair") and h[4] == wanted))]
+            found[:0] = hits
+            if len(found) >= limit:
+                break
+        return found[-limit:]
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"ERROR flushing event log: {e}")
+            time.sleep(self.flush_interval)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        self._segment.close()
+
+
+event_log = None  # EventLog, set by init_event_log(); None = no journal
+
+
+def record(kind: str, user_id: int, arg=""):
+    """Journal one state transition, attributed to the user whose update is being handled."""
+    if event_log:
+        event_log.append(kind, user_id, arg, event_actor.get())
+
+
+def restore_state(state: tuple):
+    """
+    Materialize recovered state: partners, the search pool and reaper
+    timers. In-memory mode also gets every user record and the counters;
+    with SQLite those load lazily as usual and only active users are touched.
+    """
+    records, search = state
+    now = time.monotonic()
+    statuses, pending = [], []
+    for user_id, (verified, partner, university, gender, age, banned) in records.items():
+        if storage is None:
+            users[user_id] = User(
+                verified=verified,
+                partner=partner,
+                university=University[university] if university else None,
+                gender=Gender[gender] if gender else None,
+                age=age,
+                banned=banned,
+            )
+            statuses.append((user_id, verified, banned))
+            if not verified and not banned and university and gender and age:
+                pending.append(user_id)
+        elif partner is not None or user_id in search:
+            u = get_user(user_id)
+            if u is None:
+                continue
+            u.partner = partner
+        if partner is not None and user_id < partner:
+            pair_activity[(user_id, partner)] = now
+            timers.schedule(now + PAIR_IDLE_TTL, "pair", (user_id, partner))
+    stats.add_verified(seed_indexes(*split_statuses(statuses)))
+    seed_pending(pending)
+    for user_id, prefs in search.items():
+        if user_id not in users:
+            continue
+        set_searching(user_id, True, SearchPrefs.decode(prefs))
+        if user_id in search_pool:
+            search_started[user_id] = now
+            timers.schedule(now + SEARCH_TTL, "search", user_id, now)
+
+
+def init_event_log(path: str = EVENT_LOG_DIR):
+    """Recover state from the snapshot + log tail, then journal every transition."""
+    global event_log
+    if not path:
+        return
+    started = time.perf_counter()
+    state, seq, replayed = EventLog.load(path)
+    restore_state(state)
+    event_log = EventLog(path, state, seq, replayed, flush_interval=DB_FLUSH_INTERVAL)
+    print(f"📜 Event log: {len(state[0])} user, {len(search_pool)} mencari, {replayed} event diputar ulang "
+          f"dalam {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+# ---------------------------
+# Restart checkpoint: pairs, search pool and unsent messages survive a restart
+# ---------------------------
+def checkpoint_state() -> tuple:
+    """Pairs, search pool and pending verifications in apply_event()'s state shape (records only for those users)."""
+    records, search = {}, {}
+    active = [uid for pair in pair_activity for uid in pair]
+    active += list(search_pool)
+    if not storage:
+        # with storage their profiles are already stored (and seeded ones are never loaded into users)
+        active += list(pending_verifications)
+    for user_id in active:
+        u = users[user_id]
+        records[user_id] = [
+            bool(u.verified), u.partner, u.university.name if u.university else "",
+            u.gender.name if u.gender else "", u.age, bool(u.banned),
+        ]
+        prefs = search_pool.prefs_of(user_id)
+        if prefs is not None:
+            search[user_id] = prefs.encode()
+    return records, search
+
+
+def write_checkpoint(path: str = CHECKPOINT_PATH) -> dict:
+    """Atomically write pairs, the search pool, pending verifications and unsent calls. Returns what was saved."""
+    # the event log or Redis already hold pairs and the pool; the outbox and pending list are ours alone
+    records, search = ({}, {}) if event_log or shared_state() else checkpoint_state()
+    calls, dropped = [], 0
+    for call in outbox.pending_calls():
+        try:
+            marshal.dumps(call)
+        except ValueError:
+            dropped += 1  # keyboards, album media: objects marshal can't store
+            continue
+        calls.append(call)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(marshal.dumps({"time": time.time(), "records": records, "search": search, "outbox": calls,
+                               "bulk": bulk.pending(), "analytics": analytics.dump(),
+                               "pending": list(pending_verifications), "digest_new": digest_new}))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"pairs": len(pair_activity), "searching": len(search), "messages": len(calls) + len(bulk),
+            "pending": len(pending_verifications), "dropped": dropped}
+
+
+def restore_checkpoint(path: str = CHECKPOINT_PATH) -> Optional[dict]:
+    """Restore the last clean shutdown's checkpoint (once) and re-queue its unsent calls. Needs the event loop."""
+    global digest_new
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = marshal.loads(f.read())
+    os.replace(path, path + ".restored")  # after a crash the next start must not revive these pairs
+    records, search = data["records"], data["search"]
+    if time.time() - data["time"] > PAIR_IDLE_TTL:
+        # down longer than any pair may idle: the reaper would end them all anyway; keep everything else
+        records = {user_id: [rec[0], None] + rec[2:] for user_id, rec in records.items()}
+        search = {}
+    restore_state((records, search))
+    analytics.load(data.get("analytics", ([], [])))  # after the pairs: only their conversations are kept
+    if "pending" in data:
+        pending_verifications.extend(user_id for user_id in data["pending"] if get_user(user_id) is not None)
+        digest_new = data["digest_new"]  # the exact count replaces the reminder seed_pending() queued
+    for chat_id, method, kwargs in data["outbox"]:
+        outbox.call(chat_id, method, **kwargs)
+    for item in data.get("bulk", ()):
+        bulk.send(*item)
+    return {"pairs": len(pair_activity), "searching": len(search_pool), "messages": len(data["outbox"]) + len(bulk),
+            "pending": len(pending_verifications)}
+
+
+# ---------------------------
+# Chat log ring buffers (satu per pasangan)
+# ---------------------------
+class ChatRing:
+    """Fixed-capacity ring of (sender_id, message); append is O(1), never reallocates."""
+
+    __slots__ = ("_buf", "_start", "_len")
+
+    def __init__(self, capacity: int = CHAT_LOG_LIMIT):
+        self._buf = [None] * capacity
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, entry: tuple):
+        cap = len(self._buf)
+        if self._len < cap:
+            self._buf[(self._start + self._len) % cap] = entry
+            self._len += 1
+        else:
+            self._buf[self._start] = entry
+            self._start = (self._start + 1) % cap
+
+    def view(self):
+        """Iterate entries oldest-first straight from the buffer (no copy). Consume before the next await."""
+        buf, start, cap = self._buf, self._start, len(self._buf)
+        for i in range(self._len):
+            yield buf[(start + i) % cap]
+
+
+def pair_key(a: int, b: int) -> tuple:
+    return (a, b) if a < b else (b, a)
+
+
+def save_chat(sender_id: int, partner_id: int, message: str):
+    """Save one message for the pair (last 20 entries, stored once per conversation)."""
+    key = pair_key(sender_id, partner_id)
+    if shared_state():
+        storage.save_chat(key, sender_id, message)  # the partner's worker appends to the same log
+        return
+    ring = chat_logs.get(key)
+    if ring is None:
+        ring = chat_logs[key] = ChatRing()
+        if len(chat_logs) > CHAT_LOG_MAX_PAIRS:
+            chat_logs.popitem(last=False)  # evict least recently active pair
+    else:
+        chat_logs.move_to_end(key)
+    ring.append((sender_id, message))
+    if storage:
+        storage.save_chat(key, sender_id, message)
+
+
+# what each media type is called in the chat log (first match wins)
+MEDIA_LABELS = (
+    ("photo", "foto"), ("video", "video"), ("animation", "GIF"), ("sticker", "stiker"), ("voice", "voice"),
+    ("video_note", "video bulat"), ("audio", "audio"), ("document", "dokumen"), ("location", "lokasi"),
+    ("contact", "kontak"), ("poll", "polling"), ("dice", "dadu"),
+)
+
+
+def chat_log_entry(msg) -> str:
+    """Text as-is; media as a short placeholder such as "[foto] caption" so logs and /report stay small."""
+    if msg.text is not None:
+        return msg.text
+    label = next((label for attr, label in MEDIA_LABELS if getattr(msg, attr, None)), "pesan")
+    if msg.sticker and msg.sticker.emoji:
+        label += f" {msg.sticker.emoji}"
+    caption = msg.caption or ""
+    if len(caption) > CAPTION_LOG_LIMIT:
+        caption = caption[:CAPTION_LOG_LIMIT] + "…"
+    return f"[{label}] {caption}".rstrip()
+
+
+async def get_chat_ring(user_id: int, partner_id: int) -> ChatRing:
+    """Return the pair's ring, restoring it from storage after a restart or eviction."""
+    key = pair_key(user_id, partner_id)
+    ring = chat_logs.get(key)
+    if ring is None:
+        ring = ChatRing()
+        if shared_state():
+            # behind this worker's queued writes; never cached: the other side's worker keeps appending
+            for entry in await shared_call(storage.load_chat_log, key):
+                ring.append(entry)
+            return ring
+        if storage:
+            for entry in await asyncio.to_thread(storage.load_chat_log, key):
+                ring.append(entry)
+        ring = chat_logs.setdefault(key, ring)
+    return ring
+
+
+def drop_chat_log(user_id: int, partner_id: int):
+    """Forget the pair's log once the conversation ends."""
+    key = pair_key(user_id, partner_id)
+    chat_logs.pop(key, None)
+    if storage:
+        storage.drop_chat_log(key)
+
+
+# ---------------------------
+# Menu / Start / Registration
+# ---------------------------
+def cari_doi_state(now: datetime) -> tuple:
+    """(open?, next transition) for the Cari Doi window: Saturday 18:00 -> Sunday 23:59, server local time."""
+    day = now.weekday()  # Monday=0 .. Sunday=6
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if (day == 5 and now.hour >= 18) or day == 6:
+        return True, midnight + timedelta(days=7 - day)  # closes Monday 00:00
+    return False, midnight + timedelta(days=5 - day, hours=18)  # opens Saturday 18:00
+
+
+class CariDoiWindow:
+    """Open/closed flag recomputed only when the precomputed next transition passes."""
+
+    def __init__(self):
+        self._open = False
+        self._until = 0.0  # epoch seconds of the next open/close transition
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        if now >= self._until:
+            self._open, until = cari_doi_state(datetime.fromtimestamp(now))
+            self._until = until.timestamp()
+        return self._open
+
+
+cari_doi_window = CariDoiWindow()
+
+# Main menu keyboards are immutable, so both variants are built once: is the Cari Doi window open?
+MENU_TEXT = "✅ Kamu sudah diverifikasi!\nPilih tombol untuk memulai percakapan:"
+MENU_MARKUPS = {
+    open_: InlineKeyboardMarkup(
+        [[InlineKeyboardButton("🔍 Find", callback_data="find")]]
+        + ([[InlineKeyboardButton("💘 Cari Doi", callback_data="cari_doi")]] if open_ else [])
+        + [
+            [InlineKeyboardButton("✏️ Ubah Profil", callback_data="ubah_profil")],
+            [InlineKeyboardButton("👤 Profil", callback_data="profil")],
+        ]
+    )
+    for open_ in (False, True)
+}
+
+
+async def show_main_menu(update: Optional[Update] = None, context: Optional[ContextTypes.DEFAULT_TYPE] = None, chat_id: Optional[int] = None):
+    """
+    Show main menu.
+    Cari Doi button only shown between:
+      - Saturday >= 18:00 (local server time) up to Sunday 23:59
+    """
+    text = MENU_TEXT
+    markup = MENU_MARKUPS[cari_doi_window.is_open()]
+
+    if update and getattr(update, "message", None):
+        await update.message.reply_text(text, reply_markup=markup)
+    elif update and getattr(update, "callback_query", None):
+        await update.callback_query.edit_message_text(text, reply_markup=markup)
+    elif chat_id:
+        outbox.send(chat_id, text, reply_markup=markup)
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    await shared_call(ensure_user, user_id)
+
+    if users[user_id].banned:
+        await safe_reply(update, "⚠️ Kamu telah diblokir admin dan tidak bisa menggunakan bot ini.")
+        return ConversationHandler.END
+
+    if users[user_id].verified:
+        if users[user_id].searching:
+            await safe_reply(update, "⏳ Kamu sedang mencari partner...\nGunakan /stop untuk membatalkan.")
+        elif users[user_id].partner:
+            await safe_reply(update, "💬 Kamu sedang dalam percakapan anonim.\nGunakan /stop untuk mengakhiri.")
+        else:
+            await show_main_menu(update, context)
+        return ConversationHandler.END
+
+    # not verified -> start registration
+    keyboard = [
+        [InlineKeyboardButton("UNNES", callback_data="unnes")],
+        [InlineKeyboardButton("Non-UNNES", callback_data="nonunnes")],
+    ]
+    await safe_reply(update, "👋 Selamat datang di Anonymous Kampus!\nPilih asal universitas kamu:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return UNIVERSITY
+
+
+async def handle_university(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    await shared_call(ensure_user, user_id)
+    await shared_call(update_user, user_id, university=University.UNNES if query.data == "unnes" else University.NON_UNNES)
+
+    keyboard = [
+        [InlineKeyboardButton("Laki-laki", callback_data="male")],
+        [InlineKeyboardButton("Perempuan", callback_data="female")],
+    ]
+    await query.edit_message_text("🚻 Pilih gender kamu:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return GENDER
+
+
+async def handle_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    await shared_call(ensure_user, user_id)
+    await shared_call(update_user, user_id, gender=Gender.MALE if query.data == "male" else Gender.FEMALE)
+
+    await query.edit_message_text("🎂 Masukkan usia kamu (contoh: 21):")
+    return AGE
+
+
+async def handle_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    await shared_call(ensure_user, user_id)
+    age_text = update.message.text.strip()
+    if not age_text.isdigit():
+        await safe_reply(update, "⚠️ Usia harus berupa angka. Coba lagi:")
+        return AGE
+
+    age = int(age_text)
+    if age < AGE_MIN or age > AGE_MAX:
+        await safe_reply(update, "⚠️ Usia hanya diperbolehkan 18–25 tahun. Coba lagi:")
+        return AGE
+
+    await shared_call(update_user, user_id, age=age)
+    await safe_reply(update, "📩 Data kamu sudah dikirim ke admin untuk diverifikasi. Tunggu ya!")
+    await request_admin_verification(user_id, context)
+    return ConversationHandler.END
+
+
+async def ubah_profil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Menu button: reset the profile and re-run registration (requires admin re-verify)."""
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    await shared_call(ensure_user, user_id)
+    if users[user_id].banned:
+        await query.edit_message_text("⚠️ Kamu diblokir admin.")
+        return ConversationHandler.END
+
+    await shared_call(update_user, user_id, verified=False, university=None, gender=None, age=None, searching=False)
+    pending_verifications.discard(user_id)
+    keyboard = [
+        [InlineKeyboardButton("UNNES", callback_data="unnes")],
+        [InlineKeyboardButton("Non-UNNES", callback_data="nonunnes")],
+    ]
+    await query.edit_message_text("✏️ Ubah profil kamu.\nPilih asal universitas:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return UNIVERSITY
+
+
+# ---------------------------
+# Profil user (diri sendiri)
+# ---------------------------
+profile_cache = OrderedDict()  # user_id -> (field snapshot, rendered detail lines), LRU order
+PROFILE_CACHE_MAX = 10_000
+
+
+def profile_details(user_id: int, u: User) -> str:
+    """Detail lines shared by /profil and the admin view; re-rendered only after one of the user's fields changed."""
+    fields = (u.verified, u.partner, u.university, u.gender, u.age, u.searching, u.banned)
+    hit = profile_cache.get(user_id)
+    if hit is not None and hit[0] == fields:
+        profile_cache.move_to_end(user_id)
+        return hit[1]
+
+    if u.banned:
+        status_text = "🚫 Diblokir Admin"
+    elif u.partner:
+        status_text = f"💬 Sedang ngobrol dengan User {u.partner}"
+    elif u.searching:
+        status_text = "🔎 Sedang mencari partner"
+    else:
+        status_text = "⏸️ Idle (tidak mencari / tidak ngobrol)"
+    text = (
+        f"🆔 User ID: `{user_id}`\n"
+        f"🏫 Universitas: {u.university or '-'}\n"
+        f"🚻 Gender: {u.gender or '-'}\n"
+        f"🎂 Usia: {u.age or '-'}\n"
+        f"📌 Status Aktivitas: {status_text}\n"
+        f"✅ Verifikasi: {'Sudah' if u.verified else 'Belum'}\n"
+        f"🚫 Banned: {'Ya' if u.banned else 'Tidak'}\n"
+    )
+    profile_cache[user_id] = (fields, text)
+    if len(profile_cache) > PROFILE_CACHE_MAX:
+        profile_cache.popitem(last=False)
+    return text
+
+
+async def profil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    await shared_call(ensure_user, user_id)
+    profil = users[user_id]
+
+    teks = (
+        f"📝 **Profil Kamu (Detail)**\n{profile_details(user_id, profil)}\n"
+        "🔒 Profil ini **hanya bisa kamu lihat sendiri**.\nIdentitasmu tetap **anonymous**."
+    )
+
+    await safe_reply(update, teks, parse_mode="Markdown")
+
+
+# ---------------------------
+# Stop command (keluar pencarian/percakapan)
+# ---------------------------
+async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    u = await shared_call(get_user, user_id)
+    partner_id = u.partner if u else None
+
+    if partner_id:
+        # inform partner
+        outbox.send(partner_id, "❌ Partner keluar dari percakapan.")
+        await shared_call(unpair_users, user_id, partner_id)
+
+    if u:
+        await shared_call(set_searching, user_id, False)
+    await safe_reply(update, "❌ Kamu keluar dari percakapan / pencarian partner.")
+
+
+# ---------------------------
+# Admin notifications (fan-out ke semua admin lewat outbox)
+# ---------------------------
+def notify_admins(text: str, **kwargs) -> list:
+    """Queue the same message for every admin; they are sent in parallel by the outbox workers."""
+    return [outbox.send(admin_id, text, **kwargs) for admin_id in ADMIN_IDS]
+
+
+def render_digest(page: int = 0, header: str = ""):
+    """Build one page of the pending-verification digest: (text, markup)."""
+    total = len(pending_verifications)
+    if not total:
+        return header + "✅ Tidak ada permintaan verifikasi tertunda.", None
+    total_pages = (total + DIGEST_PAGE_SIZE - 1) // DIGEST_PAGE_SIZE
+    page = min(page, total_pages - 1)
+    start = page * DIGEST_PAGE_SIZE
+
+    lines = [f"{header}🔔 {total} permintaan verifikasi (hal {page + 1}/{total_pages}):\n"]
+    keyboard = []
+    for uid in pending_verifications.slice(start, start + DIGEST_PAGE_SIZE):
+        u = get_user(uid)  # seeded at startup: may not be loaded yet
+        lines.append(f"👤 {uid} | {u.university} | {u.gender} | {u.age} tahun")
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {uid}", callback_data=f"approve_{uid}:{page}"),
+            InlineKeyboardButton(f"❌ {uid}", callback_data=f"reject_{uid}:{page}"),
+        ])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"digest:{page - 1}"))
+    if page < total_pages - 1:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"digest:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
+async def send_verification_digest():
+    """Send admins one digest if new verification requests arrived since the last one."""
+    global digest_new
+    if not digest_new or not pending_verifications:
+        return
+    digest_new = 0
+    text, markup = await shared_call(render_digest, 0)
+    notify_admins(text, reply_markup=markup)
+
+
+async def digest_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMIN_IDS:
+        await query.edit_message_text("❌ Kamu bukan admin.")
+        return
+    text, markup = await shared_call(render_digest, int(query.data.split(":", 1)[1]))
+    await query.edit_message_text(text, reply_markup=markup)
+
+
+# ---------------------------
+# Request admin verification (masuk digest, atau langsung jika digest mati)
+# ---------------------------
+async def request_admin_verification(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    global digest_new
+    # ensure user exists
+    u = await shared_call(ensure_user, user_id)
+    pending_verifications.add(user_id)
+    if VERIFY_DIGEST_INTERVAL > 0:
+        digest_new += 1
+        return
+
+    text = (
+        f"🔔 Permintaan verifikasi baru!\n\n"
+        f"👤 User ID: {user_id}\n"
+        f"🏫 Universitas: {u.university}\n"
+        f"🚻 Gender: {u.gender}\n"
+        f"🎂 Usia: {u.age}\n\n"
+        "✅ Approve atau ❌ Reject?"
+    )
+    keyboard = [
+        [InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user_id}")],
+        [InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user_id}")],
+        [InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_{user_id}")],
+        [InlineKeyboardButton("✅ Unban User", callback_data=f"unban_{user_id}")],
+    ]
+    notify_admins(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+# ---------------------------
+# Report command - send log to admin
+# ---------------------------
+async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    u = await shared_call(get_user, user_id)
+    partner_id = u.partner if u else None
+    if not partner_id:
+        await safe_reply(update, "⚠️ Kamu tidak sedang dalam percakapan anonim.")
+        return
+
+    # build log text straight from the pair's ring buffer
+    ring = await get_chat_ring(user_id, partner_id)
+    lines = ["📑 Riwayat Chat Terakhir:\n"]
+    for sender, msg in ring.view():
+        prefix = "🟢 Kamu" if sender == user_id else "🔵 Partner"
+        lines.append(f"{prefix}: {msg}")
+    log_text = "\n".join(lines) + "\n"
+
+    keyboard = [
+        [
+            InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_{partner_id}"),
+            InlineKeyboardButton("✅ Unban User", callback_data=f"unban_{partner_id}"),
+        ]
+    ]
+    notify_admins(
+        f"🚨 LAPORAN USER!\n\nPelapor: {user_id}\nTerlapor: {partner_id}\n\n{log_text}",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+    analytics.report()
+
+    await safe_reply(update, "📩 Laporan sudah dikirim ke admin. Terima kasih!")
+
+
+# ---------------------------
+# Admin: show user profile (helper)
+# ---------------------------
+async def show_user_profile(context: ContextTypes.DEFAULT_TYPE, chat_id: int, target_id: int):
+    profil = await shared_call(get_user, target_id)
+    if profil is None:
+        outbox.send(chat_id, f"⚠️ User {target_id} tidak ditemukan.")
+        return
+
+    teks = f"📝 **Profil User (Detail)**\n{profile_details(target_id, profil)}"
+
+    keyboard = [
+        [InlineKeyboardButton("🚫 Ban", callback_data=f"ban_{target_id}"),
+         InlineKeyboardButton("✅ Unban", callback_data=f"unban_{target_id}")],
+    ]
+
+    outbox.send(chat_id, teks, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+# ---------------------------
+# Admin panel - clickable lists
+# ---------------------------
+async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id
+    if admin_id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+
+    keyboard = [
+        [InlineKeyboardButton("📋 Semua User", callback_data="list_users")],
+        [InlineKeyboardButton("✅ Terverifikasi", callback_data="list_verified")],
+        [InlineKeyboardButton("⏳ Belum Verif", callback_data="list_unverified")],
+        [InlineKeyboardButton("🚫 Banned", callback_data="list_banned")],
+    ]
+    await safe_reply(update, "⚙️ Panel Admin:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+ADMIN_LISTS = {
+    # callback name -> (index key, title, empty text)
+    "list_users": ("users", "📋 Semua User:", "📋 Belum ada user terdaftar."),
+    "list_verified": ("verified", "✅ User Terverifikasi:", "✅ Tidak ada user terverifikasi."),
+    "list_unverified": ("unverified", "⏳ User Belum Verifikasi:", "⏳ Semua user sudah terverifikasi."),
+    "list_banned": ("banned", "🚫 User Banned:", "🚫 Tidak ada user banned."),
+}
+ADMIN_PAGE_SIZE = 20
+
+
+async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    admin_id = query.from_user.id
+
+    if admin_id not in ADMIN_IDS:
+        await query.edit_message_text("❌ Kamu bukan admin.")
+        return
+
+    # callback data: "list_verified" or "list_verified:<page>"
+    action, _, page_text = query.data.partition(":")
+    if action not in ADMIN_LISTS:
+        return
+    key, title, empty_text = ADMIN_LISTS[action]
+    index = user_index[key]
+    if not len(index):
+        await query.edit_message_text(empty_text)
+        return
+
+    total_pages = (len(index) + ADMIN_PAGE_SIZE - 1) // ADMIN_PAGE_SIZE
+    page = int(page_text) if page_text.isdigit() else 0
+    page = min(page, total_pages - 1)
+    start = page * ADMIN_PAGE_SIZE
+    keyboard = [[InlineKeyboardButton(f"User {uid}", callback_data=f"detail_{uid}")]
+                for uid in index.slice(start, start + ADMIN_PAGE_SIZE)]
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{action}:{page - 1}"))
+    if page < total_pages - 1:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{action}:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+
+    await query.edit_message_text(
+        f"{title}\nHalaman {page + 1}/{total_pages} ({len(index)} user)",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+# ---------------------------
+# Admin detail handler (click user)
+# ---------------------------
+async def admin_detail_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    admin_id = query.from_user.id
+
+    if admin_id not in ADMIN_IDS:
+        await query.edit_message_text("❌ Kamu bukan admin.")
+        return
+
+    parts = query.data.split("_", 1)
+    if len(parts) != 2:
+        await query.edit_message_text("⚠️ Data tidak valid.")
+        return
+
+    try:
+        target_id = int(parts[1])
+    except ValueError:
+        await query.edit_message_text("⚠️ ID user tidak valid.")
+        return
+
+    await show_user_profile(context, admin_id, target_id)
+
+
+# ---------------------------
+# Admin button actions (approve/reject/ban/unban)
+# Note: this handler accepts both verification buttons and ban/unban
+# ---------------------------
+async def admin_action_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    parts = query.data.split("_", 1)
+    action = parts[0]
+
+    if len(parts) != 2:
+        await query.edit_message_text("❌ Data tidak valid.")
+        return
+
+    # "<action>_<id>" or "<action>_<id>:<digest page>" from the verification digest
+    target_text, _, digest_page = parts[1].partition(":")
+    try:
+        target_id = int(target_text)
+    except ValueError:
+        await query.edit_message_text("❌ ID user tidak valid.")
+        return
+
+    if action == "ban":
+        await shared_call(ensure_user, target_id)  # allow pre-banning IDs that never registered
+    elif await shared_call(get_user, target_id) is None:
+        await query.edit_message_text(f"⚠️ User {target_id} tidak ditemukan.")
+        return
+
+    if action == "approve":
+        await shared_call(update_user, target_id, verified=True)
+        pending_verifications.discard(target_id)
+        result = f"✅ User {target_id} diverifikasi."
+        outbox.send(target_id, "🎉 Profil kamu sudah diverifikasi!")
+        await show_main_menu(context=context, chat_id=target_id)
+
+    elif action == "reject":
+        # incomplete profile until they register again, so a restart does not list them as pending
+        await shared_call(update_user, target_id, verified=False, searching=False, age=None)
+        pending_verifications.discard(target_id)
+        result = f"❌ User {target_id} ditolak."
+        outbox.send(target_id, "⚠️ Verifikasi kamu ditolak. Silakan coba lagi.")
+
+    elif action == "ban":
+        await shared_call(update_user, target_id, banned=True, searching=False)
+        pending_verifications.discard(target_id)
+        result = f"🚫 User {target_id} telah diblokir oleh admin."
+        outbox.send(target_id, "⚠️ Kamu telah diblokir oleh admin dan tidak bisa lagi menggunakan bot.")
+
+    elif action == "unban":
+        await shared_call(update_user, target_id, banned=False)
+        result = f"✅ User {target_id} telah di-unban oleh admin."
+        outbox.send(target_id, "✅ Kamu sudah di-unban oleh admin. Silakan gunakan bot kembali.")
+
+    else:
+        return
+
+    if digest_page.isdigit():
+        # keep the digest message usable: re-render the same page below the result
+        text, markup = await shared_call(render_digest, int(digest_page), header=result + "\n\n")
+        await query.edit_message_text(text, reply_markup=markup)
+    else:
+        await query.edit_message_text(result)
+
+
+# ---------------------------
+# Manual ban/unban commands + audit trail
+# ---------------------------
+async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id
+    if admin_id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+
+    if not context.args:
+        await safe_reply(update, "⚠️ Gunakan format: /ban <user_id>")
+        return
+
+    try:
+        target_id = int(context.args[0])
+    except ValueError:
+        await safe_reply(update, "⚠️ User ID harus berupa angka.")
+        return
+
+    await shared_call(ensure_user, target_id)
+    await shared_call(update_user, target_id, banned=True, searching=False)
+    pending_verifications.discard(target_id)
+    await safe_reply(update, f"✅ User {target_id} berhasil diblokir.")
+    outbox.send(target_id, "⚠️ Kamu telah diblokir oleh admin dan tidak bisa lagi menggunakan bot.")
+
+
+async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id
+    if admin_id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+
+    if not context.args:
+        await safe_reply(update, "⚠️ Gunakan format: /unban <user_id>")
+        return
+
+    try:
+        target_id = int(context.args[0])
+    except ValueError:
+        await safe_reply(update, "⚠️ User ID harus berupa angka.")
+        return
+
+    if await shared_call(get_user, target_id) is None:
+        await safe_reply(update, f"⚠️ User {target_id} tidak ditemukan.")
+        return
+    await shared_call(update_user, target_id, banned=False)
     await safe_reply(update, f"✅ User {target_id} sudah di-unban.")
+    outbox.send(target_id, "✅ Kamu sudah di-unban oleh admin. Silakan gunakan bot kembali.")
+
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_id = update.effective_user.id
+    if admin_id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+
+    if not event_log:
+        await safe_reply(update, "⚠️ Event log tidak aktif (set EVENT_LOG_DIR).")
+        return
+
+    if not context.args:
+        await safe_reply(update, "⚠️ Gunakan format: /audit <user_id>")
+        return
+
+    try:
+        target_id = int(context.args[0])
+    except ValueError:
+        await safe_reply(update, "⚠️ User ID harus berupa angka.")
+        return
+
+    events = await asyncio.to_thread(event_log.history, target_id)
+    if not events:
+        await safe_reply(update, f"ℹ️ Belum ada event untuk user {target_id}.")
+        return
+    lines = [f"📜 Riwayat user {target_id} ({len(events)} event terakhir):"]
+    for seq, ts, kind, _, arg, actor in events:
+        when = datetime.fromtimestamp(int(ts)).strftime("%Y-%m-%d %H:%M:%S")
+        by = "sistem" if not actor else ("admin " + actor if int(actor) in ADMIN_IDS else actor)
+        lines.append(f"#{seq} {when} {kind}{' ' + arg if arg else ''} (oleh {by})")
+    await safe_reply(update, "\n".join(lines))
+
+
+# ---------------------------
+# Bulk admin operations: /approveall, /banlist, /export, /import
+# Work in BULK_CHUNK batches (the event loop keeps serving chats), file I/O
+# in a thread, user notices through the low-priority bulk sender.
+# ---------------------------
+EXPORT_FIELDS = ("user_id", "verified", "university", "gender", "age", "banned")
+UNIVERSITY_WORDS = {"unnes": University.UNNES, "nonunnes": University.NON_UNNES, "non-unnes": University.NON_UNNES}
+GENDER_WORDS = {"male": Gender.MALE, "laki": Gender.MALE, "laki-laki": Gender.MALE,
+                "female": Gender.FEMALE, "perempuan": Gender.FEMALE}
+
+
+def parse_user_filter(words: list):
+    """
+    "unnes", "nonunnes", "laki"/"male", "perempuan"/"female", "20" or "18-21"
+    -> predicate(User). Unknown words raise ValueError. No words = everyone.
+    """
+    university = gender = None
+    age_min, age_max = 0, 200
+    for word in (w.lower() for w in words):
+        if word in UNIVERSITY_WORDS:
+            university = UNIVERSITY_WORDS[word]
+        elif word in GENDER_WORDS:
+            gender = GENDER_WORDS[word]
+        else:
+            low, _, high = word.partition("-")
+            age_min, age_max = int(low), int(high or low)  # ValueError for anything else
+
+    def match(u: User) -> bool:
+        return ((university is None or u.university == university)
+                and (gender is None or u.gender == gender)
+                and u.age is not None and age_min <= u.age <= age_max)
+
+    return match
+
+
+async def approve_pending(match) -> int:
+    """Approve every pending user accepted by match(); returns how many."""
+    approved = 0
+    for i, user_id in enumerate(list(pending_verifications), 1):
+        u = await shared_call(get_user, user_id)
+        if u is not None and user_id in pending_verifications and match(u):
+            await shared_call(update_user, user_id, verified=True)
+            pending_verifications.discard(user_id)
+            bulk.send(user_id, "🎉 Profil kamu sudah diverifikasi!\n\n" + MENU_TEXT, with_menu=True)
+            approved += 1
+        if i % BULK_CHUNK == 0:
+            await asyncio.sleep(0)
+    return approved
+
+
+async def ban_users(user_ids: list) -> int:
+    """Ban every id (registered or not, like /ban); returns how many were newly banned."""
+    banned = 0
+    for i, user_id in enumerate(user_ids, 1):
+        if not (await shared_call(ensure_user, user_id)).banned:
+            await shared_call(update_user, user_id, banned=True, searching=False)
+            pending_verifications.discard(user_id)
+            bulk.send(user_id, "⚠️ Kamu telah diblokir oleh admin dan tidak bisa lagi menggunakan bot.")
+            banned += 1
+        if i % BULK_CHUNK == 0:
+            await asyncio.sleep(0)
+    return banned
+
+
+def user_row(user_id: int, u: User) -> dict:
+    return {
+        "user_id": user_id,
+        "verified": int(bool(u.verified)),
+        "university": u.university.value if u.university else None,
+        "gender": u.gender.value if u.gender else None,
+        "age": u.age,
+        "banned": int(bool(u.banned)),
+    }
+
+
+def iter_all_users():
+    """(user_id, User) for every known user: streamed from storage, or a snapshot of the in-memory dict."""
+    if storage:
+        return storage.iter_users()
+    return iter(list(users.items()))
+
+
+def export_users(f, fmt: str, rows) -> int:
+    """Write (user_id, User) rows to the text file f as CSV or JSONL, one row at a time; returns the count."""
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(f, EXPORT_FIELDS)
+        writer.writeheader()
+        for user_id, u in rows:
+            writer.writerow(user_row(user_id, u))
+            count += 1
+    else:
+        for user_id, u in rows:
+            f.write(json.dumps(user_row(user_id, u), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def iter_import_rows(f, fmt: str):
+    """Yield (line number, user_id, fields) or (line number, None, error) for every CSV/JSONL row in f."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        rows = ((reader.line_num, row) for row in reader)
+    else:
+        rows = ((n, line) for n, line in enumerate(f, 1) if line.strip())
+    for line_num, row in rows:
+        try:
+            if fmt != "csv":
+                row = json.loads(row)
+            fields = {}
+            for flag in ("verified", "banned"):
+                if row.get(flag) not in (None, ""):
+                    fields[flag] = str(row[flag]).lower() in ("1", "true", "yes", "ya")
+            if row.get("university"):
+                fields["university"] = University(row["university"])
+            if row.get("gender"):
+                fields["gender"] = Gender(row["gender"])
+            if row.get("age") not in (None, ""):
+                fields["age"] = int(row["age"])
+            yield line_num, int(row["user_id"]), fields
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            yield line_num, None, f"{type(e).__name__}: {e}"
+
+
+async def import_users(f, fmt: str) -> tuple:
+    """Apply an export file (parsed off the event loop, BULK_CHUNK rows at a time). Returns (applied, errors)."""
+    rows = iter_import_rows(f, fmt)
+    applied, errors = 0, []
+    while True:
+        chunk = await asyncio.to_thread(list, itertools.islice(rows, BULK_CHUNK))
+        if not chunk:
+            return applied, errors
+        for line_num, user_id, fields in chunk:
+            if user_id is None:
+                errors.append(f"baris {line_num}: {fields}")
+                continue
+            await shared_call(ensure_user, user_id)
+            await shared_call(update_user, user_id, **fields)
+            if fields.get("verified") or fields.get("banned"):
+                pending_verifications.discard(user_id)
+            applied += 1
+
+
+def file_format(name: str) -> Optional[str]:
+    name = (name or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".json", ".ndjson")):
+        return "jsonl"
+    return None
+
+
+async def approveall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
     try:
-        await context.bot.send_message(target_id, "✅ Kamu sudah di-unban oleh admin. Silakan gunakan bot kembali.")
-    except:
-        pass
+        match = parse_user_filter(context.args or [])
+    except ValueError:
+        await safe_reply(update, "⚠️ Gunakan format: /approveall [unnes|nonunnes] [laki|perempuan] [usia atau 18-21]")
+        return
+    waiting = len(pending_verifications)
+    approved = await approve_pending(match)
+    await safe_reply(update, f"✅ {approved} dari {waiting} user menunggu diverifikasi. "
+                             f"Notifikasi dikirim bertahap ({len(bulk)} antre).")
+
+
+async def banlist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+    words = " ".join(context.args or []).replace(",", " ").split()
+    user_ids = [int(w) for w in words if w.isdigit()]
+    if not user_ids:
+        await safe_reply(update, "⚠️ Gunakan format: /banlist <id> <id> ... (pisahkan dengan spasi atau koma)")
+        return
+    banned = await ban_users(user_ids)
+    skipped = len(words) - len(user_ids)
+    await safe_reply(update, f"🚫 {banned} user diblokir ({len(user_ids) - banned} sudah diblokir"
+                             f"{f', {skipped} bukan ID' if skipped else ''}).")
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+    fmt = (context.args[0].lower() if context.args else "csv")
+    if fmt not in ("csv", "jsonl"):
+        await safe_reply(update, "⚠️ Gunakan format: /export [csv|jsonl]")
+        return
+    with tempfile.TemporaryFile() as raw:
+        f = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        count = await asyncio.to_thread(export_users, f, fmt, iter_all_users())
+        f.flush()
+        raw.seek(0)
+        name = f"users-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+        await context.bot.send_document(update.effective_chat.id, document=raw, filename=name,
+                                        caption=f"📤 {count} user")
+
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+    replied = update.message.reply_to_message if update.message else None
+    document = replied.document if replied else None
+    fmt = file_format(document.file_name) if document else None
+    if fmt is None:
+        await safe_reply(update, "⚠️ Balas file .csv atau .jsonl (hasil /export) dengan /import")
+        return
+    with tempfile.TemporaryFile() as raw:
+        telegram_file = await context.bot.get_file(document.file_id)  # Bot API downloads are capped at 20 MB
+        await telegram_file.download_to_memory(raw)
+        raw.seek(0)
+        applied, errors = await import_users(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""), fmt)
+    text = f"📥 {applied} user diimpor."
+    if errors:
+        text += f"\n⚠️ {len(errors)} baris dilewati:\n" + "\n".join(errors[:10])
+    await safe_reply(update, text)
 
 
 # ---------------------------
-# Button handler for menu: find / cari_doi / ubah_profil / profil
+# Button handler for menu: find / cari_doi / profil (ubah_profil is an entry point of the registration conversation)
 # - also handles the searching logic and statistics display
 # ---------------------------
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    ensure_user(user_id)
+    await shared_call(ensure_user, user_id)
 
     # blocked check
-    if users[user_id].get("banned"):
+    if users[user_id].banned:
         await query.edit_message_text("⚠️ Kamu diblokir admin.")
         return
 
@@ -534,82 +3220,359 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if action in ["find", "cari_doi"]:
         # prevent repeat clicking while searching
-        if users[user_id].get("partner"):
+        if users[user_id].partner:
             await query.edit_message_text("⚠️ Kamu sedang dalam percakapan. Gunakan /stop untuk keluar.")
             return
-        if users[user_id].get("searching"):
+        if users[user_id].searching:
             # still searching -> inform user
-            total_verified = sum(1 for u in users.values() if u.get("verified") and not u.get("banned"))
-            total_searching = sum(1 for u in users.values() if u.get("searching") and u.get("verified") and not u.get("banned"))
+            verified, searching = await shared_call(stats.counts)
             teks = (
                 f"⏳ Kamu sudah mencari partner.\n\n"
-                f"👥 User terverifikasi: {total_verified}\n"
-                f"🟢 Sedang online/mencari: {total_searching}\n\n"
+                f"👥 User terverifikasi: {verified}\n"
+                f"🟢 Sedang online/mencari: {searching}\n\n"
                 f"Gunakan /stop untuk membatalkan."
             )
             await query.edit_message_text(teks)
             return
 
         # start searching (find partner)
-        # only match against other verified & searching & not banned users
-        candidates = [uid for uid, u in users.items()
-                      if u.get("searching") and uid != user_id and u.get("verified") and not u.get("banned")]
-        if candidates:
-            partner_id = random.choice(candidates)
-            users[user_id]["partner"] = partner_id
-            users[partner_id]["partner"] = user_id
-            users[user_id]["searching"] = False
-            users[partner_id]["searching"] = False
+        # "find" uses the user's /filter prefs; "cari_doi" also asks for the opposite gender.
+        prefs = user_filters.get(user_id, DEFAULT_PREFS)
+        me = users[user_id]
+        if action == "cari_doi" and me.gender is not None:
+            prefs = replace(prefs, partner_gender=Gender.FEMALE if me.gender == Gender.MALE else Gender.MALE)
+
+        # search_pool only holds other verified & searching & not banned users.
+        # Locally there is no await between the checks above and match_user(),
+        # so the pairing step is atomic on the event loop even with concurrent
+        # updates; with shared state the match script re-checks both atomically.
+        partner_id = await shared_call(match_user, user_id, prefs)
+        if partner_id:
             # notify both
-            await context.bot.send_message(user_id, "💬 Partner ditemukan! Sekarang kamu bisa ngobrol anonim.")
-            await context.bot.send_message(partner_id, "💬 Partner ditemukan! Sekarang kamu bisa ngobrol anonim.")
+            outbox.send(user_id, "💬 Partner ditemukan! Sekarang kamu bisa ngobrol anonim.")
+            outbox.send(partner_id, "💬 Partner ditemukan! Sekarang kamu bisa ngobrol anonim.")
         else:
-            users[user_id]["searching"] = True
             # stats
-            total_verified = sum(1 for u in users.values() if u.get("verified") and not u.get("banned"))
-            total_searching = sum(1 for u in users.values() if u.get("searching") and u.get("verified") and not u.get("banned"))
+            verified, searching = await shared_call(stats.counts)
             teks = (
                 f"🔍 Sedang mencari partner...\n\n"
-                f"👥 User terverifikasi: {total_verified}\n"
-                f"🟢 Sedang online/mencari: {total_searching}\n\n"
+                f"👥 User terverifikasi: {verified}\n"
+                f"🟢 Sedang online/mencari: {searching}\n\n"
                 f"Gunakan /stop untuk membatalkan."
             )
             await query.edit_message_text(teks)
 
-    elif action == "ubah_profil":
-        # reset profile & re-run registration (requires admin re-verify)
-        users[user_id].update({"verified": False, "university": None, "gender": None, "age": None})
-        keyboard = [
-            [InlineKeyboardButton("UNNES", callback_data="unnes")],
-            [InlineKeyboardButton("Non-UNNES", callback_data="nonunnes")],
-        ]
-        await query.edit_message_text("✏️ Ubah profil kamu.\nPilih asal universitas:", reply_markup=InlineKeyboardMarkup(keyboard))
-        return UNIVERSITY
-
     elif action == "profil":
         await profil(update, context)
 
+    elif action in ("unnes", "nonunnes", "male", "female"):
+        # registration button pressed after the conversation expired (CONV_STATE_TTL) or was evicted
+        await query.edit_message_text("⌛ Sesi pendaftaran sudah kedaluwarsa. Ketik /start untuk mengulang.")
+
+
+# ---------------------------
+# Moderasi otomatis: pre-filter kata/URL terlarang di jalur relay
+# ---------------------------
+def trie_regex(patterns) -> str:
+    """
+    One alternation shaped like a trie of the patterns: at each position the
+    regex follows one branch per next character instead of trying every
+    pattern, so matching cost barely depends on how many there are. Patterns
+    that start or end with a word character only match whole words.
+    """
+    def emit(node: dict, word_end: bool) -> str:
+        branches = [re.escape(ch) + emit(child, ch.isalnum() or ch == "_") for ch, child in sorted(node.items()) if ch]
+        if "" in node:
+            branches.append(r"(?!\w)" if word_end else "")  # after the longer branches: longest match wins
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    parts = []
+    for starts_word in (True, False):
+        trie = {}
+        for pattern in patterns:
+            if (pattern[0].isalnum() or pattern[0] == "_") == starts_word:
+                node = trie
+                for ch in pattern:
+                    node = node.setdefault(ch, {})
+                node[""] = {}
+        if trie:
+            parts.append((r"(?<!\w)" if starts_word else "") + emit(trie, False))
+    return "|".join(parts)
+
+
+def parse_patterns(lines) -> frozenset:
+    """Normalized patterns: lowercased, stripped, no blanks or # comments, at most MODERATION_PATTERN_MAX chars."""
+    patterns = set()
+    for line in lines:
+        pattern = " ".join(line.lower().split())
+        if not pattern or pattern.startswith("#"):
+            continue
+        if len(pattern) > MODERATION_PATTERN_MAX:
+            print(f"ERROR moderation pattern longer than {MODERATION_PATTERN_MAX} chars skipped: {pattern[:40]}...")
+            continue
+        patterns.add(pattern)
+    return frozenset(patterns)
+
+
+class ModerationFilter:
+    """
+    Admin-managed banned words and URLs, compiled into a single regex
+    (trie_regex). Reloads read and compile in a worker thread and swap the
+    compiled regex in with one assignment, so relays never wait for them;
+    they use the previous list until the swap.
+    """
+
+    def __init__(self, path: str = MODERATION_PATH):
+        self.path = path
+        self.patterns = frozenset()
+        self._regex = None  # None = empty list, nothing to check
+        self._mtime = None  # of the file the patterns came from
+        self._lock = asyncio.Lock()  # one reload/update at a time
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def check(self, text: str) -> Optional[str]:
+        """The banned pattern found in text, or None."""
+        regex = self._regex
+        if regex is None:
+            return None
+        found = regex.search(" ".join(text.lower().split()))
+        return found.group() if found else None
+
+    @staticmethod
+    def compile(patterns: frozenset):
+        if not patterns:
+            return None
+        # the trie and re's parse tree are ~10^5 acyclic containers, freed by refcounting anyway; left on, the
+        # cycle collector runs hundreds of times here and its gen-2 passes hold the GIL (and the relay) for ~70 ms
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return re.compile(trie_regex(patterns))
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _mtime_now(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self) -> tuple:
+        mtime = self._mtime_now()
+        if mtime is None:
+            return None, frozenset()
+        with open(self.path, encoding="utf-8") as f:
+            return mtime, parse_patterns(f)
+
+    def _write(self, patterns: frozenset):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(p + "\n" for p in sorted(patterns)))
+        os.replace(tmp, self.path)
+        return self._mtime_now()
+
+    async def reload(self) -> int:
+        """Re-read the file; returns the pattern count."""
+        async with self._lock:
+            if self.path:
+                mtime, patterns = await asyncio.to_thread(self._read)
+                regex = await asyncio.to_thread(self.compile, patterns)
+                self.patterns, self._regex, self._mtime = patterns, regex, mtime
+        return len(self.patterns)
+
+    async def reload_if_changed(self):
+        if self.path and self._mtime_now() != self._mtime:
+            await self.reload()
+
+    async def update(self, add=(), remove=()) -> tuple:
+        """Add/remove patterns and save the file. Returns (added, removed) counts."""
+        async with self._lock:
+            add, remove = parse_patterns(add) - self.patterns, parse_patterns(remove) & self.patterns
+            if add or remove:
+                patterns = (self.patterns | add) - remove
+                regex = await asyncio.to_thread(self.compile, patterns)
+                if self.path:
+                    self._mtime = await asyncio.to_thread(self._write, patterns)
+                self.patterns, self._regex = patterns, regex
+        return len(add), len(remove)
+
+
+moderation = ModerationFilter()
+moderation_flags = {}  # pair_key -> monotonic time the pair was last auto-flagged to admins
+
+
+def flag_message(sender_id: int, partner_id: int, pattern: str, text: str):
+    """Tell admins a message hit the banned list (once per pair per MODERATION_FLAG_COOLDOWN)."""
+    metrics.inc("bot_moderation_hits_total")
+    key = pair_key(sender_id, partner_id)
+    now = time.monotonic()
+    last = moderation_flags.get(key)
+    if last is not None and now - last < MODERATION_FLAG_COOLDOWN:
+        return
+    moderation_flags[key] = now
+    keyboard = [
+        [
+            InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_{sender_id}"),
+            InlineKeyboardButton("✅ Unban User", callback_data=f"unban_{sender_id}"),
+        ]
+    ]
+    status = "tidak diteruskan" if MODERATION_BLOCK else "tetap diteruskan"
+    notify_admins(
+        f"🚨 MODERASI OTOMATIS\n\nPengirim: {sender_id}\nPartner: {partner_id}\nCocok: {pattern}\n"
+        f"Pesan ({status}): {text[:CAPTION_LOG_LIMIT]}",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def moderasi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/moderasi [daftar] | tambah <pola>, <pola> | hapus <pola>, <pola> | muat"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+    args = context.args or []
+    action = args[0].lower() if args else "daftar"
+    items = " ".join(args[1:]).split(",")
+    if action in ("tambah", "hapus") and any(item.strip() for item in items):
+        added, removed = await moderation.update(**{"add" if action == "tambah" else "remove": items})
+        teks = f"✅ {added} pola ditambahkan." if action == "tambah" else f"✅ {removed} pola dihapus."
+        await safe_reply(update, f"{teks} Total: {len(moderation)} pola.")
+    elif action == "muat":
+        count = await moderation.reload()
+        await safe_reply(update, f"🔄 Daftar dimuat ulang dari {moderation.path or '(memori)'}: {count} pola.")
+    elif action == "daftar":
+        shown = sorted(moderation.patterns)[:50]
+        teks = f"🛡️ Moderasi otomatis: {len(moderation)} pola ({'diblokir' if MODERATION_BLOCK else 'hanya dilaporkan'})"
+        if shown:
+            teks += "\n\n" + "\n".join(f"- {p}" for p in shown)
+            if len(moderation) > len(shown):
+                teks += f"\n... dan {len(moderation) - len(shown)} lagi (lihat {moderation.path})"
+        await safe_reply(update, teks)
+    else:
+        await safe_reply(update, "⚠️ Gunakan: /moderasi [daftar] | /moderasi tambah <kata/URL>, <kata/URL> | "
+                                 "/moderasi hapus <kata/URL> | /moderasi muat")
+
 
 # ---------------------------
 # Relay chat between partners
 # ---------------------------
+pending_albums = {}  # (sender_id, media_group_id) -> list of InputMedia waiting for the rest of the album
+
+
+def album_item(msg):
+    """InputMedia re-sending the message's file_id (no download), or None if it can't be in an album."""
+    kwargs = {"caption": msg.caption, "caption_entities": msg.caption_entities}
+    if msg.photo:
+        return InputMediaPhoto(msg.photo[-1].file_id, **kwargs)
+    if msg.video:
+        return InputMediaVideo(msg.video.file_id, **kwargs)
+    if msg.document:
+        return InputMediaDocument(msg.document.file_id, **kwargs)
+    if msg.audio:
+        return InputMediaAudio(msg.audio.file_id, **kwargs)
+    return None
+
+
+def queue_album_item(sender_id: int, partner_id: int, media_group_id: str, item):
+    """Album items arrive as separate updates; collect them for ALBUM_WAIT and send one media group."""
+    key = (sender_id, media_group_id)
+    album = pending_albums.get(key)
+    if album is None:
+        album = pending_albums[key] = []
+        asyncio.get_running_loop().call_later(ALBUM_WAIT, flush_album, key, partner_id)
+    album.append(item)
+
+
+def flush_album(key: tuple, partner_id: int):
+    media = pending_albums.pop(key, None)
+    u = users.get(key[0])
+    if media and u is not None and u.partner == partner_id:  # dropped if the chat ended meanwhile
+        outbox.call(partner_id, "send_media_group", media=media)
+
+
+def log_relay(sender_id: int, partner_id: int, entry: str, delivered: bool):
+    """Relay bookkeeping: chat log, pair activity and (if the message went through) analytics."""
+    save_chat(sender_id, partner_id, entry)
+    key = pair_key(sender_id, partner_id)
+    if key in pair_activity:
+        # only pairs this worker matched have a reaper timer; the others' activity is the Redis chat TTL
+        pair_activity[key] = time.monotonic()
+    if delivered:
+        analytics.relay(key)
+
+
 async def relay_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    ensure_user(user_id)
-    partner_id = users[user_id].get("partner")
+    u = await shared_call(get_user, user_id)
+    partner_id = u.partner if u else None
 
     if partner_id:
-        msg = update.message.text
-        save_chat(user_id, "user", msg)
-        save_chat(partner_id, "partner", msg)
-        try:
-            await context.bot.send_message(chat_id=partner_id, text=msg)
-        except Exception as e:
-            print(f"ERROR sending relayed message: {e}")
+        msg = update.message
+        text = msg.text if msg.text is not None else msg.caption
+        pattern = moderation.check(text) if text else None
+        blocked = pattern is not None and MODERATION_BLOCK
+        # not awaited: with shared state the chat log write is queued, the message goes out meanwhile
+        shared_post(log_relay, user_id, partner_id, chat_log_entry(msg), not blocked)
+        if pattern is not None:
+            flag_message(user_id, partner_id, pattern, text)
+            if blocked:  # still in the chat log above, so a /report shows it too
+                await safe_reply(update, "⚠️ Pesan tidak diteruskan karena mengandung kata/tautan yang dilarang.")
+                return
+        item = album_item(msg) if msg.text is None and msg.media_group_id else None
+        if msg.text is not None:
+            outbox.send(partner_id, msg.text)
+        elif item is not None:
+            queue_album_item(user_id, partner_id, msg.media_group_id, item)
+        else:
+            # media goes by reference: Telegram copies it server side, nothing passes through us
+            outbox.call(partner_id, "copy_message", from_chat_id=user_id, message_id=msg.message_id)
+        metrics.inc("bot_relay_messages_total")
     else:
         await safe_reply(update, "⚠️ Kamu tidak sedang dalam percakapan anonim.")
 
 
+# ---------------------------
+# Filter pencarian (usia / kampus)
+# ---------------------------
+async def filter_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/filter usia 19-22 | /filter kampus unnes|nonunnes|semua | /filter reset"""
+    user_id = update.effective_user.id
+    prefs = user_filters.get(user_id, DEFAULT_PREFS)
+    args = [a.lower() for a in context.args or []]
+
+    if args == ["reset"]:
+        user_filters.pop(user_id, None)
+        prefs = DEFAULT_PREFS
+    elif len(args) == 2 and args[0] == "usia":
+        low, _, high = args[1].partition("-")
+        if not (low.isdigit() and high.isdigit() and AGE_MIN <= int(low) <= int(high) <= AGE_MAX):
+            await safe_reply(update, f"⚠️ Format usia: /filter usia 19-22 (antara {AGE_MIN}–{AGE_MAX}).")
+            return
+        prefs = user_filters[user_id] = replace(prefs, age_min=int(low), age_max=int(high))
+    elif len(args) == 2 and args[0] == "kampus":
+        choices = {"unnes": University.UNNES, "nonunnes": University.NON_UNNES, "semua": None}
+        if args[1] not in choices:
+            await safe_reply(update, "⚠️ Pilihan kampus: unnes, nonunnes, semua.")
+            return
+        prefs = user_filters[user_id] = replace(prefs, university=choices[args[1]])
+    elif args:
+        await safe_reply(update, "⚠️ Gunakan: /filter usia 19-22, /filter kampus unnes|nonunnes|semua, /filter reset")
+        return
+
+    teks = (
+        "⚙️ Filter pencarian kamu:\n"
+        f"🎂 Usia: {prefs.age_min}–{prefs.age_max}\n"
+        f"🏫 Kampus: {prefs.university or 'Semua'}\n\n"
+        f"Filter dilonggarkan otomatis jika belum dapat partner setelah {MATCH_WIDEN_AFTER:.0f} detik.\n"
+        "Ubah: /filter usia 19-22 | /filter kampus unnes|nonunnes|semua | /filter reset"
+    )
+    await safe_reply(update, teks)
+
+
 # ---------------------------
 # Utility commands
 # ---------------------------
@@ -622,68 +3585,768 @@ async def online_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show count or details of users currently searching.
        For regular users show counts only; for admin show details."""
     user_id = update.effective_user.id
-    total_verified = sum(1 for u in users.values() if u.get("verified") and not u.get("banned"))
-    searching_verified = [uid for uid, u in users.items() if u.get("searching") and u.get("verified") and not u.get("banned")]
+    total_verified, searching = await shared_call(stats.counts)
+
+    if STATS_SELF_CHECK:
+        for problem in await shared_call(check_stats):
+            print(f"ERROR stats mismatch: {problem}")
 
     if user_id in ADMIN_IDS:
+        searching_verified = await shared_call(list, search_pool)
         if not searching_verified:
             await safe_reply(update, "📭 Tidak ada user terverifikasi yang sedang mencari partner.")
             return
         teks = "🟢 User terverifikasi yang sedang mencari:\n\n"
-        for uid in searching_verified:
-            u = users[uid]
-            teks += f"- `{uid}` | {u.get('gender') or '?'} | {u.get('age') or '?'} tahun\n"
+        for uid, u in zip(searching_verified, await shared_call(get_users, searching_verified)):
+            teks += f"- `{uid}` | {u.gender or '?'} | {u.age or '?'} tahun\n"
         teks += f"\n👥 Total verified: {total_verified}\n🟢 Sedang mencari: {len(searching_verified)}"
+        m = outbox.metrics()
+        teks += f"\n📤 Antrian kirim: {m['depth']} (rata-rata {m['latency_avg'] * 1000:.0f} ms)"
         await safe_reply(update, teks, parse_mode="Markdown")
     else:
-        teks = f"👥 User terverifikasi: {total_verified}\n🟢 Sedang online/mencari: {len(searching_verified)}"
+        teks = f"👥 User terverifikasi: {total_verified}\n🟢 Sedang online/mencari: {searching}"
         await safe_reply(update, teks)
 
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: match rate per hour, wait times per gender/university, conversation length."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_reply(update, "❌ Kamu bukan admin.")
+        return
+    await safe_reply(update, render_stats())
+
+
+# ---------------------------
+# Anti-spam: per-user rate limit, runs in handler group -1 before everything else
+# ---------------------------
+class RateLimiter:
+    """
+    One TokenBucket per (user, update kind) in a bounded LRU, so memory
+    stays constant however many users show up. Dropped updates are
+    counted per user in fixed SPAM_WINDOW windows to spot repeat offenders.
+    """
+
+    def __init__(self, limits: dict, max_users: int = RATE_LIMIT_MAX_USERS):
+        self.limits = limits
+        self.max_users = max_users
+        self._buckets = OrderedDict()  # (user_id, kind) -> TokenBucket, least recently used first
+        self._strikes = OrderedDict()  # user_id -> [window start, drops in window]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, user_id: int, kind: str) -> bool:
+        key = (user_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits[kind])
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return not bucket.delay()
+
+    def strike(self, user_id: int, now: Optional[float] = None) -> int:
+        """Count one dropped update; returns the user's drops in the current window."""
+        now = time.monotonic() if now is None else now
+        entry = self._strikes.get(user_id)
+        if entry is None or now - entry[0] > SPAM_WINDOW:
+            self._strikes.pop(user_id, None)
+            entry = self._strikes[user_id] = [now, 0]
+            if len(self._strikes) > self.max_users:
+                self._strikes.popitem(last=False)
+        entry[1] += 1
+        return entry[1]
+
+
+limiter = RateLimiter(RATE_LIMITS)
+
+
+def rate_kind(update) -> Optional[str]:
+    """Which bucket an update draws from (None = not limited)."""
+    if update.callback_query:
+        return "button"
+    message = update.message
+    if message is None:
+        return None
+    text = message.text or ""
+    if text.startswith("/report"):
+        return "report"
+    if text.startswith("/"):
+        return "command"
+    return "message"
+
+
+async def rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop updates over the sender's rate before any handler (and its API calls) runs."""
+    user = update.effective_user
+    if user is None or user.id in ADMIN_IDS:
+        return
+    kind = rate_kind(update)
+    if kind is None or limiter.allow(user.id, kind):
+        return
+    metrics.inc("bot_rate_limited_total", f'kind="{kind}"')
+    drops = limiter.strike(user.id)
+    if drops == 1:  # one warning per window, not one per dropped update
+        outbox.send(user.id, "⚠️ Pelan-pelan ya, kamu mengirim terlalu cepat. Sebagian pesan tidak diteruskan.")
+    if drops == SPAM_REPORT_DROPS:
+        keyboard = [[InlineKeyboardButton("🚫 Ban User", callback_data=f"ban_{user.id}")]]
+        notify_admins(
+            f"🚨 SPAM: user {user.id} sudah {drops} kali melewati batas dalam {SPAM_WINDOW / 60:.0f} menit "
+            f"(terakhir: {kind}).",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+    raise ApplicationHandlerStop
+
+
+# ---------------------------
+# Concurrent update processing, ordered per user
+# ---------------------------
+def update_key(update) -> Optional[int]:
+    """Ordering key for an update: the sending user (or chat for user-less updates)."""
+    user = getattr(update, "effective_user", None)
+    if user:
+        return user.id
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat else None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates from different users concurrently, but each user's
+    updates strictly in arrival order (one mailbox per user, drained by
+    whichever task got there first). Keeps ConversationHandler state and
+    partner pairing free of same-user races.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._mailboxes = {}  # key -> deque of pending coroutines
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        event_actor.set(key)  # this task's context only; attributes journaled transitions
+        if key is None:
+            await coroutine
+            return
+        mailbox = self._mailboxes.get(key)
+        if mailbox is not None:
+            # an earlier update of this user is running; its task awaits ours next
+            mailbox.append(coroutine)
+            return
+        mailbox = self._mailboxes[key] = deque([coroutine])
+        try:
+            while mailbox:
+                try:
+                    await mailbox.popleft()
+                except Exception as e:
+                    print(f"ERROR processing update for {key}: {e}")
+        finally:
+            del self._mailboxes[key]
+            for leftover in mailbox:
+                leftover.close()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# ---------------------------
+# Conversation state persistence (registration flow)
+# ---------------------------
+class StatePersistence(BasePersistence):
+    """
+    Bounded, TTL-evicting persistence for ConversationHandler states.
+    Only the last-touched time of each entry is kept in memory; values go to the
+    conversation_state table of the SQLite db (path "" = nothing survives a restart).
+    PTB hands over changes every update_interval seconds and each round is
+    written in one transaction from a worker thread. The bot keeps nothing in
+    user_data/chat_data/bot_data, so none of them are stored: PTB would create
+    an empty user_data dict for every sender just to hand it over.
+    """
+
+    def __init__(self, path: str = "", ttl: float = CONV_STATE_TTL, max_entries: int = CONV_STATE_MAX,
+                 update_interval: float = CONV_STATE_FLUSH):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evicted = 0  # dropped for max_entries, not for age
+        self._overflow = []  # (name, key) evicted for max_entries, handed to the next expire()
+        self._touched = OrderedDict()  # (name, key) -> unix time of the last change, oldest first
+        self._dirty = {}  # (name, key) -> new value, None = delete
+        self._write_task = None
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_state ("
+                "name TEXT, key TEXT, value BLOB, touched REAL, PRIMARY KEY (name, key))"
+            )
+        self._loaded = None  # name -> {key: value}, read once on the first get_*()
+
+    @property
+    def entries(self) -> int:
+        """Conversations currently tracked (a __len__ would make an empty store falsy to PTB)."""
+        return len(self._touched)
+
+    @staticmethod
+    def _key_text(key: tuple) -> str:
+        return ":".join(map(str, key))
+
+    @staticmethod
+    def _text_key(text: str) -> tuple:
+        return tuple(map(int, text.split(":")))
+
+    # --- reads: once at startup, entries older than ttl are dropped instead of loaded ---
+    def _load(self) -> dict:
+        loaded = {}
+        if not self._conn:
+            return loaded
+        cutoff = time.time() - self.ttl
+        # name "" = user_data rows written by earlier versions
+        self._conn.execute("DELETE FROM conversation_state WHERE touched < ? OR name = ''", (cutoff,))
+        rows = self._conn.execute("SELECT name, key, value, touched FROM conversation_state ORDER BY touched").fetchall()
+        for name, text, value, touched in rows[-self.max_entries:]:
+            key = self._text_key(text)
+            try:
+                loaded.setdefault(name, {})[key] = marshal.loads(value)
+            except (EOFError, ValueError, TypeError):
+                continue
+            self._touched[name, key] = touched
+        return loaded
+
+    async def _get(self, name: str) -> dict:
+        if self._loaded is None:
+            self._loaded = await asyncio.to_thread(self._load)
+        return self._loaded.pop(name, {})
+
+    async def get_conversations(self, name: str) -> dict:
+        return await self._get(name)
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- writes: remember the change, write the whole round once PTB is done handing it over ---
+    def _set(self, name: str, key, value):
+        entry = (name, key)
+        now = time.time()
+        if value is None:
+            self._touched.pop(entry, None)
+        else:
+            self._touched[entry] = now
+            self._touched.move_to_end(entry)
+            while len(self._touched) > self.max_entries:
+                oldest = self._touched.popitem(last=False)[0]
+                self._drop(oldest)
+                self._overflow.append(oldest)
+                self.evicted += 1
+        if self._conn:
+            self._dirty[entry] = None if value is None else (value, now)
+            self._schedule_write()
+
+    def _drop(self, entry):
+        if self._conn:
+            self._dirty[entry] = None
+
+    def _schedule_write(self):
+        if self._write_task is None and self._dirty:
+            # PTB gathers all update_*() calls of a round; they are queued ahead of this task
+            self._write_task = asyncio.get_running_loop().create_task(self._write_round())
+
+    async def _write_round(self):
+        try:
+            await asyncio.to_thread(self._write, self._swap_dirty())
+        except sqlite3.Error as e:
+            print(f"ERROR writing conversation state: {e}")
+        finally:
+            self._write_task = None
+            self._schedule_write()
+
+    def _swap_dirty(self) -> dict:
+        dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def _write(self, dirty: dict):
+        upserts, deletes = [], []
+        for (name, key), change in dirty.items():
+            text = self._key_text(key)
+            if change is None:
+                deletes.append((name, text))
+                continue
+            value, touched = change
+            try:
+                upserts.append((name, text, marshal.dumps(value), touched))
+            except ValueError:
+                print(f"ERROR conversation state {name}[{text}] cannot be stored")
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM conversation_state WHERE name = ? AND key = ?", deletes)
+            self._conn.executemany("INSERT OR REPLACE INTO conversation_state VALUES (?, ?, ?, ?)", upserts)
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._set(name, key, new_state)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    def expire(self, now: Optional[float] = None) -> list:
+        """Forget entries untouched for ttl seconds; returns the (name, key) pairs dropped since the last call."""
+        cutoff = (time.time() if now is None else now) - self.ttl
+        expired, self._overflow = self._overflow, []
+        while self._touched:
+            entry, touched = next(iter(self._touched.items()))
+            if touched > cutoff:
+                break
+            del self._touched[entry]
+            self._drop(entry)
+            expired.append(entry)
+        if self._conn:
+            self._schedule_write()
+        return expired
+
+    async def flush(self) -> None:
+        """
+        Called by Application.shutdown() (after post_stop, before post_shutdown) right after its
+        final update_persistence(): write what is left and close.
+        """
+        if self._write_task is not None:
+            await self._write_task
+        if self._conn:
+            if self._dirty:
+                await asyncio.to_thread(self._write, self._swap_dirty())
+            self._conn.close()
+            self._conn = None
+
+
+class RegistrationHandler(ConversationHandler):
+    """ConversationHandler whose states can be dropped from outside (expired in StatePersistence)."""
+
+    __slots__ = ()
+
+    def forget(self, key) -> bool:
+        # a tracked pop: the next update_persistence() round deletes it from the store as well
+        return self._conversations.pop(key, None) is not None
+
+
+async def expire_conversation_state(app):
+    """
+    Drop expired or evicted registrations from their RegistrationHandler too,
+    not only from the store. A user whose registration expired has to /start again.
+    """
+    handlers = {h.name: h for group in app.handlers.values() for h in group if isinstance(h, RegistrationHandler)}
+    for name, key in app.persistence.expire():
+        if name in handlers:
+            handlers[name].forget(key)
+
+
+# ---------------------------
+# /metrics endpoint + periodic metrics log
+# ---------------------------
+metrics_server = None  # asyncio server for /metrics, started in on_startup()
+_metrics_last = {"t": time.monotonic(), "relay": 0, "handlers": {}}  # state at the previous log line
+
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Minimal HTTP/1.1: GET /metrics returns metrics.render(), anything else 404."""
+    try:
+        parts = (await reader.readline()).split()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # headers are not needed
+        if len(parts) > 1 and parts[1].split(b"?")[0] == b"/metrics":
+            # the pool size is a Redis round trip with shared state
+            status, body = "200 OK", metrics.render(await shared_call(metrics.read_gauges)).encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def metrics_log_line(gauges: Optional[dict] = None) -> dict:
+    """Rates and per-handler latency over the window since the previous call (+ gauges, read if not given)."""
+    now = time.monotonic()
+    elapsed = max(now - _metrics_last["t"], 1e-9)
+    relay = metrics.counters.get(("bot_relay_messages_total", ""), 0)
+    handlers = {}
+    for (name, labels), h in metrics.histograms.items():
+        if name != "bot_handler_seconds":
+            continue
+        window = h.since(_metrics_last["handlers"].get(labels, [0] * len(h.counts)))
+        _metrics_last["handlers"][labels] = list(h.counts)
+        if window.count:
+            handlers[labels.split('"')[1]] = {
+                "n": window.count,
+                "p50_ms": window.quantile(0.5) * 1000,
+                "p99_ms": window.quantile(0.99) * 1000,
+            }
+    line = {
+        "event": "metrics",
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "relay_per_s": round((relay - _metrics_last["relay"]) / elapsed, 2),
+        "handler_errors": sum(v for (name, _), v in metrics.counters.items() if name == "bot_handler_errors_total"),
+        "api_errors": sum(v for (name, _), v in metrics.counters.items() if name == "bot_telegram_api_errors_total"),
+        "handlers": handlers,
+    }
+    for name, value in (metrics.read_gauges() if gauges is None else gauges).items():
+        line[name.removeprefix("bot_")] = value
+    _metrics_last["t"], _metrics_last["relay"] = now, relay
+    return line
+
+
+async def log_metrics():
+    try:
+        print(json.dumps(metrics_log_line(await shared_call(metrics.read_gauges))))
+    except Exception as e:  # a Redis hiccup must not end the job
+        print(f"ERROR logging metrics: {e}")
+
+
 # ---------------------------
 # Main: register handlers and run
 # ---------------------------
-def main():
-    TOKEN = os.getenv("BOT_TOKEN")
-    if not TOKEN:
-        raise RuntimeError("BOT_TOKEN environment variable is not set.")
+background_tasks = []
+boot_started = None  # monotonic time main() began; restart-to-ready is measured from here
+boot_phases = []  # (phase, monotonic time it ended) during startup, shown on the ready line
+
+
+def run_every(app, interval: float, callback):
+    """Run callback() every interval seconds on the JobQueue (plain asyncio task if it is unavailable)."""
+    job_queue = getattr(app, "job_queue", None)
+    if job_queue is not None:
+        async def job(context):
+            await callback()
+
+        job_queue.run_repeating(job, interval=interval, first=interval, name=callback.__name__)
+        return
+
+    async def loop():
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await callback()
+            except Exception as e:
+                print(f"ERROR in {callback.__name__}: {e}")
+
+    background_tasks.append(asyncio.create_task(loop()))
+
+
+async def on_startup(app):
+    global metrics_server
+    boot_phases.append(("connect", time.monotonic()))  # initialize(): HTTP clients + getMe
+    if CHECKPOINT_PATH:
+        restored = restore_checkpoint()
+        if restored:
+            print(f"♻️ Checkpoint: {restored['pairs']} pasangan, {restored['searching']} mencari, "
+                  f"{restored['messages']} pesan tertunda, {restored['pending']} menunggu verifikasi dipulihkan")
+    boot_phases.append(("checkpoint", time.monotonic()))
+    outbox.start(app.bot)
+    bulk.start()
+    if METRICS_PORT:
+        try:
+            metrics_server = await asyncio.start_server(serve_metrics, METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print(f"ERROR starting /metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    if METRICS_LOG_INTERVAL > 0:
+        run_every(app, METRICS_LOG_INTERVAL, log_metrics)
+    if VERIFY_DIGEST_INTERVAL > 0:
+        run_every(app, VERIFY_DIGEST_INTERVAL, send_verification_digest)
+    run_every(app, MATCH_WIDEN_INTERVAL, widen_searches)
+    run_every(app, REAPER_INTERVAL, reap_expired_job)
+    if moderation.path:
+        # compiled off the event loop; messages relayed before it finishes are not checked yet
+        background_tasks.append(asyncio.create_task(moderation.reload()))
+        run_every(app, MODERATION_RELOAD, moderation.reload_if_changed)
+    if isinstance(getattr(app, "persistence", None), StatePersistence):  # benches pass a bare namespace
+        async def expire_state():
+            await expire_conversation_state(app)
 
-    app = ApplicationBuilder().token(TOKEN).build()
+        run_every(app, REAPER_INTERVAL, expire_state)
+    if boot_started is not None:
+        now = time.monotonic()
+        ready = now - boot_started
+        metrics.gauge("bot_ready_seconds", lambda: ready)
+        marks = [("", boot_started)] + boot_phases + [("jobs", now)]
+        phases = ", ".join(f"{name} {end - start:.2f}" for (_, start), (name, end) in zip(marks, marks[1:]))
+        print(f"✅ Siap dalam {ready:.2f} detik ({phases})")
+        if ready > READY_TARGET:
+            print(f"ERROR restart-to-ready {ready:.2f}s melebihi target {READY_TARGET:.0f}s")
 
+
+async def on_shutdown(app):
+    """Runs once polling/webhook stopped and running handlers and jobs finished (SIGTERM, SIGINT, stop_running())."""
+    started = time.monotonic()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    for key in list(pending_albums):  # don't make half-collected albums wait for a timer that won't fire
+        u = users.get(key[0])
+        flush_album(key, u.partner if u else None)
+    if not (CHECKPOINT_PATH or event_log or shared_state()):
+        # nothing will bring the chats back: tell everyone still paired or searching
+        text = "⚠️ Bot sedang restart, percakapan/pencarian kamu berakhir. Gunakan /start untuk mulai lagi."
+        for user_id in [uid for pair in pair_activity for uid in pair] + list(search_pool):
+            outbox.send(user_id, text)
+    await bulk.stop()  # what it still holds goes into the checkpoint, not into the drain
+    await outbox.stop(SHUTDOWN_DRAIN_TIMEOUT)
+    await shared_call(lambda: None)  # writes still queued by shared_post() land before storage closes
+    if CHECKPOINT_PATH:
+        try:
+            saved = write_checkpoint()
+            print(f"💾 Checkpoint: {saved['pairs']} pasangan, {saved['searching']} mencari, "
+                  f"{saved['messages']} pesan tertunda, {saved['pending']} menunggu verifikasi disimpan "
+                  f"({saved['dropped']} tidak bisa disimpan)")
+        except Exception as e:  # the rest of the shutdown (snapshot, metrics server) must still run
+            print(f"ERROR writing checkpoint {CHECKPOINT_PATH}: {e}")
+    if event_log:
+        await asyncio.to_thread(event_log.snapshot)  # next start replays nothing
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    print(f"👋 Shutdown selesai dalam {time.monotonic() - started:.2f} detik")
+
+
+def build_application(token: str, base_url: Optional[str] = None):
+    """Build the Application with every handler registered (shared by main() and bench.py)."""
+    tls = not (base_url or "").startswith("http://")
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .request(TimedRequest(connection_pool_size=256, tls=tls))  # same pool size as PTB's default
+        .get_updates_request(SharedSSLRequest(tls=tls))  # pool of 1 like PTB's default; getUpdates stays untimed
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_stop(on_shutdown)  # not post_shutdown: by then the bot's HTTP client is closed and nothing can be sent
+        # registration state survives restarts next to the users table (in-memory only with Redis or no db)
+        .persistence(StatePersistence(storage.path if isinstance(storage, Storage) else "",
+                                      CONV_STATE_TTL, CONV_STATE_MAX, CONV_STATE_FLUSH))
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+
+    # Rate limit first: group -1 runs before the default group and stops the update when over the limit.
+    # Not timed(): ApplicationHandlerStop would count as a handler error.
+    app.add_handler(TypeHandler(Update, rate_limit), group=-1)
+
+    # Every callback is wrapped in timed() for the handler latency/error metrics
     # Conversation for registration
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+    # abandoned registrations end after CONV_STATE_TTL; "ubah_profil" (re)enters from the menu, even mid-registration
+    conv_handler = RegistrationHandler(
+        entry_points=[
+            CommandHandler("start", timed(start)),
+            CallbackQueryHandler(timed(ubah_profil), pattern="^ubah_profil$"),
+        ],
         states={
-            UNIVERSITY: [CallbackQueryHandler(handle_university, pattern="^(unnes|nonunnes)$")],
-            GENDER: [CallbackQueryHandler(handle_gender, pattern="^(male|female)$")],
-            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_age)],
+            UNIVERSITY: [CallbackQueryHandler(timed(handle_university), pattern="^(unnes|nonunnes)$")],
+            GENDER: [CallbackQueryHandler(timed(handle_gender), pattern="^(male|female)$")],
+            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed(handle_age))],
         },
-        fallbacks=[CommandHandler("start", start)],
+        fallbacks=[CommandHandler("start", timed(start))],
         per_message=False,
+        allow_reentry=True,
+        name="registration",
+        persistent=True,
     )
 
     # Add handlers
     app.add_handler(conv_handler)
-    app.add_handler(CommandHandler("profil", profil))
-    app.add_handler(CommandHandler("stop", stop))
-    app.add_handler(CommandHandler("report", report))
-    app.add_handler(CommandHandler("ban", ban_command))
-    app.add_handler(CommandHandler("unban", unban_command))
-    app.add_handler(CommandHandler("adminpanel", admin_panel))
-    app.add_handler(CommandHandler("myid", myid))
-    app.add_handler(CommandHandler("online", online_cmd))
+    app.add_handler(CommandHandler("profil", timed(profil)))
+    app.add_handler(CommandHandler("stop", timed(stop)))
+    app.add_handler(CommandHandler("report", timed(report)))
+    app.add_handler(CommandHandler("ban", timed(ban_command)))
+    app.add_handler(CommandHandler("unban", timed(unban_command)))
+    app.add_handler(CommandHandler("audit", timed(audit_command)))
+    app.add_handler(CommandHandler("approveall", timed(approveall_command)))
+    app.add_handler(CommandHandler("banlist", timed(banlist_command)))
+    app.add_handler(CommandHandler("export", timed(export_command)))
+    app.add_handler(CommandHandler("import", timed(import_command)))
+    app.add_handler(CommandHandler("adminpanel", timed(admin_panel)))
+    app.add_handler(CommandHandler("myid", timed(myid)))
+    app.add_handler(CommandHandler("online", timed(online_cmd)))
+    app.add_handler(CommandHandler("stats", timed(stats_command)))
+    app.add_handler(CommandHandler("moderasi", timed(moderasi_command)))
+    app.add_handler(CommandHandler("filter", timed(filter_cmd)))
 
     # Callbacks
-    app.add_handler(CallbackQueryHandler(admin_action_handler, pattern="^(approve|reject|ban|unban)_"))
-    app.add_handler(CallbackQueryHandler(admin_panel_handler, pattern="^(list_users|list_verified|list_unverified|list_banned)$"))
-    app.add_handler(CallbackQueryHandler(admin_detail_handler, pattern="^detail_"))
-    app.add_handler(CallbackQueryHandler(button_handler))  # catch-all for menu buttons
+    app.add_handler(CallbackQueryHandler(timed(admin_action_handler), pattern="^(approve|reject|ban|unban)_"))
+    app.add_handler(CallbackQueryHandler(timed(admin_panel_handler), pattern=r"^(list_users|list_verified|list_unverified|list_banned)(:\d+)?$"))
+    app.add_handler(CallbackQueryHandler(timed(admin_detail_handler), pattern="^detail_"))
+    app.add_handler(CallbackQueryHandler(timed(digest_handler), pattern=r"^digest:\d+$"))
+    app.add_handler(CallbackQueryHandler(timed(button_handler)))  # catch-all for menu buttons
+
+    # Relay chat messages: text, media, stickers, voice... (new messages only, not edits)
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & ~filters.COMMAND, timed(relay_message)))
+    return app
+
+
+def check_config() -> list:
+    """
+    Problems in the configuration, found without connecting to Telegram or
+    Redis (python -m main --check, e.g. as a release step before a deploy).
+    """
+    problems = []
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        problems.append("BOT_TOKEN belum diisi")
+    elif not re.fullmatch(r"\d+:[\w-]+", token):
+        problems.append("BOT_TOKEN harus berformat <angka>:<rahasia>")
+    if not ADMIN_IDS:
+        problems.append("ADMIN_IDS kosong: tidak ada yang bisa memverifikasi user")
+    if MATCH_MODE not in ("random", "fifo"):
+        problems.append(f"MATCH_MODE={MATCH_MODE!r}, harus random atau fifo")
+
+    positive = {
+        "SEND_GLOBAL_RATE": SEND_GLOBAL_RATE, "SEND_CHAT_RATE": SEND_CHAT_RATE, "SEND_CHAT_BURST": SEND_CHAT_BURST,
+        "SEND_WORKERS": SEND_WORKERS, "CONCURRENT_UPDATES": CONCURRENT_UPDATES, "BULK_SEND_RATE": BULK_SEND_RATE,
+        "SEARCH_TTL": SEARCH_TTL, "PAIR_IDLE_TTL": PAIR_IDLE_TTL, "CONV_STATE_TTL": CONV_STATE_TTL,
+        "CONV_STATE_MAX": CONV_STATE_MAX, "CONV_STATE_FLUSH": CONV_STATE_FLUSH, "SNAPSHOT_EVERY": SNAPSHOT_EVERY,
+    }
+    for kind, (rate, burst) in RATE_LIMITS.items():
+        positive[f"rate limit {kind}"] = min(rate, burst)
+    problems += [f"{name} harus > 0" for name, value in positive.items() if value <= 0]
+    if BULK_SEND_RATE >= SEND_GLOBAL_RATE:
+        problems.append("BULK_SEND_RATE harus di bawah SEND_GLOBAL_RATE, kalau tidak chat biasa ikut antri")
+    if not 0 <= METRICS_PORT <= 65535:
+        problems.append(f"METRICS_PORT={METRICS_PORT} di luar 0-65535")
+
+    if WEBHOOK_URL:
+        if not WEBHOOK_URL.startswith("https://"):
+            problems.append("WEBHOOK_URL harus https:// (syarat Telegram)")
+        if not 1 <= WEBHOOK_PORT <= 65535:
+            problems.append(f"PORT={WEBHOOK_PORT} di luar 1-65535")
+        if WEBHOOK_SECRET and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+            problems.append("WEBHOOK_SECRET hanya boleh A-Z, a-z, 0-9, _ dan -, maks 256 karakter")
+    elif REDIS_URL:
+        problems.append("REDIS_URL butuh WEBHOOK_URL: Telegram hanya mengizinkan satu getUpdates poller")
+    if BOT_API_URL and not re.fullmatch(r"https?://[^/]+/.*bot", BOT_API_URL):
+        problems.append("BOT_API_URL harus berformat http(s)://host:port/bot")
+
+    if REDIS_URL:
+        if not REDIS_URL.startswith(("redis://", "rediss://", "unix://")):
+            problems.append("REDIS_URL harus redis://, rediss:// atau unix://")
+        if importlib.util.find_spec("redis") is None:
+            problems.append("REDIS_URL diisi tapi paket redis belum terpasang")
+    else:
+        if DB_PATH:
+            if os.path.exists(DB_PATH):
+                try:
+                    with sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True) as conn:
+                        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                except sqlite3.Error as e:
+                    problems.append(f"DB_PATH={DB_PATH}: {e}")
+        for name, path in (("DB_PATH", DB_PATH), ("EVENT_LOG_DIR", EVENT_LOG_DIR), ("CHECKPOINT_PATH", CHECKPOINT_PATH)):
+            folder = path if name == "EVENT_LOG_DIR" and os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+            if path and not os.access(folder, os.W_OK):
+                problems.append(f"{name}={path}: folder {folder} tidak bisa ditulis")
 
-    # Relay chat messages
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, relay_message))
+    if MODERATION_PATH and os.path.exists(MODERATION_PATH):
+        try:
+            with open(MODERATION_PATH, encoding="utf-8") as f:
+                ModerationFilter.compile(parse_patterns(f))
+        except (OSError, UnicodeDecodeError, re.error) as e:
+            problems.append(f"MODERATION_PATH={MODERATION_PATH}: {e}")
+
+    try:
+        build_application(token or "0:check", BOT_API_URL)  # handler wiring only, nothing connects
+    except Exception as e:
+        problems.append(f"build_application gagal: {type(e).__name__}: {e}")
+    return problems
+
+
+def main():
+    global boot_started
+    boot_started = time.monotonic()
+    if "--check" in sys.argv[1:]:
+        problems = check_config()
+        for problem in problems:
+            print(f"ERROR config: {problem}")
+        if not problems:
+            print(f"✅ Konfigurasi OK ({time.monotonic() - boot_started:.2f} detik)")
+        sys.exit(1 if problems else 0)
+
+    TOKEN = os.getenv("BOT_TOKEN")
+    if not TOKEN:
+        raise RuntimeError("BOT_TOKEN environment variable is not set.")
+
+    if REDIS_URL:
+        # several workers need webhook mode behind one URL; Telegram allows only one getUpdates poller
+        import redis  # optional dependency, only needed for shared state
+
+        init_shared_state(redis.Redis.from_url(REDIS_URL, decode_responses=True))
+    else:
+        init_storage()
+        init_event_log()
+    boot_phases.append(("state", time.monotonic()))
+    app = build_application(TOKEN, BOT_API_URL)
+    boot_phases.append(("build", time.monotonic()))
 
-    print("🤖 Bot is running...")
-    app.run_polling()
+    # run_polling/run_webhook stop on SIGTERM (Heroku restart) and SIGINT; on_shutdown then drains the
+    # outbox and writes the checkpoint. Updates that arrive while down are kept by Telegram and handled
+    # after the restart (pending updates are not dropped).
+    try:
+        if WEBHOOK_URL:
+            print(f"🤖 Bot is running (webhook on port {WEBHOOK_PORT})...")
+            app.run_webhook(
+                listen="0.0.0.0",
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            )
+        else:
+            print("🤖 Bot is running...")
+            app.run_polling()
+    finally:
+        if event_log:
+            event_log.close()
+        if storage:
+            storage.close()
 
 
 if __name__ == "__main__":